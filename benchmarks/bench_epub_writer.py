@@ -0,0 +1,142 @@
+"""
+EPUB writer benchmark.
+
+Builds the same synthetic book with the ebooklib writer and the streaming writer, each in its own
+process, reports their peak memory usage, build time and size, and checks that both books have the
+same content. The book is also built as ebooklib writes it by default, indented pages and all, for
+reference, and its files are compressed with each compression level to compare their sizes.
+
+    python -m benchmarks.bench_epub_writer [-n 5000]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import zlib
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from zipfile import ZipFile
+
+from ebooklib.epub import EpubHtml
+
+from shamela2epub.misc.utils import get_peak_memory
+from shamela2epub.models import epub_book
+from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.epub_book import EPUBBook
+from shamela2epub.models.epub_stream_writer import COMPRESSION_LEVEL
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+BOOK_URL = "https://shamela.ws/book/823"
+BACKENDS = ("reference", "ebooklib", "stream")
+# Book files that have a random identifier or a timestamp
+VOLATILE_FILES = ("EPUB/content.opf", "EPUB/toc.ncx")
+
+
+def build_book(path: Path, pages: int, stream: bool) -> float:
+    start = perf_counter()
+    epub_book = EPUBBook()
+    epub_book.init()
+    epub_book.create_info_page(BookInfoHTMLPage(BOOK_URL, (FIXTURES_DIR / "info.html").read_text()))
+    if stream:
+        epub_book.stream_to(path)
+    first_page = BookHTMLPage(f"{BOOK_URL}/1", (FIXTURES_DIR / "page_footnotes.html").read_text())
+    epub_book.set_page_count(str(pages))
+    epub_book.set_parts_map(first_page.parts_map)
+    epub_book.set_toc(first_page.toc)
+    epub_book.set_chapter_index(first_page.chapter_index)
+    book_page = first_page.to_book_page()
+    for page_number in range(1, pages + 1):
+        epub_book.add_page(
+            replace(book_page, url=f"{BOOK_URL}/{page_number}", current_page=str(page_number))
+        )
+    epub_book.generate_toc()
+    epub_book.save_book(str(path))
+    return perf_counter() - start
+
+
+def run_backend(backend: str, path: Path, pages: int) -> dict[str, float | None]:
+    output = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_epub_writer",
+            "--backend",
+            backend,
+            "-n",
+            str(pages),
+            "-o",
+            path,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def read_book(path: Path) -> dict[str, bytes]:
+    with ZipFile(path) as book:
+        return {name: book.read(name) for name in book.namelist() if name not in VOLATILE_FILES}
+
+
+def compare_compression_levels(path: Path) -> None:
+    files = list(read_book(path).values())
+    print(f"\n{'level':<12}{'compress s':>12}{'size KiB':>10}")
+    for level in range(1, 10):
+        start = perf_counter()
+        size = 0
+        for data in files:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            size += len(compressor.compress(data) + compressor.flush())
+        selected = " (selected)" if level == COMPRESSION_LEVEL else ""
+        print(f"{level:<12}{perf_counter() - start:>12.2f}{size / 1024:>10.0f}{selected}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    # The fixture book TOC links pages up to page 280
+    parser.add_argument("-n", "--pages", type=int, default=5000)
+    parser.add_argument("--backend", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("-o", "--output", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.backend:
+        if args.backend == "reference":
+            # Pages XHTML and writer options as ebooklib has them by default
+            epub_book.EPUBPage = EpubHtml
+            epub_book.WRITER_OPTIONS = {}
+        seconds = build_book(args.output, args.pages, args.backend == "stream")
+        print(json.dumps({"seconds": seconds, "peak_memory": get_peak_memory()}))
+        return
+    print(f"{'backend':<12}{'pages':>8}{'seconds':>10}{'peak MiB':>10}{'size KiB':>10}")
+    with TemporaryDirectory() as temp_dir:
+        results = {}
+        for backend in BACKENDS:
+            path = Path(temp_dir) / f"{backend}.epub"
+            results[backend] = result = run_backend(backend, path, args.pages)
+            peak_memory = result["peak_memory"]
+            print(
+                f"{backend:<12}{args.pages:>8}{result['seconds']:>10.2f}"
+                f"{peak_memory if peak_memory is not None else float('nan'):>10.1f}"
+                f"{path.stat().st_size / 1024:>10.0f}"
+            )
+        reference_size = (Path(temp_dir) / "reference.epub").stat().st_size
+        size = (Path(temp_dir) / "ebooklib.epub").stat().st_size
+        print(
+            f"Compact pages: {1 - size / reference_size:.1%} smaller, "
+            f"{results['reference']['seconds'] / results['ebooklib']['seconds']:.2f}x "
+            "as fast as the reference"
+        )
+        # Books are compared once all backends ran, since a child process peak memory usage
+        # includes its parent memory usage when it was started
+        assert read_book(Path(temp_dir) / "ebooklib.epub") == read_book(
+            Path(temp_dir) / "stream.epub"
+        ), "streamed book content differs"
+        compare_compression_levels(Path(temp_dir) / "ebooklib.epub")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Footnotes linking micro-benchmark.
+
+Compares BookHTMLPage footnotes linking with the previous implementation, which rebuilt and
+parsed the whole page for every footnote, and checks that both produce the same page.
+
+    python -m benchmarks.bench_hamesh [-n 50]
+"""
+
+import argparse
+from pathlib import Path
+from re import Match
+from time import perf_counter
+
+from lxml.etree import Element
+from parsel import Selector, SelectorList
+
+from shamela2epub.misc.patterns import (
+    ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN,
+    ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN,
+)
+from shamela2epub.models.book_html_page import BookHTMLPage, epub_type
+from shamela2epub.models.book_page import HAMESH_PLACEHOLDER
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+FIXTURES = ("page.html", "page_footnotes.html")
+
+
+class LegacyBookHTMLPage(BookHTMLPage):
+    def _update_hamesh(self) -> None:
+        """
+        Previous footnotes linking, a full page rebuild and parse per footnote.
+        The stale parent and first occurrence replacement bugs are fixed so that the output
+        can be compared.
+        """
+        footnote_count = 1
+        if not self.content:
+            return
+        hamesh: SelectorList = self.content.css(".hamesh")
+        if not hamesh:
+            return
+        p_elements: SelectorList = self.content.css("p:not(.hamesh)")
+        for p in p_elements:
+            p_html = new_p_html = p.get()
+            shift = 0
+            match: Match
+            for match in ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN.finditer(p_html):
+                number = match.group("number")
+                if self.hamesh_items.get(number) is None:
+                    continue
+                aya_match = ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN.search(p_html)
+                if (
+                    aya_match
+                    and number in aya_match.group()
+                    and match.start("number") > aya_match.start()
+                ):
+                    continue
+                footnote_link: Element = Element(
+                    "a",
+                    {
+                        "href": f"#fn{footnote_count}",
+                        epub_type: "noteref",
+                        "role": "doc-noteref",
+                        "id": f"fnref{footnote_count}",
+                        "class": "fn nu",
+                    },
+                )
+                footnote_link.text = number
+                link = self.element_as_text(footnote_link)
+                start, end = match.start() + shift, match.end() + shift
+                previous_p_html, new_p_html = (
+                    new_p_html,
+                    new_p_html[:start] + link + new_p_html[end:],
+                )
+                shift += len(link) - len(number)
+                self.content = Selector(
+                    text=self.content.get().replace(previous_p_html, new_p_html)
+                )
+                footnote_count += 1
+                if self.hamesh_items[number] not in self.footnotes:
+                    self.footnotes.append(self.hamesh_items[number])
+        self.content = Selector(text=self.content.get().replace(hamesh.get(""), HAMESH_PLACEHOLDER))
+
+
+def benchmark(page_class: type[BookHTMLPage], html: str, rounds: int) -> float:
+    start = perf_counter()
+    for _ in range(rounds):
+        page_class("https://shamela.ws/book/823/5", html)
+    return (perf_counter() - start) / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--rounds", type=int, default=50)
+    args = parser.parse_args()
+    print(f"{'fixture':<24}{'footnotes':>10}{'legacy ms':>12}{'current ms':>12}{'speed-up':>10}")
+    for fixture in FIXTURES:
+        html = (FIXTURES_DIR / fixture).read_text()
+        legacy_page = LegacyBookHTMLPage("https://shamela.ws/book/823/5", html).to_book_page()
+        current_page = BookHTMLPage("https://shamela.ws/book/823/5", html).to_book_page()
+        assert legacy_page == current_page, f"{fixture}: output differs from the legacy output"
+        legacy = benchmark(LegacyBookHTMLPage, html, args.rounds)
+        current = benchmark(BookHTMLPage, html, args.rounds)
+        print(
+            f"{fixture:<24}{len(current_page.footnotes):>10}{legacy * 1000:>12.2f}"
+            f"{current * 1000:>12.2f}{legacy / current:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+CLI startup import-time benchmark.
+
+Runs CLI commands that don't download anything with `python -X importtime`, reports how long
+their imports took, and fails if they took longer than the budget or if they imported modules
+that only some commands need.
+
+    python -m benchmarks.bench_import [--budget-ms 150] [-n 5]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from statistics import median
+
+COMMANDS = (("--help",), ("download", "--help"), ("batch", "--help"))
+# Modules that should only be imported by the commands that use them
+HEAVY_MODULES = ("trogon", "textual", "PyQt6", "ebooklib", "parsel", "lxml", "niquests", "tqdm")
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+\d+ \|\s+(?P<cumulative>\d+) \| (?P<module>.+)$")
+
+
+def get_imports(command: tuple[str, ...]) -> dict[str, int]:
+    """Get top-level and nested imports of a command, with their cumulative time in µs."""
+    output = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-m", "shamela2epub", *command],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports: dict[str, int] = {}
+    for line in output.splitlines():
+        if match := IMPORT_TIME_PATTERN.match(line):
+            imports[match["module"]] = int(match["cumulative"])
+    return imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=150)
+    parser.add_argument("-n", "--rounds", type=int, default=5)
+    args = parser.parse_args()
+    failed = False
+    print(f"{'command':<20}{'imports ms':>12}{'budget ms':>12}  heavy modules")
+    for command in COMMANDS:
+        rounds = [get_imports(command) for _ in range(args.rounds)]
+        # Only top-level imports are counted, since their time includes the nested ones
+        import_ms = (
+            median(
+                sum(time for module, time in imports.items() if not module.startswith(" "))
+                for imports in rounds
+            )
+            / 1000
+        )
+        heavy_modules = sorted(
+            {
+                module.strip().split(".")[0]
+                for module in rounds[0]
+                if module.strip().split(".")[0] in HEAVY_MODULES
+            }
+        )
+        failed |= import_ms > args.budget_ms or bool(heavy_modules)
+        print(
+            f"{' '.join(command):<20}{import_ms:>12.1f}{args.budget_ms:>12.0f}  "
+            f"{', '.join(heavy_modules) or '-'}"
+        )
+    if failed:
+        sys.exit("CLI startup is over budget")
+
+
+if __name__ == "__main__":
+    main()
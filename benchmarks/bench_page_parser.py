@@ -0,0 +1,60 @@
+"""
+Page parser micro-benchmark.
+
+Compares the page scanner, which parses only the page content, with parsing the whole page with
+BookHTMLPage, and checks that both produce the same pages.
+
+    python -m benchmarks.bench_page_parser [-n 50]
+"""
+
+import argparse
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+
+from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.book_page import BookPage
+from shamela2epub.models.page_parser import parse_page_fields, scan_page
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+FIXTURES = ("page.html", "page_footnotes.html")
+PAGE_URL = "https://shamela.ws/book/823/5"
+
+
+def parse_with_parsel(url: str, html: str) -> BookPage | None:
+    return BookHTMLPage(url, html, with_toc=False).to_book_page()
+
+
+def parse_with_scanner(url: str, html: str) -> BookPage | None:
+    fields = scan_page(html)
+    return parse_page_fields(url, fields) if fields is not None else None
+
+
+def benchmark(parse: Callable[[str, str], BookPage | None], html: str, rounds: int) -> float:
+    start = perf_counter()
+    for _ in range(rounds):
+        parse(PAGE_URL, html)
+    return (perf_counter() - start) / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--rounds", type=int, default=50)
+    args = parser.parse_args()
+    print(f"{'fixture':<24}{'parsel ms':>12}{'scanner ms':>12}{'speed-up':>10}")
+    for fixture in FIXTURES:
+        html = (FIXTURES_DIR / fixture).read_text()
+        scanned_page = parse_with_scanner(PAGE_URL, html)
+        assert scanned_page is not None, f"{fixture}: page couldn't be scanned"
+        assert scanned_page == parse_with_parsel(PAGE_URL, html), (
+            f"{fixture}: scanned page differs from the parsed page"
+        )
+        parsel = benchmark(parse_with_parsel, html, args.rounds)
+        scanner = benchmark(parse_with_scanner, html, args.rounds)
+        print(
+            f"{fixture:<24}{parsel * 1000:>12.2f}{scanner * 1000:>12.2f}{parsel / scanner:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Book download pipeline benchmark.
+
+Downloads a synthetic book end to end from a local Shamela stand-in server, and runs the page
+parsing and EPUB building stages in isolation. Every stage runs in its own process and reports
+its pages per second and peak memory usage, along with page latency percentiles and EPUB write
+time. Results are saved as JSON.
+
+    python -m benchmarks.bench_pipeline [-n 300] [-x 8] [--latency 0.05] [--error-rate 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+from niquests import AsyncSession, Response
+
+from benchmarks.server import BOOK_ID, ShamelaStandIn
+from shamela2epub.fetcher import ConnectionBudget
+from shamela2epub.main import BookDownloader
+from shamela2epub.misc.utils import get_peak_memory
+from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.epub_book import EPUBBook
+from shamela2epub.models.page_parser import parse_book_page
+
+BOOK_URL = f"https://shamela.ws/book/{BOOK_ID}"
+RESULTS_DIR = Path(__file__).parent / "results"
+STAGES = ("parse", "epub", "download")
+
+
+def get_latency_stats(latencies: list[float]) -> dict[str, float]:
+    """Get p50 and p99 of latencies in milliseconds."""
+    if len(latencies) < 2:  # noqa: PLR2004
+        latency = latencies[0] * 1000 if latencies else 0.0
+        return {"p50_ms": latency, "p99_ms": latency}
+    percentiles = quantiles(latencies, n=100)
+    return {"p50_ms": percentiles[49] * 1000, "p99_ms": percentiles[98] * 1000}
+
+
+class TimedSession(AsyncSession):
+    def __init__(self, latencies: list[float], **kwargs: Any) -> None:
+        """Session that records every GET request latency."""
+        super().__init__(**kwargs)
+        self.latencies = latencies
+
+    async def get(self, url: str, **kwargs: Any) -> Response:  # type: ignore[override]
+        start = perf_counter()
+        try:
+            return await super().get(url, **kwargs)
+        finally:
+            self.latencies.append(perf_counter() - start)
+
+
+class StandInBookDownloader(BookDownloader):
+    def __init__(self, server_url: str, connections: int, parse_workers: int) -> None:
+        """Book downloader that fetches pages from a stand-in server, and records their latency."""
+        super().__init__(BOOK_URL, connections, parse_workers)
+        self._server_url = server_url
+        self.latencies: list[float] = []
+
+    def _page_url(self, page_number: int) -> str:
+        # The info page is page 0
+        return f"{self._server_url}/book/{BOOK_ID}/{page_number or ''}"
+
+    async def _with_session(
+        self, download: Callable[[AsyncSession, ConnectionBudget], Awaitable[None]]
+    ) -> None:
+        async with TimedSession(self.latencies, pool_maxsize=self._connections) as session:
+            await download(session, ConnectionBudget(self._connections))
+
+
+def run_download(args: argparse.Namespace, output: Path) -> dict[str, Any]:
+    downloader = StandInBookDownloader(args.server_url, args.connections, args.parse_workers)
+
+    async def download(session: AsyncSession, budget: ConnectionBudget) -> None:
+        await downloader.fetch_info_page(session, budget)
+        if args.stream:
+            downloader.stream_book(str(output))
+        await downloader.fetch_book(session, budget, lambda _: None)
+
+    start = perf_counter()
+    asyncio.run(downloader._with_session(download))
+    download_seconds = perf_counter() - start
+    write_start = perf_counter()
+    downloader.save_book(str(output))
+    write_seconds = perf_counter() - write_start
+    pages = downloader.epub_book.pages_count
+    return {
+        "pages": pages,
+        "requests": len(downloader.latencies),
+        "failed_pages": downloader.failed_pages,
+        "seconds": download_seconds + write_seconds,
+        "pages_per_second": pages / (download_seconds + write_seconds),
+        "latency": get_latency_stats(downloader.latencies),
+        "write_seconds": write_seconds,
+    }
+
+
+def get_fixture_pages(pages: int) -> list[str]:
+    """Get pages HTML of a book, served the same way the stand-in server does."""
+    server = ShamelaStandIn(pages)
+    try:
+        return [server.render_page(page_number).decode() for page_number in range(1, pages + 1)]
+    finally:
+        server.server_close()
+
+
+def run_parse(args: argparse.Namespace) -> dict[str, Any]:
+    pages_html = get_fixture_pages(args.pages)
+    latencies = []
+    start = perf_counter()
+    for page_number, html in enumerate(pages_html, 1):
+        page_start = perf_counter()
+        parse_book_page(f"{BOOK_URL}/{page_number}", html)
+        latencies.append(perf_counter() - page_start)
+    seconds = perf_counter() - start
+    return {
+        "pages": args.pages,
+        "seconds": seconds,
+        "pages_per_second": args.pages / seconds,
+        "latency": get_latency_stats(latencies),
+    }
+
+
+def run_epub(args: argparse.Namespace, output: Path) -> dict[str, Any]:
+    pages_html = get_fixture_pages(args.pages)
+    first_page = BookHTMLPage(f"{BOOK_URL}/1", pages_html[0])
+    book_pages = [first_page.to_book_page()] + [
+        BookHTMLPage(f"{BOOK_URL}/{page_number}", html).to_book_page()
+        for page_number, html in enumerate(pages_html[1:], 2)
+    ]
+    start = perf_counter()
+    epub_book = EPUBBook()
+    epub_book.init()
+    epub_book.create_info_page(
+        BookInfoHTMLPage(f"{BOOK_URL}/", (Path(__file__).parent / "fixtures/info.html").read_text())
+    )
+    if args.stream:
+        epub_book.stream_to(output)
+    epub_book.set_page_count(first_page.last_page)
+    epub_book.set_parts_map(first_page.parts_map)
+    epub_book.set_toc(first_page.toc)
+    epub_book.set_chapter_index(first_page.chapter_index)
+    for book_page in book_pages:
+        epub_book.add_page(book_page)
+    write_start = perf_counter()
+    epub_book.generate_toc()
+    epub_book.save_book(str(output))
+    end = perf_counter()
+    return {
+        "pages": args.pages,
+        "seconds": end - start,
+        "pages_per_second": args.pages / (end - start),
+        "write_seconds": end - write_start,
+        "size_kib": output.stat().st_size / 1024,
+    }
+
+
+def run_stage(args: argparse.Namespace) -> dict[str, Any]:
+    with TemporaryDirectory() as temp_dir:
+        output = Path(temp_dir) / "book.epub"
+        if args.stage == "parse":
+            result = run_parse(args)
+        elif args.stage == "epub":
+            result = run_epub(args, output)
+        else:
+            result = run_download(args, output)
+    return {**result, "peak_memory_mib": get_peak_memory()}
+
+
+def run_stage_process(stage: str, args: argparse.Namespace, server_url: str) -> dict[str, Any]:
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.bench_pipeline",
+        "--stage",
+        stage,
+        "--server-url",
+        server_url,
+        "-n",
+        str(args.pages),
+        "-x",
+        str(args.connections),
+        "-p",
+        str(args.parse_workers),
+    ]
+    if args.stream:
+        command.append("--stream")
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout  # noqa: S603
+    return json.loads(output)
+
+
+def format_value(value: float | None, digits: int = 1) -> str:
+    return f"{value:.{digits}f}" if value is not None else "-"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--pages", type=int, default=300)
+    parser.add_argument("-x", "--connections", type=int, default=8)
+    parser.add_argument("-p", "--parse-workers", type=int, default=0)
+    parser.add_argument("-s", "--stream", action="store_true", help="stream the EPUB book")
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failed responses")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("-o", "--output", type=Path, help="results JSON file")
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--server-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.stage:
+        print(json.dumps(run_stage(args)))
+        return
+
+    stages: dict[str, dict[str, Any]] = {}
+    with ShamelaStandIn(
+        args.pages, args.latency, args.jitter, args.error_rate, args.error_status
+    ) as server:
+        for stage in args.stages:
+            stages[stage] = run_stage_process(stage, args, server.url)
+        requests_count, errors_count = server.requests_count, server.errors_count
+
+    print(
+        f"{'stage':<10}{'pages':>7}{'seconds':>9}{'pages/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+        f"{'write s':>9}{'peak MiB':>10}"
+    )
+    for stage, result in stages.items():
+        latency = result.get("latency", {})
+        print(
+            f"{stage:<10}{result['pages']:>7}{result['seconds']:>9.2f}"
+            f"{result['pages_per_second']:>9.1f}"
+            f"{format_value(latency.get('p50_ms'), 2):>9}{format_value(latency.get('p99_ms'), 2):>9}"
+            f"{format_value(result.get('write_seconds'), 2):>9}"
+            f"{format_value(result['peak_memory_mib']):>10}"
+        )
+    if "download" in stages:
+        print(f"server: {requests_count} requests, {errors_count} injected errors")
+
+    output = args.output or RESULTS_DIR / f"pipeline-{datetime.now(UTC):%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    results = {
+        "date": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {
+            "pages": args.pages,
+            "connections": args.connections,
+            "parse_workers": args.parse_workers,
+            "stream": args.stream,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "error_status": args.error_status,
+        },
+        "server": {"requests": requests_count, "errors": errors_count},
+        "stages": stages,
+    }
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Local Shamela stand-in server.
+
+Serves the recorded book pages of the benchmark fixtures for any page number of a synthetic book,
+with configurable response latency, jitter and error injection, so that downloads can be
+benchmarked offline and reproducibly.
+
+    python -m benchmarks.server [--port 8080] [-n 300] [--latency 0.05] [--error-rate 0.01]
+"""
+
+import argparse
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from random import Random
+from threading import Lock, Thread
+from time import sleep
+from types import TracebackType
+from typing import Self
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+BOOK_ID = "823"
+PAGE_PATH_PATTERN = re.compile(rf"^/book/{BOOK_ID}/(?P<page>\d*)$")
+PAGE_LINK_PATTERN = re.compile(rf"(https://shamela\.ws/book/{BOOK_ID}/)(\d+)")
+PAGE_NAVIGATION_PATTERN = re.compile(
+    rf'(href="https://shamela\.ws/book/{BOOK_ID}/)\d+(">&lsaquo;</a>\s*'
+    rf'<input[^>]+id="fld_goto_bottom" value=")\d+(">'
+    rf'<a class="btn btn-default" href="https://shamela\.ws/book/{BOOK_ID}/)\d+(">&rsaquo;</a>'
+    rf'<a class="btn btn-default" href="https://shamela\.ws/book/{BOOK_ID}/)\d+'
+)
+
+
+class ShamelaStandIn(ThreadingHTTPServer):
+    def __init__(  # noqa: PLR0913
+        self,
+        pages: int = 300,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        footnotes_every: int = 4,
+        port: int = 0,
+    ) -> None:
+        """
+        Shamela stand-in server of a book with `pages` pages.
+        The first page has the book TOC and parts, and every `footnotes_every` page is a
+        footnote heavy one. Responses are delayed by `latency` seconds give or take `jitter`,
+        and `error_rate` of them fail with `error_status`, in a reproducible order.
+        """
+        super().__init__(("127.0.0.1", port), _RequestHandler)
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.footnotes_every = footnotes_every
+        self.requests_count = 0
+        self.errors_count = 0
+        self._random = Random(0)  # noqa: S311
+        self._lock = Lock()
+        self._info_page = (FIXTURES_DIR / "info.html").read_bytes()
+        self._page = self._clamp_links((FIXTURES_DIR / "page.html").read_text())
+        self._footnotes_page = self._clamp_links((FIXTURES_DIR / "page_footnotes.html").read_text())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def _clamp_links(self, html: str) -> str:
+        """Point the recorded page links beyond the book last page to the last page."""
+        return PAGE_LINK_PATTERN.sub(
+            lambda match: f"{match[1]}{min(int(match[2]), self.pages)}", html
+        )
+
+    def render_page(self, page_number: int) -> bytes:
+        """Get the recorded page HTML with its navigation updated to the page number."""
+        html = (
+            self._footnotes_page
+            if page_number == 1 or page_number % self.footnotes_every == 0
+            else self._page
+        )
+        return PAGE_NAVIGATION_PATTERN.sub(
+            lambda match: (
+                f"{match[1]}{max(page_number - 1, 1)}{match[2]}{page_number}"
+                f"{match[3]}{min(page_number + 1, self.pages)}{match[4]}{self.pages}"
+            ),
+            html,
+        ).encode()
+
+    def get_response(self, path: str) -> tuple[int, bytes]:
+        """Get the response status and body of a request path, after the simulated latency."""
+        with self._lock:
+            self.requests_count += 1
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors_count += 1
+        sleep(delay)
+        if failed:
+            return self.error_status, b""
+        match = PAGE_PATH_PATTERN.match(path)
+        if match is None:
+            return 404, b""
+        if not match["page"]:
+            return 200, self._info_page
+        page_number = int(match["page"])
+        if not 1 <= page_number <= self.pages:
+            return 404, b""
+        return 200, self.render_page(page_number)
+
+    def __enter__(self) -> Self:
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like the real server does
+    protocol_version = "HTTP/1.1"
+    server: ShamelaStandIn
+
+    def do_GET(self) -> None:
+        status, body = self.server.get_response(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-n", "--pages", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.0, help="response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failed responses")
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+    server = ShamelaStandIn(
+        args.pages, args.latency, args.jitter, args.error_rate, args.error_status, port=args.port
+    )
+    print(f"Serving book {BOOK_ID} at {server.url}/book/{BOOK_ID}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,55 @@
 """Entry Point."""
 
+from importlib import import_module
+from importlib.util import find_spec
+from multiprocessing import freeze_support
+
 import click
-from trogon import tui
 
-from shamela2epub.cli.app import download
+from shamela2epub.misc.log import setup_logging
+
+# Commands are imported only when they run, since they import heavy modules (PyQt6 for the GUI)
+COMMANDS = {
+    "download": "shamela2epub.cli.app",
+    "batch": "shamela2epub.cli.app",
+    "assemble": "shamela2epub.cli.app",
+    "info": "shamela2epub.cli.app",
+    "search": "shamela2epub.cli.app",
+    "gui": "shamela2epub.gui.app",
+}
+
+
+class LazyGroup(click.Group):
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return [
+            *(name for name in COMMANDS if name != "gui" or find_spec("PyQt6") is not None),
+            *super().list_commands(ctx),
+        ]
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name in COMMANDS and cmd_name in self.list_commands(ctx):
+            command: click.Command = getattr(import_module(COMMANDS[cmd_name]), cmd_name)
+            return command
+        return super().get_command(ctx, cmd_name)
 
 
-@tui()  # type: ignore[untyped-decorator]
-@click.group()
+@click.group(cls=LazyGroup)
 def click_cli() -> None:
     pass
 
 
-def main() -> None:
-    click_cli.add_command(download)
-    try:
-        from shamela2epub.gui.app import gui  # noqa: PLC0415
+@click_cli.command(name="tui", help="Open Textual TUI.")
+@click.pass_context
+def tui(ctx: click.Context) -> None:
+    from trogon import Trogon  # noqa: PLC0415
+
+    Trogon(click_cli, command_name="tui", click_context=ctx).run()
 
-        click_cli.add_command(gui)
-    except ImportError:
-        pass
+
+def main() -> None:
+    # Required for the parse workers processes in PyInstaller bundles
+    freeze_support()
+    setup_logging()
     click_cli()
 
 
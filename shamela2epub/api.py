@@ -0,0 +1,117 @@
+"""
+Library API for converting Shamela books to EPUB from async code.
+
+    async with get_async_session(32) as session:
+        budget = ConnectionBudget(32)
+        with Path("book.epub").open("wb") as sink:
+            await convert("823", sink=sink, session=session, budget=budget)
+"""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+from enum import StrEnum
+from pathlib import Path
+from time import perf_counter
+from typing import BinaryIO
+
+from niquests import AsyncSession
+
+from shamela2epub.batch import BookResult, BookStatus
+from shamela2epub.fetcher import ConnectionBudget
+from shamela2epub.main import BookDownloader
+from shamela2epub.misc.http_utils import get_async_session
+from shamela2epub.misc.page_cache import CachePolicy
+from shamela2epub.misc.utils import get_book_url
+
+__all__ = ["ConnectionBudget", "ConvertStage", "ProgressEvent", "convert", "get_async_session"]
+
+
+class ConvertStage(StrEnum):
+    INFO = "info"
+    PAGE = "page"
+    SAVING = "saving"
+    DONE = "done"
+
+
+@dataclass(slots=True, frozen=True)
+class ProgressEvent:
+    stage: ConvertStage
+    title: str
+    # Pages added so far, and book pages count once the first page is downloaded
+    pages: int = 0
+    pages_count: int = 0
+
+
+async def convert(  # noqa: PLR0913
+    book: str,
+    *,
+    sink: BinaryIO,
+    connections: int = 16,
+    progress: Callable[[ProgressEvent], None] | None = None,
+    session: AsyncSession | None = None,
+    budget: ConnectionBudget | None = None,
+    stream: bool = False,
+    cache_dir: Path | None = None,
+    cache_policy: CachePolicy = CachePolicy.WRITE,
+) -> BookResult:
+    """
+    Download a book by its ID or URL and write it as EPUB to a binary file-like `sink`.
+    Pass the same `session` and connection `budget` to conversions running in one event loop to
+    share their connections, otherwise each conversion opens `connections` of its own.
+    With `stream`, pages are written to the sink while downloading instead of all at once when
+    the download is done. Saving runs in a thread, so the event loop isn't blocked meanwhile.
+    Raises ValueError if the book URL isn't valid.
+    """
+    downloader = BookDownloader(
+        get_book_url(book), connections, cache_dir=cache_dir, cache_policy=cache_policy
+    )
+    if not downloader.valid:
+        raise ValueError(f"Invalid book URL: {downloader.url}")
+    if budget is None:
+        budget = ConnectionBudget(connections)
+    start = perf_counter()
+
+    def notify(stage: ConvertStage, pages: int = 0) -> None:
+        if progress is not None:
+            progress(
+                ProgressEvent(
+                    stage, downloader.book_info_page.title, pages, downloader.epub_book.pages_count
+                )
+            )
+
+    async def download(session: AsyncSession) -> None:
+        await downloader.fetch_info_page(session, budget)
+        notify(ConvertStage.INFO)
+        if stream:
+            downloader.epub_book.stream_to(sink)
+        # The first page is added before pages count is known, so the count starts from it
+        added_pages = 1
+
+        def update_progress(_: str | int) -> None:
+            nonlocal added_pages
+            added_pages += 1
+            notify(ConvertStage.PAGE, added_pages)
+
+        await downloader.fetch_book(session, budget, update_progress)
+
+    try:
+        if session is not None:
+            await download(session)
+        else:
+            async with get_async_session(connections) as own_session:
+                await download(own_session)
+    finally:
+        downloader.close()
+    pages_count = downloader.epub_book.pages_count
+    notify(ConvertStage.SAVING, pages_count)
+    await asyncio.to_thread(downloader.write_book, sink)
+    notify(ConvertStage.DONE, pages_count)
+    return BookResult(
+        downloader.url,
+        BookStatus.DONE,
+        downloader.book_info_page.title,
+        pages_count,
+        perf_counter() - start,
+        failed_pages=downloader.failed_pages,
+    )
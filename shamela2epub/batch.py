@@ -0,0 +1,152 @@
+"""Batch books downloader."""
+
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from time import perf_counter
+
+from niquests import AsyncSession
+from tqdm import tqdm
+
+from shamela2epub.fetcher import ConnectionBudget
+from shamela2epub.main import BookDownloader
+from shamela2epub.misc.http_utils import get_async_session
+
+logger = logging.getLogger(__name__)
+
+# Max length of book titles in progress bars
+PROGRESS_TITLE_LENGTH = 30
+
+
+class BookStatus(StrEnum):
+    DONE = "done"
+    SKIPPED = "skipped"
+    INVALID = "invalid"
+    FAILED = "failed"
+
+
+@dataclass(slots=True)
+class BookResult:
+    url: str
+    status: BookStatus
+    title: str = ""
+    pages: int = 0
+    seconds: float = 0.0
+    output: Path | None = None
+    failed_pages: list[int] = field(default_factory=list)
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+
+class BatchDownloader:
+    def __init__(
+        self,
+        connections: int,
+        jobs: int,
+        output: str = "",
+        force: bool = False,
+        stream: bool = False,
+    ) -> None:
+        """
+        Download many books concurrently, `jobs` books at a time, sharing one session and
+        `connections` requests in flight between all of them.
+        Books that already exist in `output` are skipped unless `force` is set.
+        """
+        self._connections = connections
+        self._jobs = jobs
+        self._output = output
+        self._force = force
+        self._stream = stream
+
+    async def _download_book(
+        self,
+        session: AsyncSession,
+        budget: ConnectionBudget,
+        downloader: BookDownloader,
+        position: int,
+    ) -> BookResult:
+        if not downloader.valid:
+            logger.error(f"Skipping invalid URL: {downloader.url}")
+            return BookResult(downloader.url, BookStatus.INVALID)
+        try:
+            return await self._convert_book(session, budget, downloader, position)
+        finally:
+            # Books that failed are closed too, so their pages cache is synced and unlocked
+            downloader.close()
+
+    async def _convert_book(
+        self,
+        session: AsyncSession,
+        budget: ConnectionBudget,
+        downloader: BookDownloader,
+        position: int,
+    ) -> BookResult:
+        start = perf_counter()
+        await downloader.fetch_info_page(session, budget)
+        title = downloader.book_info_page.title
+        output_path = downloader.get_output_path(self._output)
+        if output_path.exists() and not self._force:
+            logger.info(f"{output_path} already exists, skipping")
+            return BookResult(downloader.url, BookStatus.SKIPPED, title, output=output_path)
+        if self._stream:
+            downloader.stream_book(self._output)
+        progress_bar = tqdm(
+            desc=title[:PROGRESS_TITLE_LENGTH],
+            position=position,
+            leave=False,
+            unit=" page",
+            dynamic_ncols=True,
+        )
+
+        def update_progress(_: str | int) -> None:
+            if not progress_bar.total:
+                # The first page is added before the book pages count is known
+                progress_bar.total = downloader.epub_book.pages_count
+                progress_bar.update(1)
+            progress_bar.set_postfix(connections=budget.window, refresh=False)
+            progress_bar.update(1)
+
+        try:
+            await downloader.fetch_book(session, budget, update_progress)
+        finally:
+            progress_bar.close()
+        # Saving the book takes a while, so other books keep downloading meanwhile
+        output_book = await asyncio.to_thread(downloader.save_book, self._output)
+        return BookResult(
+            downloader.url,
+            BookStatus.DONE,
+            title,
+            downloader.epub_book.pages_count,
+            perf_counter() - start,
+            output_book,
+            downloader.failed_pages,
+        )
+
+    async def download(
+        self, urls: Iterable[str], create_downloader: Callable[[str], BookDownloader]
+    ) -> list[BookResult]:
+        """Download books of the URLs, creating each book downloader only once its turn comes."""
+        pending_urls = enumerate(urls)
+        results: dict[int, BookResult] = {}
+        budget = ConnectionBudget(self._connections)
+
+        async def download_books(position: int) -> None:
+            for index, url in pending_urls:
+                try:
+                    result = await self._download_book(
+                        session, budget, create_downloader(url), position
+                    )
+                except Exception as err:  # noqa: BLE001
+                    logger.error(f"Failed to download {url}: {err}")
+                    result = BookResult(url, BookStatus.FAILED)
+                results[index] = result
+
+        async with get_async_session(self._connections) as session, asyncio.TaskGroup() as tasks:
+            for position in range(self._jobs):
+                tasks.create_task(download_books(position))
+        return [results[index] for index in sorted(results)]
@@ -1,24 +1,275 @@
+import json
 import logging
+from collections.abc import Callable
+from dataclasses import asdict
+from datetime import UTC, datetime
 from pathlib import Path
+from time import perf_counter
+from typing import TextIO
 
 import click
 
 from shamela2epub import OUT_DIR
-from shamela2epub.main import BookDownloader
+from shamela2epub.misc.book_index import INDEX_FILE, BookIndex, BookRecord, PageMatch
+from shamela2epub.misc.log import setup_logging
+from shamela2epub.misc.page_cache import CachePolicy
+from shamela2epub.misc.stats import stats
+from shamela2epub.misc.utils import get_book_url, get_peak_memory
 
 logger = logging.getLogger(__name__)
 
+stats_options = (
+    click.option(
+        "--stats",
+        "show_stats",
+        is_flag=True,
+        default=False,
+        help="Show time spent in each conversion stage, and requests counters",
+    ),
+    click.option(
+        "--stats-file",
+        type=click.Path(dir_okay=False, path_type=Path),
+        help="Save stats to a JSON file (.json) or a Prometheus text file (any other extension)",
+    ),
+)
+
+
+index_file_option = click.option(
+    "--index-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=INDEX_FILE,
+    show_default=True,
+    help="Books metadata index, updated by every download",
+)
+
+
+index_text_option = click.option(
+    "--index-text",
+    is_flag=True,
+    default=False,
+    help="Add books pages text to the index full-text search, see search --text",
+)
+
+
+def with_stats_options(command: Callable[..., None]) -> Callable[..., None]:
+    for option in reversed(stats_options):
+        command = option(command)
+    return command
+
+
+def collect_stats(show_stats: bool, stats_file: Path | None) -> None:
+    """Collect stats if asked to, and report them once the command is done."""
+    if not show_stats and stats_file is None:
+        return
+    stats.enable()
+
+    def report_stats() -> None:
+        if show_stats:
+            logger.info(f"Stats:\n{stats.summary()}")
+        if stats_file is not None:
+            stats.dump(stats_file)
+            logger.info(f"Stats saved to {stats_file}")
+
+    click.get_current_context().call_on_close(report_stats)
+
+
+def validate_split(_: click.Context, __: click.Parameter, value: str) -> str:
+    if value and value != "part" and not (value.isdigit() and int(value) > 0):
+        raise click.BadParameter('should be "part" or a number of pages')
+    return value
+
+
+def parse_pages_range(_: click.Context, __: click.Parameter, value: str) -> range | None:
+    if not value:
+        return None
+    start, _separator, end = value.partition("-")
+    if not start.isdigit() or not (end or start).isdigit() or int(start) > int(end or start):
+        raise click.BadParameter("should be a page number or a pages range, like 300-450")
+    return range(int(start), int(end or start) + 1)
+
+
+def parse_shard(_: click.Context, __: click.Parameter, value: str) -> tuple[int, int] | None:
+    if not value:
+        return None
+    index, _separator, count = value.partition("/")
+    if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+        raise click.BadParameter("should be a shard number and the shards count, like 2/4")
+    return int(index), int(count)
+
+
+def get_options_error(  # noqa: PLR0913
+    *,
+    no_cache: bool,
+    refresh: bool,
+    resume: bool,
+    split: bool,
+    stream: bool,
+    output_format: str,
+    shard: bool,
+) -> str:
+    """Get why download options can't be used together, if they can't."""
+    if no_cache and (resume or refresh):
+        return "Resuming, refreshing or repairing a book requires the pages cache!"
+    if split and (refresh or resume):
+        return "Refreshing or repairing a book can't be used with splitting!"
+    if output_format != "epub" and (stream or split or refresh):
+        return (
+            "Only EPUB books can be streamed, split or refreshed, "
+            "text is always written while downloading!"
+        )
+    if shard and (stream or split or refresh or output_format != "epub"):
+        return (
+            "Shards are always written while downloading, and can't be split, refreshed "
+            "or saved as text, assemble them first!"
+        )
+    return ""
+
 
 @click.command()
 @click.argument("url", type=str)
 @click.option("-o", "--output", type=str, help="ePub output book custom name", default="")
 @click.option("-x", "--connections", type=int, default=16, help="Max number of connections")
+@click.option(
+    "-p",
+    "--parse-workers",
+    type=int,
+    default=0,
+    help="Number of processes used to parse pages (0 parses them in the main process)",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=OUT_DIR / "cache",
+    show_default=True,
+    help="Downloaded pages cache directory",
+)
+@click.option("--no-cache", is_flag=True, default=False, help="Don't cache downloaded pages")
+@click.option(
+    "-r",
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Resume an interrupted download, using the cached pages",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Download only the pages modified since they were cached, and update the book if any",
+)
+@click.option(
+    "--repair",
+    is_flag=True,
+    default=False,
+    help="Download only the pages that failed in a previous run, and update the book with them",
+)
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Write pages to the book while downloading instead of keeping the whole book in memory",
+)
+@click.option(
+    "--split",
+    type=str,
+    default="",
+    callback=validate_split,
+    help="Save the book in volumes while downloading, one per book part (part), "
+    "or one per a number of pages",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["epub", "jsonl", "txt"]),
+    default="epub",
+    show_default=True,
+    help="Save the book as EPUB, or only its pages text and footnotes as JSON lines or plain text",
+)
+@click.option(
+    "--pages",
+    type=str,
+    default="",
+    callback=parse_pages_range,
+    help="Download only a page or a pages range, like 300-450",
+)
+@click.option(
+    "--shard",
+    type=str,
+    default="",
+    callback=parse_shard,
+    help="Download only a shard of the book pages to a shard file, like 2/4 for the second "
+    "quarter, to assemble the book from all its shards later",
+)
+@click.option("--part", type=str, default="", help="Download only the pages of a book part")
+@click.option(
+    "--chapter", type=str, default="", help="Download only the pages of a chapter, by its title"
+)
 @click.option(
     "-f", "--force", is_flag=True, default=False, help="Force download even if the file exists"
 )
-def download(url: str, output: str, connections: int, force: bool) -> None:
+@index_file_option
+@index_text_option
+@with_stats_options
+def download(  # noqa: C901, PLR0912, PLR0913
+    url: str,
+    output: str,
+    connections: int,
+    parse_workers: int,
+    cache_dir: Path,
+    no_cache: bool,
+    resume: bool,
+    refresh: bool,
+    repair: bool,
+    stream: bool,
+    split: str,
+    output_format: str,
+    shard: tuple[int, int] | None,
+    pages: range | None,
+    part: str,
+    chapter: str,
+    force: bool,
+    index_file: Path,
+    index_text: bool,
+    show_stats: bool,
+    stats_file: Path | None,
+) -> None:
     """Download Shamela book form URL to ePub."""
-    downloader = BookDownloader(url, connections)
+    from shamela2epub.main import BookDownloader  # noqa: PLC0415
+    from shamela2epub.models.book_shard import Shard  # noqa: PLC0415
+    from shamela2epub.models.corpus_writer import CorpusFormat  # noqa: PLC0415
+    from shamela2epub.models.page_selection import PageSelection  # noqa: PLC0415
+
+    collect_stats(show_stats, stats_file)
+    if error := get_options_error(
+        no_cache=no_cache,
+        refresh=refresh,
+        resume=resume or repair,
+        split=bool(split),
+        stream=stream,
+        output_format=output_format,
+        shard=shard is not None,
+    ):
+        logger.error(f"{error} Exiting...")
+        return
+    # Failed pages are not cached, so resuming downloads only them
+    cache_policy = (
+        CachePolicy.REFRESH
+        if refresh
+        else CachePolicy.RESUME
+        if resume or repair
+        else CachePolicy.WRITE
+    )
+    book_shard = Shard(*shard) if shard is not None else None
+    downloader = BookDownloader(
+        url,
+        connections,
+        parse_workers,
+        None if no_cache else cache_dir,
+        cache_policy,
+        BookIndex(index_file),
+        book_shard,
+    )
     if not downloader.valid:
         logger.error("The URL you entered is invalid! Exiting...")
         return
@@ -26,28 +277,316 @@ def download(url: str, output: str, connections: int, force: bool) -> None:
     downloader.create_info_page()
     book_name = f"{downloader.book_info_page.title} - {downloader.book_info_page.author}"
     logger.info(f"Working on book {book_name}")
-    output_path = (
-        output
-        if output.endswith(".epub")
-        else f"{output}/{book_name}.epub"
-        if output
-        else f"{OUT_DIR}/{book_name}.epub"
-    )
-    if Path(output_path).exists() and not force:
+    output_path = downloader.get_output_path(
+        output, extension=book_shard.extension if book_shard is not None else output_format
+    )
+    # Split books are saved in volumes, unless they end up in one volume
+    output_exists = output_path.exists() or bool(split and downloader.get_volumes_paths(output))
+    if output_exists and not (force or refresh or repair):
+        downloader.close()
         logger.info("The file already exists! Exiting...")
         return
-    downloader.download()
+    if output_format != "epub":
+        downloader.export_book(output, CorpusFormat(output_format))
+    if book_shard is not None:
+        downloader.shard_book(output)
+    if stream:
+        downloader.stream_book(output)
+    if split:
+        downloader.split_book(output, 0 if split == "part" else int(split))
+    if pages is not None or part or chapter:
+        downloader.select_pages(PageSelection(pages, part, chapter))
+    if index_text:
+        downloader.index_text()
+    try:
+        downloader.download()
+    except ValueError as err:
+        logger.error(f"{err}! Exiting...")
+        return
+    if refresh or repair:
+        logger.info(f"{downloader.changed_pages} pages changed")
+        if not downloader.changed_pages and output_path.exists():
+            downloader.epub_book.discard()
+            logger.info("The book is already up to date! Exiting...")
+            return
     # Save new book
     logger.info("Saving the new book")
     output_book = downloader.save_book(output)
+    logger.info(
+        f"Done! You can find the book {len(downloader.volumes)} volumes at: {output_book.parent}"
+        if downloader.volumes
+        else f"Done! You can find the book at: {output_book}"
+    )
+    if downloader.failed_pages:
+        logger.warning(
+            f"{len(downloader.failed_pages)} pages couldn't be downloaded: "
+            f"{', '.join(map(str, downloader.failed_pages))}. "
+            "Run again with --repair to download them."
+        )
+    if (peak_memory := get_peak_memory()) is not None:
+        logger.info(f"Peak memory usage: {peak_memory:.1f} MiB")
+
+
+@click.command()
+@click.argument("books", type=click.File("r"), default="-")
+@click.option("-o", "--output", type=str, help="ePub output books directory", default="")
+@click.option(
+    "-x", "--connections", type=int, default=16, help="Max number of connections for all books"
+)
+@click.option("-j", "--jobs", type=int, default=4, help="Number of books downloaded at a time")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=OUT_DIR / "cache",
+    show_default=True,
+    help="Downloaded pages cache directory",
+)
+@click.option("--no-cache", is_flag=True, default=False, help="Don't cache downloaded pages")
+@click.option(
+    "-r",
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Resume interrupted downloads, using the cached pages",
+)
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Write pages to the books while downloading instead of keeping them in memory",
+)
+@click.option(
+    "-f", "--force", is_flag=True, default=False, help="Force download even if the file exists"
+)
+@index_file_option
+@index_text_option
+@with_stats_options
+def batch(  # noqa: PLR0913
+    books: TextIO,
+    output: str,
+    connections: int,
+    jobs: int,
+    cache_dir: Path,
+    no_cache: bool,
+    resume: bool,
+    stream: bool,
+    force: bool,
+    index_file: Path,
+    index_text: bool,
+    show_stats: bool,
+    stats_file: Path | None,
+) -> None:
+    """Download Shamela books from a file (or stdin) of URLs or book IDs, one per line."""
+    import asyncio  # noqa: PLC0415
+
+    from shamela2epub.batch import BatchDownloader, BookStatus  # noqa: PLC0415
+    from shamela2epub.main import BookDownloader  # noqa: PLC0415
+
+    collect_stats(show_stats, stats_file)
+    urls = [
+        get_book_url(line.strip())
+        for line in books
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+    if no_cache and resume:
+        logger.error("Resuming downloads requires the pages cache! Exiting...")
+        return
+
+    def create_downloader(url: str) -> BookDownloader:
+        downloader = BookDownloader(
+            url,
+            connections,
+            cache_dir=None if no_cache else cache_dir,
+            cache_policy=CachePolicy.RESUME if resume else CachePolicy.WRITE,
+            book_index=BookIndex(index_file),
+        )
+        if index_text:
+            downloader.index_text()
+        return downloader
+
+    logger.info(f"Downloading {len(urls)} books, {jobs} at a time")
+    batch_downloader = BatchDownloader(connections, jobs, output, force, stream)
+    start = perf_counter()
+    results = asyncio.run(batch_downloader.download(urls, create_downloader))
+    # Summary
+    for result in results:
+        if result.status == BookStatus.DONE:
+            logger.info(
+                f"[{result.status}] {result.title}: {result.pages} pages in "
+                f"{result.seconds:.1f}s ({result.pages_per_second:.1f} pages/s)"
+            )
+            if result.failed_pages:
+                logger.warning(f"{result.title}: failed pages {result.failed_pages}")
+        else:
+            logger.info(f"[{result.status}] {result.title or result.url}")
+    done = [result for result in results if result.status == BookStatus.DONE]
+    total_pages = sum(result.pages for result in done)
+    seconds = perf_counter() - start
+    logger.info(
+        f"Done! {len(done)} of {len(results)} books downloaded, {total_pages} pages in "
+        f"{seconds:.1f}s ({total_pages / seconds:.1f} pages/s)"
+    )
+    if any(result.failed_pages for result in results):
+        logger.warning("Run again with --resume --force to download the failed pages of the books.")
+
+
+@click.command()
+@click.argument(
+    "shards", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option("-o", "--output", type=str, help="ePub output book custom name", default="")
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Write pages to the book while assembling instead of keeping the whole book in memory",
+)
+@click.option(
+    "-f", "--force", is_flag=True, default=False, help="Force assembling even if the file exists"
+)
+@index_file_option
+def assemble(
+    shards: tuple[Path, ...], output: str, stream: bool, force: bool, index_file: Path
+) -> None:
+    """Assemble a book into ePub from all its shards, downloaded with download --shard."""
+    from shamela2epub.main import BookDownloader  # noqa: PLC0415
+    from shamela2epub.models.book_shard import read_shard_header  # noqa: PLC0415
+
+    try:
+        downloader = BookDownloader(
+            read_shard_header(shards[0]).url, 1, book_index=BookIndex(index_file)
+        )
+        downloader.load_shards(list(shards))
+    except ValueError as err:
+        logger.error(f"{err}! Exiting...")
+        return
+    output_path = downloader.get_output_path(output)
+    if output_path.exists() and not force:
+        logger.info("The file already exists! Exiting...")
+        return
+    logger.info(f"Assembling book {downloader.book_info_page.title} from {len(shards)} shards")
+    if stream:
+        downloader.stream_book(output)
+    downloader.assemble_book()
+    output_book = downloader.save_book(output)
     logger.info(f"Done! You can find the book at: {output_book}")
+    if downloader.failed_pages:
+        logger.warning(
+            f"{len(downloader.failed_pages)} pages couldn't be downloaded: "
+            f"{', '.join(map(str, downloader.failed_pages))}. "
+            "Download their shards again with --repair, then assemble the book again."
+        )
+
+
+def format_book_record(record: BookRecord) -> str:
+    size = f"{record.size / 1024:,.0f} KiB" if record.size is not None else "-"
+    return (
+        f"[{record.book_id}] {record.title} - {record.author}: "
+        f"{record.pages if record.pages is not None else '-'} pages, {size}"
+    )
+
+
+@click.command()
+@click.argument("book", type=str)
+@index_file_option
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show book info as JSON")
+def info(book: str, index_file: Path, as_json: bool) -> None:
+    """Show indexed info of a book, by its URL or ID, without downloading it."""
+    from shamela2epub.misc.utils import get_info_from_url, is_valid_url  # noqa: PLC0415
+
+    url = get_book_url(book)
+    if not is_valid_url(url):
+        logger.error("The URL you entered is invalid! Exiting...")
+        return
+    record = BookIndex(index_file).get(get_info_from_url(url)["bookID"])
+    if record is None:
+        logger.error(f"{book} is not indexed yet, download it first.")
+        return
+    if as_json:
+        click.echo(json.dumps(asdict(record), ensure_ascii=False))
+        return
+    click.echo(format_book_record(record))
+    click.echo(f"URL: {record.url}")
+    click.echo(f"Parts: {', '.join(record.parts) or '-'}")
+    click.echo(f"TOC hash: {record.toc_hash or '-'}")
+    click.echo(
+        "Converted at: "
+        + (
+            datetime.fromtimestamp(record.converted_at, UTC)
+            .astimezone()
+            .isoformat(sep=" ", timespec="seconds")
+            if record.converted_at is not None
+            else "-"
+        )
+    )
+
+
+def format_page_match(match: PageMatch) -> str:
+    page = f"part {match.part}, page {match.page}" if match.part else f"page {match.page}"
+    chapter = f" ({match.chapter.splitlines()[0]})" if match.chapter else ""
+    return (
+        f"[{match.book_id}] {match.title or match.url}, {page}{chapter}:\n"
+        f"    {' '.join(match.snippet.split())}"
+    )
+
+
+@click.command()
+@click.argument("query", type=str, default="")
+@index_file_option
+@click.option("-n", "--limit", type=int, default=50, help="Max number of results to show")
+@click.option(
+    "-t",
+    "--text",
+    is_flag=True,
+    default=False,
+    help="Search books pages text, indexed with --index-text, instead of titles and authors",
+)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show results as JSON lines")
+def search(query: str, index_file: Path, limit: int, text: bool, as_json: bool) -> None:
+    """Search indexed books by title or author, or list them all without a query."""
+    if text:
+        search_text(query, index_file, limit, as_json)
+        return
+    records = BookIndex(index_file).search(query, limit)
+    if not records:
+        logger.info("No books found.")
+    for record in records:
+        click.echo(
+            json.dumps(asdict(record), ensure_ascii=False)
+            if as_json
+            else format_book_record(record)
+        )
+
+
+def search_text(query: str, index_file: Path, limit: int, as_json: bool) -> None:
+    if not query.strip():
+        logger.error("Searching text requires a query! Exiting...")
+        return
+    matches = BookIndex(index_file).search_text(query, limit)
+    if not matches:
+        logger.info("No pages found.")
+    for match in matches:
+        click.echo(
+            json.dumps(asdict(match), ensure_ascii=False) if as_json else format_page_match(match)
+        )
 
 
 if __name__ == "__main__":
+    from multiprocessing import freeze_support
+
+    # Required for the parse workers processes in PyInstaller bundles, which are built from here
+    freeze_support()
 
     @click.group()
     def cli() -> None:
         pass
 
     cli.add_command(download)
+    cli.add_command(batch)
+    cli.add_command(assemble)
+    cli.add_command(info)
+    cli.add_command(search)
+    setup_logging()
     cli()
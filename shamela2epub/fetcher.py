@@ -0,0 +1,340 @@
+"""Sliding-window book pages fetcher."""
+
+import asyncio
+import logging
+from collections.abc import AsyncIterator, Callable, Iterable
+from contextlib import asynccontextmanager, suppress
+from heapq import heappop, heappush
+from http import HTTPStatus
+from math import inf
+from random import uniform
+from typing import cast
+
+from niquests import AsyncSession, RequestException, Response, Timeout
+from urllib3.exceptions import HTTPError
+from urllib3.exceptions import TimeoutError as HTTPTimeoutError
+
+from shamela2epub.misc.http_utils import (
+    BACKOFF_FACTOR,
+    MAX_RETRIES,
+    TIME_OUT,
+    get_conditional_headers,
+    get_retry_after,
+    get_validators,
+)
+from shamela2epub.misc.page_cache import CachePolicy, PageCache
+from shamela2epub.misc.stats import stats
+
+# Requests in flight a connection budget starts with, and the least it can drop to
+INITIAL_WINDOW = 4
+MIN_WINDOW = 1
+# Latency is considered flat while its moving average stays within this factor of the lowest one
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.1
+OVERLOAD_STATUSES = (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE)
+TIMEOUT_ERRORS = (TimeoutError, Timeout, HTTPTimeoutError)
+FETCH_ERRORS = (TimeoutError, HTTPError, RequestException)
+MAX_BACKOFF = 60
+
+
+def get_backoff(attempt: int) -> float:
+    """Get a jittered exponential backoff delay, so that failed requests aren't retried together."""
+    return min(MAX_BACKOFF, BACKOFF_FACTOR * 2.0**attempt) * uniform(0.5, 1.5)  # noqa: S311
+
+
+class RequestFeedback:
+    __slots__ = ("overloaded", "retry_after")
+
+    def __init__(self) -> None:
+        """Request outcome, used by the connection budget to adapt its window."""
+        self.overloaded = False
+        self.retry_after: float | None = None
+
+    def overload(self, retry_after: float | None = None) -> None:
+        self.overloaded = True
+        self.retry_after = retry_after
+
+
+class ConnectionBudget:
+    def __init__(self, connections: int) -> None:
+        """
+        Adaptive limit of requests in flight, which can be shared by many fetchers to download
+        several books at the same time over the same connections.
+        The window of requests in flight grows while latency stays flat, up to `connections`,
+        and is halved when the server is overloaded (429/503 responses and timeouts).
+        Requests are paused while the server asks to wait with a Retry-After header.
+        """
+        self.connections = connections
+        self._window = float(min(INITIAL_WINDOW, connections))
+        self._in_flight = 0
+        self._slow_start = True
+        self._min_latency = inf
+        self._latency = 0.0
+        self._decreased_at = 0.0
+        self._resume_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def window(self) -> int:
+        return int(self._window)
+
+    async def _acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (pause := self._resume_at - loop.time()) > 0:
+            await asyncio.sleep(pause)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.window)
+            self._in_flight += 1
+
+    def _adapt(self, started_at: float, feedback: RequestFeedback) -> None:
+        now = asyncio.get_running_loop().time()
+        if feedback.overloaded:
+            if feedback.retry_after and now + feedback.retry_after > self._resume_at:
+                logging.warning(f"Rate limited, pausing requests for {feedback.retry_after:.0f}s")
+                self._resume_at = now + feedback.retry_after
+            # Requests that started before the last decrease were sent with the previous window
+            if started_at >= self._decreased_at:
+                self._window = max(MIN_WINDOW, self._window / 2)
+                self._slow_start = False
+                self._decreased_at = now
+                logging.info(f"Server is overloaded, reducing connections to {self.window}")
+            return
+        latency = now - started_at
+        self._min_latency = min(self._min_latency, latency)
+        self._latency = (
+            self._latency + LATENCY_SMOOTHING * (latency - self._latency)
+            if self._latency
+            else latency
+        )
+        if self._latency <= self._min_latency * LATENCY_TOLERANCE:
+            # Grow by one request per response at first, then by one request per window
+            self._window = min(
+                self.connections, self._window + (1 if self._slow_start else 1 / self._window)
+            )
+        else:
+            self._slow_start = False
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[RequestFeedback]:
+        """Hold a request slot, then adapt the window to the request feedback."""
+        await self._acquire()
+        started_at = asyncio.get_running_loop().time()
+        feedback = RequestFeedback()
+        completed = False
+        try:
+            yield feedback
+            completed = True
+        except TIMEOUT_ERRORS:
+            feedback.overload()
+            raise
+        finally:
+            self._in_flight -= 1
+            # Other errors and cancelled requests say nothing about the server load
+            if completed or feedback.overloaded:
+                self._adapt(started_at, feedback)
+            async with self._condition:
+                self._condition.notify_all()
+
+
+class PageFetcher:
+    def __init__(  # noqa: PLR0913
+        self,
+        session: AsyncSession,
+        page_url: Callable[[int], str],
+        budget: ConnectionBudget,
+        page_cache: PageCache | None = None,
+        cache_policy: CachePolicy = CachePolicy.WRITE,
+        prefetched: dict[int, asyncio.Task[tuple[str, dict[str, str] | None]]] | None = None,
+    ) -> None:
+        """
+        Fetch book pages keeping as many requests in flight as the connection budget allows.
+        Downloaded pages are written to the pages cache, if any, and already cached pages are
+        read from it or downloaded again only if they were modified, depending on cache policy.
+        Pages prefetched by any fetcher sharing the `prefetched` pages are taken from them.
+        """
+        self._session = session
+        self._page_url = page_url
+        self._budget = budget
+        self._page_cache = page_cache
+        self._cache_policy = cache_policy
+        self.failed_pages: list[int] = []
+        self.bytes_downloaded = 0
+        self.prefetched = prefetched if prefetched is not None else {}
+        # Pages fetched past the last consumed page at most, see fetch
+        self._ahead = 0
+        self._fetch_limit = inf
+        self._window_moved = asyncio.Event()
+
+    async def _download_page(self, page_number: int) -> tuple[str, dict[str, str] | None]:
+        """Get page HTML, and its HTTP validators if it was downloaded instead of read from cache."""
+        cached = self._page_cache is not None and page_number in self._page_cache
+        # Corrupt cached pages are downloaded again
+        if (
+            cached
+            and self._cache_policy == CachePolicy.RESUME
+            and (html := cast(PageCache, self._page_cache).get(page_number)) is not None
+        ):
+            stats.count("cache_hits")
+            return html, None
+        headers = (
+            get_conditional_headers(cast(PageCache, self._page_cache).get_validators(page_number))
+            if cached and self._cache_policy == CachePolicy.REFRESH
+            else {}
+        )
+        response = await self.fetch_page(page_number, headers)
+        if cached and response.status_code == HTTPStatus.NOT_MODIFIED:
+            if (html := cast(PageCache, self._page_cache).get(page_number)) is not None:
+                stats.count("not_modified")
+                return html, None
+            response = await self.fetch_page(page_number)
+        return response.text or "", get_validators(response)
+
+    def _store_page(
+        self, page_number: int, page: tuple[str, dict[str, str] | None]
+    ) -> tuple[str, bool]:
+        """Write a downloaded page to the pages cache, and get whether it was cached already."""
+        html, validators = page
+        if validators is None:
+            return html, True
+        if self._page_cache is not None:
+            self._page_cache.put(page_number, html, validators)
+        return html, False
+
+    async def _get_page(self, page_number: int) -> tuple[str, bool]:
+        return self._store_page(page_number, await self._download_page(page_number))
+
+    def prefetch(self, pages: Iterable[int]) -> None:
+        """
+        Start downloading pages before they are known to be in the book, so they are ready by
+        the time they are needed. Prefetched pages are only tried once, and are requested again
+        if they failed once they're actually needed. They are only written to the pages cache
+        once they're taken, so pages that aren't needed after all leave it unchanged.
+        """
+        for page_number in pages:
+            if page_number not in self.prefetched:
+                self.prefetched[page_number] = asyncio.create_task(self._download_page(page_number))
+
+    async def _get_prefetched_page(self, page_number: int) -> tuple[str, bool]:
+        """Get a page that was prefetched, or request it if it wasn't."""
+        task = self.prefetched.pop(page_number, None)
+        if task is None or task.cancelled():
+            return await self._get_page(page_number)
+        stats.count("prefetched_pages")
+        # The page may have been prefetched in the event loop of a previous download step
+        return self._store_page(page_number, task.result() if task.done() else await task)
+
+    async def get_page(self, page_number: int) -> tuple[str, bool]:
+        """
+        Get page HTML, and whether it's the same page that was cached before.
+        Failed requests are retried with a jittered exponential backoff.
+        """
+        for attempt in range(MAX_RETRIES - 1):
+            try:
+                return await self._get_prefetched_page(page_number)
+            except FETCH_ERRORS as err:
+                logging.warning(f"(try {attempt}): {err}")
+                stats.count("retries")
+                await asyncio.sleep(get_backoff(attempt))
+        return await self._get_page(page_number)
+
+    async def fetch_page(self, page_number: int, headers: dict[str, str] | None = None) -> Response:
+        """Request a page, raising an HTTPError if it failed."""
+        async with self._budget.request() as feedback:
+            with stats.time("fetch"):
+                response: Response = await self._session.get(
+                    self._page_url(page_number), headers=headers, timeout=TIME_OUT
+                )
+            if response.status_code in OVERLOAD_STATUSES:
+                feedback.overload(get_retry_after(response))
+        self.bytes_downloaded += len(response.content or b"")
+        if stats.enabled:
+            self._count_response(response)
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _count_response(response: Response) -> None:
+        stats.count("requests")
+        stats.count("bytes_downloaded", len(response.content or b""))
+        if response.conn_info is None:
+            return
+        # Connection timings are only set for requests that opened a new connection
+        for stage, latency in (
+            ("dns", response.conn_info.resolution_latency),
+            ("connect", response.conn_info.established_latency),
+            ("tls", response.conn_info.tls_handshake_latency),
+        ):
+            if latency:
+                stats.observe(stage, latency.total_seconds())
+
+    def consume(self, page_number: int) -> None:
+        """Mark pages up to `page_number` as consumed, which lets fetching run further ahead."""
+        if self._ahead:
+            self._fetch_limit = page_number + 1 + self._ahead
+            self._window_moved.set()
+            self._window_moved = asyncio.Event()
+
+    async def fetch(
+        self,
+        pages: Iterable[int],
+        queue: asyncio.Queue[tuple[int, str | None, bool]],
+        ahead: int = 0,
+    ) -> None:
+        """
+        Put pages HTML into the queue as soon as each one is downloaded.
+        Every connection starts a new request once its previous one is queued, so a slow page
+        never stalls the others. The queue is expected to be bounded to apply back pressure.
+        Failed pages are scheduled to be retried later with a jittered exponential backoff,
+        while the other pages keep downloading. Pages that still fail after all retries are
+        queued without HTML and added to `failed_pages`.
+        If `ahead` is set, pages are only started up to `ahead` pages past the last consumed
+        page, so pages that are kept until a retried page before them is consumed stay bounded.
+        """
+        pending_pages = iter(pages)
+        next_page = next(pending_pages, None)
+        self._ahead = ahead
+        self._fetch_limit = next_page + ahead if ahead and next_page is not None else inf
+        loop = asyncio.get_running_loop()
+        # (retry time, page number, attempt)
+        retries: list[tuple[float, int, int]] = []
+
+        async def fetch_page(page_number: int, attempt: int) -> None:
+            try:
+                html, cached = await self._get_prefetched_page(page_number)
+            except FETCH_ERRORS as err:
+                if attempt + 1 < MAX_RETRIES:
+                    logging.warning(f"(try {attempt}): {err}")
+                    stats.count("retries")
+                    heappush(
+                        retries, (loop.time() + get_backoff(attempt), page_number, attempt + 1)
+                    )
+                    return
+                logging.error(f"Failed to download page {page_number}: {err}")
+                self.failed_pages.append(page_number)
+                stats.count("failed_pages")
+                await queue.put((page_number, None, False))
+                return
+            await queue.put((page_number, html, cached))
+
+        async def fetch_pages() -> None:
+            nonlocal next_page
+            while True:
+                if retries and retries[0][0] <= loop.time():
+                    _, retried_page, attempt = heappop(retries)
+                    await fetch_page(retried_page, attempt)
+                elif next_page is not None and next_page < self._fetch_limit:
+                    page_number, next_page = next_page, next(pending_pages, None)
+                    await fetch_page(page_number, 0)
+                elif next_page is not None or retries:
+                    # Wait for the next retry, or for more pages to be consumed
+                    with suppress(TimeoutError):
+                        await asyncio.wait_for(
+                            self._window_moved.wait(),
+                            retries[0][0] - loop.time() if retries else None,
+                        )
+                else:
+                    return
+
+        async with asyncio.TaskGroup() as tasks:
+            for _ in range(self._budget.connections):
+                tasks.create_task(fetch_pages())
@@ -1,94 +1,192 @@
+import asyncio
+import logging
 import sys
-from functools import partial
+from contextlib import suppress
+from enum import StrEnum
 from pathlib import Path
+from time import monotonic
 from typing import cast
 
 import click
 import qdarktheme
 from PyQt6 import uic
-from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
-from PyQt6.QtGui import QFontDatabase, QGuiApplication
-from PyQt6.QtWidgets import QApplication, QFileDialog, QLabel, QMainWindow, QMessageBox, QPushButton
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from PyQt6.QtGui import QCloseEvent, QFontDatabase, QGuiApplication
+from PyQt6.QtWidgets import (
+    QApplication,
+    QFileDialog,
+    QLabel,
+    QLineEdit,
+    QMainWindow,
+    QMessageBox,
+    QPushButton,
+    QSpinBox,
+    QTableWidget,
+    QTableWidgetItem,
+)
 
 from shamela2epub import PKG_DIR
+from shamela2epub.fetcher import ConnectionBudget
 from shamela2epub.main import BookDownloader
-from shamela2epub.misc.utils import browse_file_directory
+from shamela2epub.misc.book_index import BookIndex
+from shamela2epub.misc.http_utils import get_async_session
+from shamela2epub.misc.log import setup_logging
+from shamela2epub.misc.stats import stats
+from shamela2epub.misc.utils import browse_file_directory, get_book_url
 
+logger = logging.getLogger(__name__)
 
-class QBookDownloader(BookDownloader):
-    def __init__(self, url: str) -> None:
-        super().__init__(url, connections=16)
-        self.progress: pyqtSignal = pyqtSignal(str)
+# Milliseconds between queue updates, progress is read from the jobs instead of signaled per page
+REFRESH_INTERVAL = 500
+
+
+class JobStatus(StrEnum):
+    QUEUED = "في الانتظار"
+    STARTING = "تحليل معلومات الرابط"
+    DOWNLOADING = "جار التحميل"
+    SAVING = "حفظ الكتاب"
+    DONE = "اكتمل التحميل"
+    CANCELLED = "ألغي"
+    FAILED = "فشل"
+
+
+FINISHED_STATUSES = {JobStatus.DONE, JobStatus.CANCELLED, JobStatus.FAILED}
 
-    def download(self) -> None:
-        self.progress.emit(f"تحميل الصفحة 1 من {self.epub_book.pages_count}")
-        self._download(
-            lambda page_number: self.progress.emit(
-                f"تحميل الصفحة {page_number} من {self.epub_book.pages_count}"
-            )
-        )
+
+def format_size(size: int) -> str:
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f} KiB"
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
 
 
 class WorkerSignals(QObject):
     finished = pyqtSignal()
-    progress = pyqtSignal(str)
-    downloaded = pyqtSignal(Path)
 
 
 class Worker(QRunnable):
-    def __init__(self, downloader: QBookDownloader, output: str) -> None:
+    def __init__(self, downloader: BookDownloader, output: str, connections: int) -> None:
+        """
+        Download job of one book, running in the thread pool with its own event loop and session.
+        Progress is kept on the job and read by the app periodically.
+        """
         super().__init__()
-        self.downloader: QBookDownloader = downloader
+        # Jobs are kept in the queue after they finish, so Qt mustn't delete them
+        self.setAutoDelete(False)
+        self.downloader: BookDownloader = downloader
         self.output: str = output
+        self.connections: int = connections
         self.signals = WorkerSignals()
+        self.status: JobStatus = JobStatus.QUEUED
+        self.error: str = ""
+        self.pages: int = 0
+        self.started_at: float = 0.0
+        self.finished_at: float = 0.0
+        self.output_book: Path | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._cancelled = False
+
+    @property
+    def title(self) -> str:
+        # Info page is set once it's downloaded
+        book_info_page = getattr(self.downloader, "book_info_page", None)
+        return book_info_page.title if book_info_page is not None else self.downloader.url
+
+    @property
+    def pages_count(self) -> int:
+        return self.downloader.epub_book.pages_count
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or monotonic()) - self.started_at
 
     def run(self) -> None:
         """Process the book."""
-        self.downloader.progress = self.signals.progress
-        self.downloader.create_info_page()
-        self.signals.progress.emit(
-            f"بدء العمل على كتاب {self.downloader.book_info_page.title} لمؤلفه {self.downloader.book_info_page.author}"
-        )
-        self.downloader.download()
-        self.signals.progress.emit("حفظ الكتاب")
-        output_book = self.downloader.save_book(self.output)
-        self.signals.downloaded.emit(output_book)
-        self.signals.finished.emit()
+        if self._cancelled:
+            self.status = JobStatus.CANCELLED
+            self.signals.finished.emit()
+            return
+        self.started_at = monotonic()
+        try:
+            asyncio.run(self.download())
+            self.status = JobStatus.SAVING
+            self.output_book = self.downloader.save_book(self.output)
+            self.status = JobStatus.DONE
+        except asyncio.CancelledError:
+            self.status = JobStatus.CANCELLED
+        except Exception as error:
+            logger.exception(f"Failed to download {self.downloader.url}")
+            self.error = str(error)
+            self.status = JobStatus.FAILED
+        finally:
+            self.finished_at = monotonic()
+            self.signals.finished.emit()
+
+    async def download(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        # Cancel requested while the loop was starting
+        if self._cancelled:
+            raise asyncio.CancelledError
+        self.status = JobStatus.STARTING
+        # Exiting the session on cancel closes its connections right away
+        async with get_async_session(self.connections) as session:
+            budget = ConnectionBudget(self.connections)
+            await self.downloader.fetch_info_page(session, budget)
+            self.status = JobStatus.DOWNLOADING
+            self.pages = 1
+            await self.downloader.fetch_book(session, budget, self.update_progress)
+
+    def update_progress(self, _: str | int) -> None:
+        self.pages += 1
+
+    def cancel(self) -> None:
+        """Cancel the download from another thread, it stops at the next page request."""
+        self._cancelled = True
+        if self._loop is None or self._task is None:
+            return
+        # The loop is closed if the job is already finishing
+        with suppress(RuntimeError):
+            self._loop.call_soon_threadsafe(self._task.cancel)
 
 
 class App(QMainWindow):
     download: QPushButton
+    cancel: QPushButton
     statusbar: QLabel
-    url_form: QLabel
+    url_form: QLineEdit
+    jobs: QSpinBox
+    connections: QSpinBox
+    queue: QTableWidget
 
     def __init__(self) -> None:
         """GUI App constructor."""
         super().__init__()
         self.thread_pool: QThreadPool = QThreadPool()
+        self.workers: list[Worker] = []
 
         uic.loadUi(f"{PKG_DIR}/gui/ui.ui", self)
         # self.setWindowIcon(QIcon(f"{WORK_DIR}/assets/books-duotone-512.png"))
         self.center()
+        self.thread_pool.setMaxThreadCount(self.jobs.value())
+        self.jobs.valueChanged.connect(self.thread_pool.setMaxThreadCount)
         self.download.clicked.connect(self.run)
+        self.url_form.returnPressed.connect(self.run)
+        self.cancel.clicked.connect(self.cancel_selected)
+        self.queue.cellDoubleClicked.connect(self.open_book)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh_queue)
         self.statusbar.setText("جاهز")
 
-    def update_statusbar(self, text: str) -> None:
-        self.statusbar.setText(text)
-        self.statusbar.repaint()
-
-    def on_process_complete(self, filepath: Path) -> None:
-        message_box = QMessageBox(
-            QMessageBox.Icon.Information,
-            "اكتمل التحميل",
-            "هل تريد فتح الكتاب الآن؟",
-            QMessageBox.StandardButton.NoButton,
-            self,
-        )
-        message_box.addButton("لا", QMessageBox.ButtonRole.NoRole)
-        open_path_button = message_box.addButton("فتح", QMessageBox.ButtonRole.ActionRole)
-        open_path_button.clicked.connect(partial(browse_file_directory, filepath))
-        message_box.exec()
-
     def show_error_message(self, message: str) -> None:
         message_box = QMessageBox(
             QMessageBox.Icon.Critical, "خطأ", message, QMessageBox.StandardButton.OkButton, self
@@ -98,47 +196,109 @@ class App(QMainWindow):
 
     def choose_output_directory(self) -> str:
         """Opens select file Dialog."""
-        output_directory = QFileDialog().getExistingDirectory(self, "اختر مكان حفظ الكتاب")
+        output_directory = QFileDialog().getExistingDirectory(self, "اختر مكان حفظ الكتب")
         if not output_directory:
-            self.show_error_message("لم تختر مكانا لحفظ الكتاب!")
+            self.show_error_message("لم تختر مكانا لحفظ الكتب!")
             return ""
         return cast(str, output_directory)
 
-    def report_progress(self, progress: str) -> None:
-        self.update_statusbar(progress)
-
-    def on_finish(self) -> None:
-        self.download.setEnabled(True)
-        self.url_form.setEnabled(True)
-        self.url_form.setText("")
-        self.update_statusbar("اكتمل التحميل!")
-
     def run(self) -> None:
-        self.download.setDisabled(True)
-        self.url_form.setDisabled(True)
-        if not self.url_form.text():
+        urls = self.url_form.text().split()
+        if not urls:
             self.show_error_message("لم تدخل رابط الكتاب بعد!")
-            self.download.setEnabled(True)
-            self.url_form.setDisabled(False)
             return
-        downloader = QBookDownloader(self.url_form.text())
-        if not downloader.valid:
-            self.show_error_message("رابط غير صحيح!")
-            self.download.setEnabled(True)
+        connections = self.connections.value()
+        downloaders = [
+            BookDownloader(get_book_url(url), connections, book_index=BookIndex()) for url in urls
+        ]
+        invalid_urls = [downloader.url for downloader in downloaders if not downloader.valid]
+        if invalid_urls:
+            self.show_error_message("روابط غير صحيحة:\n" + "\n".join(invalid_urls))
             return
         output = self.choose_output_directory()
         if not output:
-            self.download.setEnabled(True)
             return
-        self.update_statusbar("تحليل معلومات الرابط")
-        # Create a qrunner and start it in a thread
-        worker = Worker(downloader, output)
-        self.thread_pool.start(worker)
-        # Connect signals and slots
-        worker.signals.progress.connect(self.report_progress)
-        worker.signals.downloaded.connect(self.on_process_complete)
-        # Final resets
-        worker.signals.finished.connect(self.on_finish)
+        if stats.enabled and not any(
+            worker.status not in FINISHED_STATUSES for worker in self.workers
+        ):
+            stats.reset()
+        for downloader in downloaders:
+            worker = Worker(downloader, output, connections)
+            worker.signals.finished.connect(self.refresh_queue)
+            self.workers.append(worker)
+            self.queue.insertRow(self.queue.rowCount())
+            self.thread_pool.start(worker)
+        self.url_form.setText("")
+        self.refresh_queue()
+        self.refresh_timer.start()
+
+    def cancel_selected(self) -> None:
+        rows = {index.row() for index in self.queue.selectionModel().selectedRows()}
+        for row in rows:
+            worker = self.workers[row]
+            if worker.status in FINISHED_STATUSES:
+                continue
+            # Queued jobs are removed from the pool, and running ones are cancelled
+            if self.thread_pool.tryTake(worker):
+                worker.status = JobStatus.CANCELLED
+            else:
+                worker.cancel()
+        self.refresh_queue()
+
+    def open_book(self, row: int, _: int) -> None:
+        output_book = self.workers[row].output_book
+        if output_book is not None:
+            browse_file_directory(output_book)
+
+    def refresh_queue(self) -> None:
+        """Update jobs progress in the queue, and a summary of all jobs in the status bar."""
+        for row, worker in enumerate(self.workers):
+            self.update_row(row, worker)
+        running = sum(worker.status not in FINISHED_STATUSES for worker in self.workers)
+        done = sum(worker.status == JobStatus.DONE for worker in self.workers)
+        pages_per_second = sum(
+            worker.pages / worker.elapsed
+            for worker in self.workers
+            if worker.status == JobStatus.DOWNLOADING and worker.elapsed
+        )
+        self.statusbar.setText(
+            f"اكتمل {done} من {len(self.workers)} كتب، {pages_per_second:.1f} صفحة/ث"
+        )
+        if stats.enabled:
+            self.statusbar.setToolTip(stats.summary())
+        if not running:
+            self.refresh_timer.stop()
+
+    def update_row(self, row: int, worker: Worker) -> None:
+        status = f"{worker.status}: {worker.error}" if worker.error else str(worker.status)
+        pages_count = worker.pages_count
+        elapsed = worker.elapsed
+        pages_per_second = worker.pages / elapsed if worker.pages and elapsed else 0.0
+        eta = ""
+        if worker.status == JobStatus.DOWNLOADING and pages_per_second and pages_count:
+            eta = format_duration(max(pages_count - worker.pages, 0) / pages_per_second)
+        cells = (
+            worker.title,
+            status,
+            f"{worker.pages} / {pages_count}" if pages_count else "",
+            f"{pages_per_second:.1f}" if pages_per_second else "",
+            format_size(worker.downloader.bytes_downloaded),
+            eta,
+        )
+        for column, text in enumerate(cells):
+            item = self.queue.item(row, column)
+            if item is None:
+                self.queue.setItem(row, column, QTableWidgetItem(text))
+            elif item.text() != text:
+                item.setText(text)
+
+    def closeEvent(self, event: QCloseEvent) -> None:  # noqa: N802
+        """Cancel running downloads before closing."""
+        self.thread_pool.clear()
+        for worker in self.workers:
+            worker.cancel()
+        self.thread_pool.waitForDone()
+        event.accept()
 
     def center(self) -> None:
         """Dynamically center the window in screen."""
@@ -154,9 +314,18 @@ class App(QMainWindow):
 
 
 @click.command()
-def gui() -> None:
+@click.option(
+    "--stats",
+    "show_stats",
+    is_flag=True,
+    default=False,
+    help="Show conversion stats in the status bar tooltip",
+)
+def gui(show_stats: bool) -> None:
     """Run Shamela2Epub GUI."""
-
+    setup_logging()
+    if show_stats:
+        stats.enable()
     app = QApplication(sys.argv)
     window = App()
     QFontDatabase.addApplicationFont(f"{PKG_DIR}/assets/NotoNaskhArabic-Regular.ttf")
@@ -1,96 +1,691 @@
 """shamela2epub main."""
 
-import logging
+import asyncio
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, nullcontext
+from math import ceil
 from pathlib import Path
+from typing import BinaryIO
 
-from niquests import codes
+from niquests import AsyncSession
 from tqdm import tqdm
-from urllib3.exceptions import HTTPError
 
 from shamela2epub import OUT_DIR
-from shamela2epub.misc.http_utils import MAX_RETRIES, TIME_OUT, get_session
-from shamela2epub.misc.utils import get_book_first_page_url, get_book_info_page_url, is_valid_url
+from shamela2epub.fetcher import ConnectionBudget, PageFetcher
+from shamela2epub.misc.book_index import BookIndex, IndexedPage, TextIndexWriter
+from shamela2epub.misc.http_utils import get_async_session
+from shamela2epub.misc.page_cache import INFO_PAGE, CachePolicy, PageCache
+from shamela2epub.misc.stats import stats
+from shamela2epub.misc.utils import (
+    get_book_first_page_url,
+    get_book_info_page_url,
+    get_book_page_url,
+    get_info_from_url,
+    is_valid_url,
+)
 from shamela2epub.models.book_html_page import BookHTMLPage
 from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.book_page import BookPage
+from shamela2epub.models.book_shard import (
+    Shard,
+    ShardWriter,
+    read_shard_header,
+    read_shard_pages,
+)
+from shamela2epub.models.chapter_index import ChapterIndex
+from shamela2epub.models.corpus_writer import (
+    CorpusFormat,
+    CorpusPage,
+    CorpusWriter,
+    get_corpus_page,
+)
 from shamela2epub.models.epub_book import EPUBBook
+from shamela2epub.models.page_parser import parse_book_page
+from shamela2epub.models.page_selection import PageSelection
+
+# Pages downloaded along with the info page, before the book pages count is known, so short books
+# are mostly downloaded by the time their first page is parsed
+PREFETCH_PAGES = 8
+# Pages fetched past the last page added to the book at most, which are kept in memory until the
+# pages before them are added, like when one of them is retried
+FETCH_AHEAD = 128
 
 
 class BookDownloader:
     book_info_page: BookInfoHTMLPage
+    _first_page: BookPage
 
-    def __init__(self, url: str, connections: int) -> None:
-        """Book Downloader constructor."""
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        connections: int,
+        parse_workers: int = 0,
+        cache_dir: Path | None = None,
+        cache_policy: CachePolicy = CachePolicy.WRITE,
+        book_index: BookIndex | None = None,
+        shard: Shard | None = None,
+    ) -> None:
+        """
+        Book Downloader constructor.
+        Downloaded pages are cached in `cache_dir` if it's set, and cache policy decides whether
+        cached pages are reused, downloaded again if modified, or only written.
+        Book metadata is recorded in `book_index` if it's set.
+        Only the `shard` of the book pages is downloaded if it's set, see shard_book, and it's
+        cached apart from the book other shards.
+        """
         self.url = url
         self.valid = is_valid_url(self.url)
+        self.book_id = get_info_from_url(url)["bookID"] if self.valid else ""
         self.epub_book = EPUBBook()
-        self._session = get_session(connections)
-        self._chunk_size = connections * 2
+        self._connections = connections
+        self._parse_workers = parse_workers
+        self._shard = shard
+        self._page_cache: PageCache | None = (
+            PageCache(
+                cache_dir,
+                self.book_id,
+                name=f"{self.book_id}.{shard.name}" if shard is not None else "",
+            )
+            if cache_dir is not None and self.valid
+            else None
+        )
+        self._book_index = book_index
+        self._cache_policy = cache_policy
+        # Number of pages that are new or different from the cached ones, which is only counted
+        # when the cache is reused, since comparing pages to the cached ones isn't free
+        self.changed_pages = 0
+        self._track_changes = self._page_cache is not None and cache_policy != CachePolicy.WRITE
         self._progress_bar: tqdm | None = None
+        # Connection budget of the current download
+        self.budget: ConnectionBudget | None = None
+        self._fetchers: list[PageFetcher] = []
+        # Pages that couldn't be downloaded after all retries
+        self.failed_pages: list[int] = []
+        # Output of a book that's saved in volumes while downloading, see split_book
+        self._split_output: str | None = None
+        self._volume_pages = 0
+        self._volume = 1
+        self.volumes: list[Path] = []
+        # Pages selected to be downloaded, see select_pages, all pages if it's not set
+        self._selection: PageSelection | None = None
+        self._selected_pages: range | None = None
+        # Writer of the book pages text, when it's exported instead of an EPUB, see export_book
+        self._corpus_writer: CorpusWriter | None = None
+        # Whether pages text is added to the book index full-text search, see index_text
+        self._index_text = False
+        self._text_index_writer: TextIndexWriter | None = None
+        self._chapter_index = ChapterIndex()
+        # Writer of the downloaded shard of the book pages, see shard_book
+        self._shard_writer: ShardWriter | None = None
+        # Shards the book is assembled from, see load_shards
+        self._shards: list[Path] = []
+        # Pages downloaded before they are known to be in the book, see fetch_info_page
+        self._prefetched: dict[int, asyncio.Task[tuple[str, dict[str, str] | None]]] = {}
+        # Event loop and session of the sync download steps, see create_info_page
+        self._runner: asyncio.Runner | None = None
+        self._session: AsyncSession | None = None
+        self._session_stack = AsyncExitStack()
 
-    def create_info_page(self) -> None:
+    def _page_url(self, page_number: int) -> str:
+        if page_number == INFO_PAGE:
+            return get_book_info_page_url(self.url)
+        return get_book_page_url(self.url, page_number)
+
+    def _get_fetcher(self, session: AsyncSession, budget: ConnectionBudget) -> PageFetcher:
+        self.budget = budget
+        fetcher = PageFetcher(
+            session,
+            self._page_url,
+            budget,
+            self._page_cache,
+            self._cache_policy,
+            self._prefetched,
+        )
+        self._fetchers.append(fetcher)
+        return fetcher
+
+    @property
+    def bytes_downloaded(self) -> int:
+        return sum(fetcher.bytes_downloaded for fetcher in self._fetchers)
+
+    async def _get_page(self, fetcher: PageFetcher, page_number: int) -> tuple[str, str | None]:
+        """Get page HTML, and its previously cached HTML if any."""
+        cached_html = (
+            self._page_cache.get(page_number)
+            if self._page_cache is not None and self._track_changes
+            else None
+        )
+        html, cached = await fetcher.get_page(page_number)
+        return html, html if cached else cached_html
+
+    async def fetch_info_page(self, session: AsyncSession, budget: ConnectionBudget) -> None:
+        """
+        Download the book info page, and the first book pages along with it, which are kept
+        until the book is downloaded, or cancelled once the book pages are known.
+        """
         # Info Page
         url = get_book_info_page_url(self.url)
-        self.book_info_page = BookInfoHTMLPage(url, self._session.get(url, timeout=TIME_OUT).text)
+        fetcher = self._get_fetcher(session, budget)
+        info_page = asyncio.create_task(self._get_page(fetcher, INFO_PAGE))
+        fetcher.prefetch(range(1, min(PREFETCH_PAGES, self._connections) + 1))
+        try:
+            html, cached_html = await info_page
+        except BaseException:
+            self.cancel_prefetch()
+            raise
+        self.book_info_page = BookInfoHTMLPage(url, html)
+        if self._track_changes and cached_html != html:
+            cached_info_page = BookInfoHTMLPage(url, cached_html) if cached_html else None
+            if cached_info_page is None or any(
+                getattr(cached_info_page, field) != getattr(self.book_info_page, field)
+                for field in ("title", "author", "text_content")
+            ):
+                self.changed_pages += 1
         self.epub_book.init()
         self.epub_book.create_info_page(self.book_info_page)
+        if self._book_index is not None:
+            self._book_index.record_info(
+                self.book_id, self.url, self.book_info_page.title, self.book_info_page.author
+            )
+
+    def create_info_page(self) -> None:
+        """
+        Download the book info page in an event loop and a session that are kept for download,
+        so the pages prefetched along with it keep downloading until then. Call close instead
+        if the book isn't downloaded after all.
+        """
+        self._runner = asyncio.Runner()
+        try:
+            self._session = self._runner.run(self._open_session())
+            self._runner.run(
+                self.fetch_info_page(self._session, ConnectionBudget(self._connections))
+            )
+        except BaseException:
+            self._close_runner()
+            raise
+
+    async def _open_session(self) -> AsyncSession:
+        session: AsyncSession = await self._session_stack.enter_async_context(
+            get_async_session(self._connections)
+        )
+        return session
+
+    def _close_runner(self) -> None:
+        if self._runner is None:
+            return
+        try:
+            self._runner.run(self._session_stack.aclose())
+        finally:
+            self._runner.close()
+            self._runner = None
+            self._session = None
+
+    def close(self) -> None:
+        """
+        Stop a book that won't be downloaded after its info page was, or that failed: cancel
+        the prefetched pages, and close the pages cache, and the event loop and session of
+        create_info_page. Books that were downloaded can be closed again.
+        """
+        self.cancel_prefetch()
+        if self._page_cache is not None:
+            self._page_cache.close()
+        self._close_runner()
+
+    def cancel_prefetch(self, keep: range = range(0)) -> None:
+        """Cancel prefetched pages that are not in `keep`, since they aren't needed."""
+        for page_number in [page for page in self._prefetched if page not in keep]:
+            task = self._prefetched.pop(page_number)
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Pages past the book last page fail, which is expected
+                task.exception()
 
-    def create_first_page(self) -> None:
+    async def create_first_page(self, fetcher: PageFetcher) -> None:
         url = get_book_first_page_url(self.url)
-        book_html_page = BookHTMLPage(url, self._session.get(url, timeout=TIME_OUT).text)
+        html, cached_html = await self._get_page(fetcher, 1)
+        book_html_page = BookHTMLPage(url, html)
+        if self._track_changes and cached_html != html:
+            cached_page = BookHTMLPage(url, cached_html) if cached_html else None
+            if (
+                cached_page is None
+                or any(
+                    getattr(cached_page, field) != getattr(book_html_page, field)
+                    for field in ("last_page", "parts_map", "toc")
+                )
+                or cached_page.to_book_page() != book_html_page.to_book_page()
+            ):
+                self.changed_pages += 1
         self.epub_book.set_page_count(book_html_page.last_page)
         self.epub_book.set_parts_map(book_html_page.parts_map)
         self.epub_book.set_toc(book_html_page.toc)
-        self.epub_book.add_page(book_html_page)
+        self._chapter_index = book_html_page.chapter_index
+        self.epub_book.set_chapter_index(self._chapter_index)
+        self._first_page = book_html_page.to_book_page()
+        if self._book_index is not None:
+            self._book_index.record_pages(
+                self.book_id,
+                self.url,
+                self.epub_book.pages_count,
+                list(book_html_page.parts_map),
+                book_html_page.toc,
+            )
+        if self._selection is not None:
+            self._selected_pages = self._selection.resolve(book_html_page)
+        if self._shard_writer is not None:
+            self._selected_pages = self._shard_writer.shard.get_pages(
+                self._selected_pages or range(1, self.epub_book.pages_count + 1)
+            )
+            self._shard_writer.write_header(book_html_page, self._selected_pages)
+        self.cancel_prefetch(
+            self._selected_pages
+            if self._selected_pages is not None
+            else range(1, self.epub_book.pages_count + 1)
+        )
+        if self._index_text and self._book_index is not None:
+            self._text_index_writer = self._book_index.text_writer(
+                self.book_id, self._selected_pages
+            )
+        if self._selected_pages is None or 1 in self._selected_pages:
+            self._add_page(1, self._first_page)
         if self._progress_bar is not None:
-            self._progress_bar.total = self.epub_book.pages_count
-            self._progress_bar.update(1)
+            self._progress_bar.total = (
+                len(self._selected_pages)
+                if self._selected_pages is not None
+                else self.epub_book.pages_count
+            )
+            if self._selected_pages is None or 1 in self._selected_pages:
+                self._progress_bar.update(1)
+
+    async def fetch_book(
+        self,
+        session: AsyncSession,
+        budget: ConnectionBudget,
+        progress_callback: Callable[[str | int], None],
+    ) -> None:
+        """
+        Download the book pages and add them to the EPUB book.
+        The session and connection budget can be shared with other downloaders.
+        """
+        fetcher = self._get_fetcher(session, budget)
+        try:
+            await self.create_first_page(fetcher)
+            await self._download_pages(fetcher, progress_callback)
+        except BaseException:
+            self.epub_book.discard()
+            if self._corpus_writer is not None:
+                self._corpus_writer.discard()
+            if self._shard_writer is not None:
+                self._shard_writer.discard()
+            raise
+        finally:
+            self.cancel_prefetch()
+            if self._page_cache is not None:
+                self._page_cache.close()
+            if self._text_index_writer is not None:
+                self._text_index_writer.close()
 
     def _download(self, progress_callback: Callable[[str | int], None]) -> None:
-        self.create_first_page()
-        # This loop starts from the second page (since the first page is already downloaded)
-        # and goes up to the total number of pages in the book. The step size is equal to the chunk size.
-        for i in range(2, self.epub_book.pages_count + 1, self._chunk_size):
-            responses = []
-            # This inner loop iterates over each page number in the current chunk.
-            # The range starts from the current page number `i` and goes up to
-            # either the end of the current chunk or the total number of pages, whichever is smaller.
-            pages = list(range(i, min(i + self._chunk_size, self.epub_book.pages_count + 1)))
-            for page_number in pages:
-                responses.append(self._session.get(f"{self.url}/{page_number}", timeout=TIME_OUT))
-            for idx, response in enumerate(responses):
-                for _i in range(MAX_RETRIES):
-                    try:
-                        if response.status_code == codes.ok:
-                            break
-                    except (TimeoutError, HTTPError) as err:
-                        logging.warning(f"(try {_i}): {err}")
-                        responses[idx] = self._session.get(
-                            f"{self.url}/{pages[idx]}", timeout=TIME_OUT
-                        )
-                        continue
-                    except Exception as err:  # noqa: BLE001
-                        logging.error(f"Error (try {_i}): {err}")
-                        continue
-                self.epub_book.add_page(BookHTMLPage(response.url, response.text))
-                progress_callback(response.url.split("/")[-1])
+        assert self._runner is not None, "create_info_page must be called first"
+        assert self._session is not None
+        assert self.budget is not None
+        try:
+            self._runner.run(self.fetch_book(self._session, self.budget, progress_callback))
+        finally:
+            self._close_runner()
+
+    def _get_failed_page(self, page_number: int, previous_page: BookPage) -> BookPage:
+        """
+        Get a placeholder for a page that couldn't be downloaded, which keeps its chapters in
+        the TOC until the book is repaired.
+        """
+        url = get_book_page_url(self.url, page_number)
+        return BookPage(
+            url,
+            previous_page.current_page,
+            previous_page.part,
+            f'<div class="nass"><p>تعذر تحميل <a href="{url}">هذه الصفحة</a></p></div>',
+        )
+
+    async def _parse_page(
+        self, page_number: int, html: str | None, cached: bool, pool: ProcessPoolExecutor | None
+    ) -> BookPage | None:
+        """
+        Parse a page, or get it from the cache if the same page was parsed before, when the cache
+        is reused.
+        """
+        if html is None:
+            return None
+        cached_book_page = (
+            self._page_cache.get_parsed(page_number)
+            if self._page_cache is not None and self._track_changes
+            else None
+        )
+        if cached and cached_book_page is not None:
+            stats.count("parsed_cache_hits")
+            return BookPage.from_json(cached_book_page)
+        url = get_book_page_url(self.url, page_number)
+        # Pages parsed in worker processes are timed here, since their own stats are not collected
+        with stats.time("parse_page"):
+            book_page = (
+                await asyncio.get_running_loop().run_in_executor(pool, parse_book_page, url, html)
+                if pool
+                else parse_book_page(url, html)
+            )
+        if self._page_cache is None or not self._track_changes:
+            return book_page
+        if not cached and (
+            cached_book_page is None or BookPage.from_json(cached_book_page) != book_page
+        ):
+            self.changed_pages += 1
+        self._page_cache.put_parsed(page_number, book_page.to_json())
+        return book_page
+
+    async def _parse_pages(
+        self,
+        queue: asyncio.Queue[tuple[int, str | None, bool]],
+        pool: ProcessPoolExecutor | None,
+        parsed_pages: dict[int, asyncio.Future[BookPage | None]],
+    ) -> None:
+        while True:
+            page_number, html, cached = await queue.get()
+            parsed_pages[page_number].set_result(
+                await self._parse_page(page_number, html, cached, pool)
+            )
+
+    async def _download_pages(
+        self, fetcher: PageFetcher, progress_callback: Callable[[str | int], None]
+    ) -> None:
+        # Pages are fetched over a sliding window of requests, starting from the second page
+        # (since the first page is already downloaded), parsed as soon as they arrive,
+        # then added to the book in order.
+        pages = (
+            range(max(self._selected_pages.start, 2), self._selected_pages.stop)
+            if self._selected_pages is not None
+            else range(2, self.epub_book.pages_count + 1)
+        )
+        parsers_count = max(self._parse_workers, 1)
+        queue: asyncio.Queue[tuple[int, str | None, bool]] = asyncio.Queue(
+            maxsize=parsers_count * 2
+        )
+        loop = asyncio.get_running_loop()
+        parsed_pages: dict[int, asyncio.Future[BookPage | None]] = {
+            page_number: loop.create_future() for page_number in pages
+        }
+        with (
+            ProcessPoolExecutor(self._parse_workers) if self._parse_workers else nullcontext()
+        ) as pool:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(
+                    fetcher.fetch(pages, queue, max(FETCH_AHEAD, self._connections * 2))
+                )
+                parsers = [
+                    tasks.create_task(self._parse_pages(queue, pool, parsed_pages))
+                    for _ in range(parsers_count)
+                ]
+                previous_page = self._first_page
+                for page_number in pages:
+                    book_page = await parsed_pages[page_number] or self._get_failed_page(
+                        page_number, previous_page
+                    )
+                    if self._starts_volume(page_number, book_page, previous_page):
+                        await self._save_volume()
+                    self._add_page(page_number, book_page)
+                    del parsed_pages[page_number]
+                    fetcher.consume(page_number)
+                    previous_page = book_page
+                    progress_callback(page_number)
+                for parser in parsers:
+                    parser.cancel()
+            self.failed_pages = sorted(fetcher.failed_pages)
+
+    def _add_page(self, page_number: int, book_page: BookPage) -> None:
+        if self._corpus_writer is not None or self._text_index_writer is not None:
+            corpus_page = get_corpus_page(
+                self.book_id, book_page, self._chapter_index.get(book_page.url)
+            )
+            if self._corpus_writer is not None:
+                self._corpus_writer.write_page(corpus_page)
+            if self._text_index_writer is not None:
+                self._index_page(page_number, corpus_page)
+        if self._shard_writer is not None:
+            self._shard_writer.write_page(book_page)
+        elif self._corpus_writer is None:
+            self.epub_book.add_page(book_page)
+
+    def _index_page(self, page_number: int, corpus_page: CorpusPage) -> None:
+        assert self._text_index_writer is not None
+        footnotes = [f"{footnote.number} {footnote.text}" for footnote in corpus_page.footnotes]
+        if corpus_page.hamesh_continuation:
+            footnotes.insert(0, corpus_page.hamesh_continuation)
+        with stats.time("index_text"):
+            self._text_index_writer.add_page(
+                IndexedPage(
+                    page_number,
+                    corpus_page.url,
+                    corpus_page.part,
+                    corpus_page.page,
+                    corpus_page.chapters,
+                    corpus_page.text,
+                    footnotes,
+                )
+            )
 
     def download(self) -> None:
         self._progress_bar = tqdm(
             desc="Downloading", colour="white", unit=" page", dynamic_ncols=True
         )
-        self._download(lambda page_number: self._progress_bar.update(1))  # type: ignore[union-attr]
+        self._download(self._update_progress)
 
-    def save_book(self, output: str) -> Path:
-        # Generate TOC
-        self.epub_book.generate_toc()
-        # Save to disk
-        book_name = f"{self.book_info_page.title} - {self.book_info_page.author}.epub"
+    def _update_progress(self, _: str | int) -> None:
+        assert self._progress_bar is not None
+        if self.budget is not None:
+            self._progress_bar.set_postfix(connections=self.budget.window, refresh=False)
+        self._progress_bar.update(1)
+
+    def get_output_path(self, output: str, volume: int = 0, extension: str = "epub") -> Path:
+        book_name = f"{self.book_info_page.title} - {self.book_info_page.author}.{extension}"
         if output:
-            output_book = output if output.endswith(".epub") else f"{output}/{book_name}"
+            output_book = Path(
+                output if output.endswith(f".{extension}") else f"{output}/{book_name}"
+            )
         else:
-            output_book = f"{OUT_DIR}/{book_name}"
-        self.epub_book.save_book(output_book)
+            output_book = Path(f"{OUT_DIR}/{book_name}")
+        if not volume:
+            return output_book
+        # Volume numbers are padded, so volumes files are sorted by name
+        volumes_count = (
+            ceil(self.epub_book.pages_count / self._volume_pages)
+            if self._volume_pages
+            else self.epub_book.parts_count
+        )
+        volume_number = str(volume).zfill(max(len(str(volumes_count)), 2))
+        return output_book.with_name(f"{output_book.stem} - {volume_number}{output_book.suffix}")
+
+    def get_volumes_paths(self, output: str) -> list[Path]:
+        """Get the volumes files of the book that were saved before, when it was split."""
+        output_book = self.get_output_path(output)
+        prefix = f"{output_book.stem} - "
+        return sorted(
+            path
+            for path in output_book.parent.glob(f"*{output_book.suffix}")
+            if path.stem.startswith(prefix) and path.stem.removeprefix(prefix).isdigit()
+        )
+
+    def select_pages(self, selection: PageSelection) -> None:
+        """
+        Download only the selected pages of the book, along with its first page, which is needed
+        to find them. The book TOC only has the chapters in these pages.
+        """
+        self._selection = selection
+
+    def split_book(self, output: str, pages: int = 0) -> None:
+        """
+        Save the book in volumes while downloading, one per book part, or one per `pages` pages
+        if it's set, so volumes can be read while the next ones download, and only one volume is
+        kept in memory. A book that ends up in one volume is saved as usual.
+        """
+        self._split_output = output
+        self._volume_pages = pages
+
+    def _starts_volume(
+        self, page_number: int, book_page: BookPage, previous_page: BookPage
+    ) -> bool:
+        if self._split_output is None:
+            return False
+        # A volume starts with the first selected page, even if the book first page isn't in it
+        if self._selected_pages is not None and page_number == self._selected_pages.start:
+            return False
+        if self._volume_pages:
+            return (page_number - 1) % self._volume_pages == 0
+        return book_page.part != previous_page.part
+
+    async def _save_volume(self) -> None:
+        """Save the finished volume, and continue the book in a new volume."""
+        assert self._split_output is not None
+        volume_book = self.epub_book
+        if self._volume == 1:
+            volume_book.set_volume(1)
+        output_book = self.get_output_path(self._split_output, self._volume)
+        self._volume += 1
+        self.epub_book = volume_book.new_volume(self._volume)
+        if volume_book.streaming:
+            self.epub_book.stream_to(self.get_output_path(self._split_output, self._volume))
+        # Other pages keep downloading while the volume is saved
+        await asyncio.to_thread(self._write_book, volume_book, output_book)
+        self.volumes.append(output_book)
+
+    def export_book(self, output: str, corpus_format: CorpusFormat) -> None:
+        """
+        Write the book pages text and footnotes to a JSON lines or a plain text file while
+        downloading, instead of making an EPUB book, for search indexing and text processing.
+        """
+        self._corpus_writer = CorpusWriter(
+            self.get_output_path(output, extension=corpus_format),
+            corpus_format,
+            self.book_info_page,
+        )
+
+    def index_text(self) -> None:
+        """
+        Add the book pages text, footnotes and chapters to the book index full-text search while
+        downloading, so books can be searched without parsing them again.
+        """
+        assert self._book_index is not None, "Indexing text requires a book index"
+        self._index_text = True
+
+    def shard_book(self, output: str) -> None:
+        """
+        Download only the downloader shard of the book pages, and save them parsed to a shard
+        file instead of an EPUB book, so a huge book can be downloaded by many processes or
+        machines at once. Shards are assembled into the book with load_shards and assemble_book.
+        """
+        assert self._shard is not None, "Sharding requires the downloader shard"
+        self._shard_writer = ShardWriter(
+            self.get_output_path(output, extension=self._shard.extension),
+            self._shard,
+            self.url,
+            self.book_info_page,
+        )
+
+    def load_shards(self, shards: list[Path]) -> None:
+        """
+        Start the book from the info and first page in its shards, instead of downloading them.
+        Raises ValueError if the shards aren't of this book, or some of them are missing.
+        """
+        headers = sorted(
+            ((read_shard_header(path), path) for path in shards), key=lambda item: item[0].shard
+        )
+        header = headers[0][0]
+        if any(
+            shard_header.url != self.url or shard_header.shards != header.shards
+            for shard_header, _ in headers
+        ):
+            raise ValueError("Shards are not of the same book, or not split the same way")
+        missing_shards = set(range(1, header.shards + 1)) - {
+            shard_header.shard for shard_header, _ in headers
+        }
+        if missing_shards or len(headers) != header.shards:
+            raise ValueError(
+                f"Missing shards: {', '.join(map(str, sorted(missing_shards)))}"
+                if missing_shards
+                else "Some shards are given more than once"
+            )
+        self.book_info_page = BookInfoHTMLPage(get_book_info_page_url(self.url), header.info_html)
+        self.epub_book.init()
+        self.epub_book.create_info_page(self.book_info_page)
+        self.epub_book.set_page_count(header.pages_count)
+        self.epub_book.set_parts_map(header.parts_map)
+        self.epub_book.set_toc(header.toc)
+        self.epub_book.set_chapter_index(ChapterIndex(header.chapters))
+        self._shards = [path for _, path in headers]
+
+    def assemble_book(self) -> None:
+        """
+        Add the loaded shards pages to the book in order, the same way downloaded pages are, so
+        duplicate pages numbers, color classes, chapters and footnotes continued from previous
+        pages are all handled across shards.
+        """
+        failed_pages: list[int] = []
+        try:
+            for path in self._shards:
+                for book_page in read_shard_pages(path, failed_pages):
+                    self.epub_book.add_page(book_page)
+        except BaseException:
+            self.epub_book.discard()
+            raise
+        self.failed_pages = failed_pages
+
+    def stream_book(self, output: str) -> None:
+        """Write the book pages to the output file while downloading, to keep memory usage low."""
+        output_book = self.get_output_path(output)
+        output_book.parent.mkdir(parents=True, exist_ok=True)
+        self.epub_book.stream_to(output_book)
+
+    def write_book(self, sink: BinaryIO) -> None:
+        """Write the book to a binary file-like object, like an open file or a BytesIO."""
+        self.epub_book.generate_toc()
+        self.epub_book.save_book(sink)
+
+    @staticmethod
+    def _write_book(epub_book: EPUBBook, output_book: Path) -> None:
+        # Generate TOC
+        epub_book.generate_toc()
+        # Save to disk
+        output_book.parent.mkdir(parents=True, exist_ok=True)
+        epub_book.save_book(str(output_book))
+
+    def save_book(self, output: str) -> Path:
+        if self._corpus_writer is not None:
+            return self._save_corpus()
+        if self._shard_writer is not None:
+            return self._save_shard()
+        output_book = self.get_output_path(output, self._volume if self._volume > 1 else 0)
+        self._write_book(self.epub_book, output_book)
+        if self.volumes:
+            self.volumes.append(output_book)
+        # Sizes of books with only some pages selected would be misleading
+        if self._book_index is not None and self._selection is None:
+            self._book_index.record_conversion(
+                self.book_id,
+                self.url,
+                sum(volume.stat().st_size for volume in self.volumes or [output_book]),
+            )
+        if self._progress_bar is not None:
+            self._progress_bar.close()
+        return output_book
+
+    def _save_shard(self) -> Path:
+        assert self._shard_writer is not None
+        self._shard_writer.close(self.failed_pages)
+        if self._progress_bar is not None:
+            self._progress_bar.close()
+        return self._shard_writer.path
+
+    def _save_corpus(self) -> Path:
+        assert self._corpus_writer is not None
+        self._corpus_writer.close()
         if self._progress_bar is not None:
             self._progress_bar.close()
-        return Path(output_book)
+        return self._corpus_writer.path
@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import sys
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from hashlib import sha1
+from pathlib import Path
+from time import time
+from typing import Any
+
+from shamela2epub.misc.patterns import ARABIC_DIACRITICS_PATTERN
+
+
+def get_data_dir() -> Path:
+    """Get the user data directory of the app, where each platform keeps apps data."""
+    if sys.platform == "win32":
+        data_dir = Path(os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local")
+    elif sys.platform == "darwin":
+        data_dir = Path.home() / "Library" / "Application Support"
+    else:
+        data_dir = Path(os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share")
+    return data_dir / "shamela2epub"
+
+
+# The index is kept with the user data, so it's shared by every installation of the app
+INDEX_FILE = get_data_dir() / "index.sqlite"
+# Seconds to wait for other processes writing to the index
+BUSY_TIMEOUT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    pages INTEGER,
+    parts TEXT,
+    toc_hash TEXT,
+    size INTEGER,
+    converted_at REAL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Full-text index of books pages, with Arabic diacritics left out, so words are found with or
+# without them. Pages of a book are found by their book ID and page number in the book URLs.
+TEXT_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_text USING fts5 (
+    text,
+    footnotes,
+    chapter,
+    book_id UNINDEXED,
+    page_number UNINDEXED,
+    part UNINDEXED,
+    page UNINDEXED,
+    url UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+# Pages written to the full-text index in each transaction
+TEXT_BATCH_SIZE = 100
+# Number of words around the matched words in search results
+SNIPPET_WORDS = 12
+
+
+@dataclass(slots=True)
+class BookRecord:
+    book_id: int
+    url: str
+    title: str
+    author: str
+    pages: int | None
+    parts: list[str] = field(default_factory=list)
+    toc_hash: str | None = None
+    # Size of the last converted EPUB, in bytes
+    size: int | None = None
+    converted_at: float | None = None
+    updated_at: float = 0.0
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "BookRecord":
+        return cls(**{**dict(row), "parts": json.loads(row["parts"] or "[]")})
+
+
+@dataclass(slots=True)
+class IndexedPage:
+    page_number: int
+    url: str
+    part: str
+    page: str
+    chapters: list[str]
+    text: str
+    footnotes: list[str] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class PageMatch:
+    book_id: int
+    title: str
+    author: str
+    part: str
+    page: str
+    chapter: str
+    url: str
+    snippet: str
+
+
+def normalize_text(text: str) -> str:
+    return ARABIC_DIACRITICS_PATTERN.sub("", text)
+
+
+def get_match_query(query: str) -> str:
+    """Get an FTS5 query of pages that have all the query words, in any order."""
+    return " ".join(
+        '"{}"'.format(word.replace('"', '""')) for word in normalize_text(query).split()
+    )
+
+
+def get_toc_hash(toc: list[Any]) -> str:
+    return sha1(json.dumps(toc, ensure_ascii=False).encode(), usedforsecurity=False).hexdigest()
+
+
+class TextIndexWriter:
+    def __init__(self, path: Path, book_id: str, pages: range | None = None) -> None:
+        """
+        Writer of a book pages text to the full-text index while the book downloads, in batches
+        of pages each written in one transaction, so the index isn't locked for every page.
+        Pages of the book that were indexed before, only the selected `pages` if they're set,
+        are replaced.
+        """
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self._book_id = int(book_id)
+        self._rows: list[tuple[Any, ...]] = []
+        # Chapter of the last page, which continues on the next pages until another one starts
+        self._chapter = ""
+        with self._connection:
+            self._connection.execute(TEXT_SCHEMA)
+            if pages is None:
+                self._connection.execute(
+                    "DELETE FROM pages_text WHERE book_id = ?", (self._book_id,)
+                )
+            else:
+                self._connection.execute(
+                    "DELETE FROM pages_text WHERE book_id = ? AND page_number BETWEEN ? AND ?",
+                    (self._book_id, pages.start, pages.stop - 1),
+                )
+
+    def add_page(self, page: IndexedPage) -> None:
+        """Add a page to the index, pages must be added in order."""
+        if page.chapters:
+            self._chapter = page.chapters[-1]
+        self._rows.append(
+            (
+                normalize_text(page.text),
+                normalize_text("\n".join(page.footnotes)),
+                normalize_text("\n".join(page.chapters) or self._chapter),
+                self._book_id,
+                page.page_number,
+                page.part,
+                page.page,
+                page.url,
+            )
+        )
+        if len(self._rows) >= TEXT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO pages_text (text, footnotes, chapter, book_id, page_number, part, page, "
+                "url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._rows,
+            )
+        self._rows.clear()
+
+    def close(self) -> None:
+        """Write the remaining pages, and close the index."""
+        self.flush()
+        self._connection.close()
+
+
+class BookIndex:
+    def __init__(self, path: Path = INDEX_FILE) -> None:
+        """
+        Local index of books metadata, recorded while converting them, so books can be looked up
+        and planned without requesting Shamela again.
+        Each update opens its own connection, so the index can be updated from any thread or
+        process.
+        """
+        self.path = path
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)) as connection:
+            connection.row_factory = sqlite3.Row
+            connection.execute(SCHEMA)
+            with connection:
+                yield connection
+
+    def _update(self, book_id: str, url: str, fields: dict[str, Any]) -> None:
+        columns = ", ".join(fields)
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT INTO books (book_id, url, updated_at, {columns}) "  # noqa: S608
+                f"VALUES (?, ?, ?, {', '.join('?' * len(fields))}) "
+                f"ON CONFLICT (book_id) DO UPDATE SET url = excluded.url, "
+                f"updated_at = excluded.updated_at, "
+                f"{', '.join(f'{column} = excluded.{column}' for column in fields)}",
+                (int(book_id), url, time(), *fields.values()),
+            )
+
+    def record_info(self, book_id: str, url: str, title: str, author: str) -> None:
+        self._update(book_id, url, {"title": title, "author": author})
+
+    def record_pages(
+        self, book_id: str, url: str, pages: int, parts: list[str], toc: list[Any]
+    ) -> None:
+        self._update(
+            book_id,
+            url,
+            {
+                "pages": pages,
+                "parts": json.dumps(parts, ensure_ascii=False),
+                "toc_hash": get_toc_hash(toc),
+            },
+        )
+
+    def record_conversion(self, book_id: str, url: str, size: int) -> None:
+        self._update(book_id, url, {"size": size, "converted_at": time()})
+
+    def get(self, book_id: str) -> BookRecord | None:
+        if not self.path.exists():
+            return None
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT * FROM books WHERE book_id = ?", (int(book_id),)
+            ).fetchone()
+        return BookRecord.from_row(row) if row is not None else None
+
+    def search(self, query: str = "", limit: int = 50) -> list[BookRecord]:
+        """Find books whose title or author contains the query, or all books if it's empty."""
+        if not self.path.exists():
+            return []
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT * FROM books WHERE title LIKE ?1 OR author LIKE ?1 ORDER BY title LIMIT ?2",
+                (f"%{query}%", limit),
+            ).fetchall()
+        return [BookRecord.from_row(row) for row in rows]
+
+    def text_writer(self, book_id: str, pages: range | None = None) -> TextIndexWriter:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return TextIndexWriter(self.path, book_id, pages)
+
+    def search_text(self, query: str, limit: int = 50) -> list[PageMatch]:
+        """Find indexed pages that have all the query words, best matches first."""
+        match_query = get_match_query(query)
+        if not self.path.exists() or not match_query:
+            return []
+        with self._connect() as connection:
+            connection.execute(TEXT_SCHEMA)
+            rows = connection.execute(
+                "SELECT pages_text.book_id, coalesce(books.title, '') AS title, "
+                "coalesce(books.author, '') AS author, pages_text.part, pages_text.page, "
+                "pages_text.chapter, pages_text.url, "
+                "snippet(pages_text, -1, '[', ']', '...', ?1) AS snippet "
+                "FROM pages_text LEFT JOIN books ON books.book_id = pages_text.book_id "
+                "WHERE pages_text MATCH ?2 ORDER BY pages_text.rank LIMIT ?3",
+                (SNIPPET_WORDS, match_query, limit),
+            ).fetchall()
+        return [PageMatch(**dict(row)) for row in rows]
@@ -1,21 +1,63 @@
-from niquests import Session
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+
+from niquests import AsyncSession, Response
 from urllib3 import Retry
 
 TIME_OUT = 60
 MAX_RETRIES = 10
 
+VALIDATOR_HEADERS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+
+BACKOFF_FACTOR = 0.1
+
+# Rate limiting (429, 503) and read timeouts are retried by the pages fetcher instead, so that its
+# connection budget can back off
 retry_strategy = Retry(
     total=MAX_RETRIES,
-    status_forcelist=[429, 500, 502, 503, 504],
+    read=False,
+    status_forcelist=[500, 502, 504],
     allowed_methods=["GET"],
-    backoff_factor=0.1,
+    backoff_factor=BACKOFF_FACTOR,
 )
 
 
-def get_session(connections: int) -> Session:
-    return Session(
+def get_async_session(connections: int) -> AsyncSession:
+    return AsyncSession(
         resolver="doh+cloudflare://",
-        multiplexed=True,
         retries=retry_strategy,
-        pool_maxsize=connections * 3,
+        pool_maxsize=connections,
     )
+
+
+def get_retry_after(response: Response) -> float | None:
+    """Get the number of seconds to wait before retrying, from the response Retry-After header."""
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=UTC)
+    return max((retry_date - datetime.now(UTC)).total_seconds(), 0.0)
+
+
+def get_validators(response: Response) -> dict[str, str]:
+    """Get response headers that can be used later to send a conditional request."""
+    return {
+        header: response.headers[header]
+        for header in VALIDATOR_HEADERS
+        if response.headers.get(header)
+    }
+
+
+def get_conditional_headers(validators: dict[str, str]) -> dict[str, str]:
+    return {
+        VALIDATOR_HEADERS[header]: value
+        for header, value in validators.items()
+        if header in VALIDATOR_HEADERS
+    }
@@ -0,0 +1,33 @@
+import logging
+from logging.handlers import TimedRotatingFileHandler
+from sys import stderr, stdout
+
+from shamela2epub import PARENT_DIR
+
+LOG_FILE = PARENT_DIR / "last_run.log"
+LOG_FORMAT = (
+    "%(asctime)s [%(levelname)s] %(name)s [%(module)s.%(funcName)s:%(lineno)d]: %(message)s"
+)
+
+
+def setup_logging() -> None:
+    """
+    Log to the console and to the last run log file.
+    Called by entry points instead of on import, and only once, since commands can be entered
+    from more than one entry point.
+    """
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    logging.basicConfig(filename=str(LOG_FILE), filemode="w", format=LOG_FORMAT)
+    out = logging.StreamHandler(stdout)
+    err = logging.StreamHandler(stderr)
+    out.setFormatter(formatter)
+    err.setFormatter(formatter)
+    out.setLevel(logging.INFO)
+    err.setLevel(logging.WARNING)
+    root_logger.addHandler(out)
+    root_logger.addHandler(err)
+    root_logger.addHandler(TimedRotatingFileHandler(LOG_FILE, when="d", interval=1, backupCount=3))
+    root_logger.setLevel(logging.INFO)
@@ -0,0 +1,395 @@
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, suppress
+from enum import IntEnum, StrEnum
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import shamela2epub
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAGIC = b"S2EPC3\n"
+# Marks the start of each record, so records after a corrupt one can still be found
+RECORD_MARKER = b"\x00S2R"
+# marker, page number, record kind, metadata length, compressed data length
+RECORD_HEADER = struct.Struct("<4siBHI")
+COMPRESSION_LEVEL = 3
+SYNC_INTERVAL = 64
+MAX_CACHE_SIZE = 2048 * 1024 * 1024
+# Share of outdated records, replaced by newer ones of the same pages, that gets a pack rewritten
+COMPACT_THRESHOLD = 0.5
+INFO_PAGE = 0
+
+# Packs are written under an exclusive lock of their lock file, and are shared by the processes
+# they are open in until they're closed, so they aren't evicted while they're in use
+if sys.platform == "win32":
+    import msvcrt
+
+    def lock_file(file: BinaryIO) -> None:
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after trying for 10 seconds
+                continue
+
+    def share_file(file: BinaryIO) -> None:
+        # Files that are open in any process can't be removed on Windows
+        pass
+
+    def remove_unused_pack(path: Path, lock_path: Path) -> bool:
+        try:
+            path.unlink()
+        except OSError:
+            return False
+        # The lock file stays while another process is about to write to a new pack
+        with suppress(OSError):
+            lock_path.unlink()
+        return True
+
+else:
+    import fcntl
+
+    def lock_file(file: BinaryIO) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+    def share_file(file: BinaryIO) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+
+    def remove_unused_pack(path: Path, lock_path: Path) -> bool:
+        try:
+            with path.open("rb") as pack, lock_path.open("a+b") as lock:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(pack.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if not is_current(path, pack):
+                    return False
+                path.unlink()
+                lock_path.unlink()
+        except OSError:
+            return False
+        return True
+
+
+def is_current(path: Path, file: BinaryIO) -> bool:
+    """Whether an open file is still the file at its path, and wasn't replaced or removed."""
+    try:
+        return os.path.samestat(path.stat(), os.fstat(file.fileno()))
+    except FileNotFoundError:
+        return False
+
+
+def open_current(path: Path, lock: Callable[[BinaryIO], None]) -> BinaryIO:
+    """Open a file and lock it, opening it again if it was replaced or removed meanwhile."""
+    while True:
+        file = path.open("a+b")
+        lock(file)
+        if is_current(path, file):
+            return file
+        file.close()
+
+
+class CachePolicy(StrEnum):
+    # Only write downloaded pages to the cache
+    WRITE = "write"
+    # Use cached pages instead of downloading them again
+    RESUME = "resume"
+    # Download cached pages again only if they were modified
+    REFRESH = "refresh"
+
+
+class RecordKind(IntEnum):
+    HTML = 0
+    PARSED = 1
+
+
+RECORD_KINDS = frozenset(RecordKind)
+
+
+def append_record(
+    pack: BinaryIO, page_number: int, kind: RecordKind, metadata: dict[str, str], data: bytes
+) -> int:
+    """Append a record to a pack, and get the offset of its data."""
+    encoded_metadata = json.dumps(metadata).encode() if metadata else b""
+    data_offset = pack.seek(0, os.SEEK_END) + RECORD_HEADER.size + len(encoded_metadata)
+    pack.write(
+        RECORD_HEADER.pack(RECORD_MARKER, page_number, kind, len(encoded_metadata), len(data))
+    )
+    pack.write(encoded_metadata)
+    pack.write(data)
+    return data_offset
+
+
+def read_record(
+    pack: BinaryIO, offset: int, pack_size: int
+) -> tuple[int, RecordKind, int, int, dict[str, str]] | None:
+    """
+    Get a record page number, kind, data offset, data length and metadata, or None if there's
+    no valid record at the offset.
+    """
+    pack.seek(offset)
+    header = pack.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    marker, page_number, kind, meta_length, length = RECORD_HEADER.unpack(header)
+    data_offset = offset + RECORD_HEADER.size + meta_length
+    if (
+        marker != RECORD_MARKER
+        or kind not in RECORD_KINDS
+        or page_number < INFO_PAGE
+        or data_offset + length > pack_size
+    ):
+        return None
+    try:
+        metadata: Any = json.loads(pack.read(meta_length) or b"{}")
+    except ValueError:
+        return None
+    if not isinstance(metadata, dict):
+        return None
+    return page_number, RecordKind(kind), data_offset, length, metadata
+
+
+def find_record(pack: BinaryIO, offset: int) -> int | None:
+    """Find the offset of the next record marker from the offset, if any."""
+    pack.seek(offset)
+    position = pack.read().find(RECORD_MARKER)
+    return offset + position if position >= 0 else None
+
+
+def is_cut_short(pack: BinaryIO, offset: int, pack_size: int) -> bool:
+    """Whether the last record of a pack was cut short, when it was interrupted while writing it."""
+    pack.seek(offset)
+    header = pack.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return RECORD_MARKER.startswith(header[: len(RECORD_MARKER)])
+    marker, _, _, meta_length, length = RECORD_HEADER.unpack(header)
+    record_size: int = RECORD_HEADER.size + meta_length + length
+    return marker == RECORD_MARKER and offset + record_size > pack_size
+
+
+class PageCache:
+    def __init__(
+        self,
+        cache_dir: Path,
+        book_id: str,
+        max_size: int = MAX_CACHE_SIZE,
+        sync_interval: int = SYNC_INTERVAL,
+        name: str = "",
+    ) -> None:
+        """
+        Book pages cache, holding pages raw HTML with their HTTP validators and parsed pages.
+        Each book pages are appended as compressed records to a single pack file, which is synced
+        to disk every `sync_interval` records, and named after the book ID, or `name` if it's set.
+        The pack is locked while writing to it, so it can be shared by many processes, and it's
+        rewritten without its outdated records once they are too many.
+        Least recently used books are evicted once the cache size exceeds `max_size` bytes,
+        unless their packs are open.
+        """
+        self.cache_dir = cache_dir
+        self.path = cache_dir / f"{name or book_id}.pack"
+        self.lock_path = self.path.with_name(f"{self.path.name}.lock")
+        self._max_size = max_size
+        self._sync_interval = sync_interval
+        self._index: dict[RecordKind, dict[int, tuple[int, int, dict[str, str]]]] = {
+            kind: {} for kind in RecordKind
+        }
+        # Records in the pack, including outdated ones
+        self._records = 0
+        self._unsynced = 0
+        self._pack: BinaryIO | None = None
+        if self.path.exists():
+            with self._lock():
+                pass
+
+    @contextmanager
+    def _lock(self) -> Iterator[BinaryIO]:
+        """
+        Lock the pack, so other processes don't write to it at the same time. The pack index is
+        loaded when it's opened, and loaded again if another process rewrote or removed the pack.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open_current(self.lock_path, lock_file):
+            if self._pack is None or not is_current(self.path, self._pack):
+                if self._pack is not None:
+                    self._pack.close()
+                self._pack = open_current(self.path, share_file)
+                self._load_index()
+            try:
+                yield self._pack
+            finally:
+                self._pack.flush()
+
+    def _load_index(self) -> None:
+        """
+        Index the pack records, skipping corrupt records. A record cut short by an interrupted
+        run is dropped, and the pack is rewritten if it has corrupt records, or too many outdated
+        records. The pack must be locked.
+        """
+        assert self._pack is not None
+        pack = self._pack
+        self._index = {kind: {} for kind in RecordKind}
+        self._records = 0
+        pack_size = pack.seek(0, os.SEEK_END)
+        if not pack_size:
+            pack.write(CACHE_MAGIC)
+            return
+        pack.seek(0)
+        corrupt = pack.read(len(CACHE_MAGIC)) != CACHE_MAGIC
+        offset = 0 if corrupt else len(CACHE_MAGIC)
+        while offset < pack_size:
+            record = read_record(pack, offset, pack_size)
+            if record is None:
+                next_offset = find_record(pack, offset + 1)
+                if next_offset is None and is_cut_short(pack, offset, pack_size):
+                    pack.truncate(offset)
+                    break
+                corrupt = True
+                if next_offset is None:
+                    break
+                offset = next_offset
+                continue
+            page_number, kind, data_offset, length, metadata = record
+            self._index[kind][page_number] = (data_offset, length, metadata)
+            # A newer page HTML makes its previously parsed page outdated
+            if kind == RecordKind.HTML:
+                self._index[RecordKind.PARSED].pop(page_number, None)
+            self._records += 1
+            offset = data_offset + length
+        if corrupt:
+            logger.warning(f"Dropping corrupt records of cache file {self.path}")
+        outdated = self._records - sum(len(records) for records in self._index.values())
+        if corrupt or (outdated and outdated >= self._records * COMPACT_THRESHOLD):
+            self._rewrite()
+
+    def _rewrite(self) -> None:
+        """Rewrite the pack with only its indexed records. The pack must be locked."""
+        assert self._pack is not None
+        partial_path = self.path.with_name(f"{self.path.name}.part")
+        partial_path.unlink(missing_ok=True)
+        new_pack = partial_path.open("a+b")
+        share_file(new_pack)
+        index: dict[RecordKind, dict[int, tuple[int, int, dict[str, str]]]] = {
+            kind: {} for kind in RecordKind
+        }
+        try:
+            new_pack.write(CACHE_MAGIC)
+            # Pages HTML are written first, since they outdate parsed pages written before them
+            for kind, records in self._index.items():
+                for page_number, (offset, length, metadata) in records.items():
+                    self._pack.seek(offset)
+                    data = self._pack.read(length)
+                    index[kind][page_number] = (
+                        append_record(new_pack, page_number, kind, metadata, data),
+                        length,
+                        metadata,
+                    )
+            new_pack.flush()
+            os.fsync(new_pack.fileno())
+            partial_path.replace(self.path)
+        except OSError as err:
+            # Files that are open can't be replaced on Windows
+            logger.warning(f"Couldn't rewrite cache file {self.path}: {err}")
+            new_pack.close()
+            partial_path.unlink(missing_ok=True)
+            return
+        self._pack.close()
+        self._pack = new_pack
+        self._index = index
+        self._records = sum(len(records) for records in index.values())
+
+    def __contains__(self, page_number: int) -> bool:
+        return page_number in self._index[RecordKind.HTML]
+
+    def __len__(self) -> int:
+        return len(self._index[RecordKind.HTML])
+
+    def _read(self, kind: RecordKind, page_number: int) -> str | None:
+        if page_number not in self._index[kind] or self._pack is None:
+            return None
+        offset, length, _ = self._index[kind][page_number]
+        self._pack.seek(offset)
+        try:
+            return zlib.decompress(self._pack.read(length)).decode()
+        except (zlib.error, UnicodeDecodeError):
+            logger.warning(f"Ignoring corrupt page {page_number} of cache file {self.path}")
+            del self._index[kind][page_number]
+            return None
+
+    def _write(
+        self, kind: RecordKind, page_number: int, data: str, metadata: dict[str, str]
+    ) -> None:
+        compressed_data = zlib.compress(data.encode(), COMPRESSION_LEVEL)
+        with self._lock() as pack:
+            data_offset = append_record(pack, page_number, kind, metadata, compressed_data)
+        self._index[kind][page_number] = (data_offset, len(compressed_data), metadata)
+        self._records += 1
+        self._unsynced += 1
+        if self._unsynced >= self._sync_interval:
+            self.sync()
+
+    def get(self, page_number: int) -> str | None:
+        return self._read(RecordKind.HTML, page_number)
+
+    def get_validators(self, page_number: int) -> dict[str, str]:
+        """Get the cached page HTTP validators (ETag and Last-Modified headers)."""
+        return self._index[RecordKind.HTML].get(page_number, (0, 0, {}))[2]
+
+    def put(self, page_number: int, html: str, validators: dict[str, str] | None = None) -> None:
+        self._write(RecordKind.HTML, page_number, html, validators or {})
+
+    def get_parsed(self, page_number: int) -> str | None:
+        """Get the cached parsed page, if it was parsed by the current version."""
+        record = self._index[RecordKind.PARSED].get(page_number)
+        if record is None or record[2].get("version") != shamela2epub.__version__:
+            return None
+        return self._read(RecordKind.PARSED, page_number)
+
+    def put_parsed(self, page_number: int, parsed_page: str) -> None:
+        self._write(
+            RecordKind.PARSED, page_number, parsed_page, {"version": shamela2epub.__version__}
+        )
+
+    def sync(self) -> None:
+        if self._pack is None or not self._unsynced:
+            return
+        os.fsync(self._pack.fileno())
+        self._unsynced = 0
+
+    def evict(self) -> None:
+        """
+        Remove least recently used books caches until the cache fits its max size, except packs
+        that are open in any process.
+        """
+        packs = sorted(
+            (pack.stat().st_mtime, pack.stat().st_size, pack)
+            for pack in self.cache_dir.glob("*.pack")
+        )
+        cache_size = sum(size for _, size, _ in packs)
+        for _, size, pack in packs:
+            if cache_size <= self._max_size:
+                break
+            if pack == self.path or not remove_unused_pack(
+                pack, pack.with_name(f"{pack.name}.lock")
+            ):
+                continue
+            logger.info(f"Evicted {pack.name} from the pages cache")
+            cache_size -= size
+
+    def close(self) -> None:
+        """Sync the pack, rewrite it if too many of its records are outdated, and close it."""
+        if self._pack is not None:
+            self.sync()
+            with self._lock():
+                # Other processes may have written to the pack since it was loaded
+                self._load_index()
+            self._pack.close()
+            self._pack = None
+        if self.cache_dir.exists():
+            self.evict()
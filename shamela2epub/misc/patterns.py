@@ -24,6 +24,24 @@ ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN: Pattern = re.compile(r"(?P<number>\([\u0
 ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN: Pattern = re.compile(r"{.+?(\([\u0660-\u0669]+\)).+?}")
 
 
+# Arabic diacritics (tashkeel) and tatweel, which are left out of the full-text index
+ARABIC_DIACRITICS_PATTERN: Pattern = re.compile(r"[\u0640\u064b-\u065f\u0670]")
+
+HTML_PARAGRAPH_PATTERN: Pattern = re.compile(r"<p(?P<attributes>(?:\s[^>]*)?)>.*?</p>", re.DOTALL)
+HTML_LIST_TAG_PATTERN: Pattern = re.compile(r"<(?P<closing>/?)ul\b[^>]*>", re.IGNORECASE)
+HTML_DIV_TAG_PATTERN: Pattern = re.compile(r"<(?P<closing>/?)div\b[^>]*>", re.IGNORECASE)
+HAMESH_CLASS_PATTERN: Pattern = re.compile(r'class="(?:[^"]*\s)?hamesh[\s"]')
+
 # HTML_CLASS_PATTERN = re.compile(r' class="(.*?)"')  # r' class="[\w\d -]+"'
-HTML_STYLE_PATTERN = re.compile(r' style="(.*?)"')
 PARENT_DIV_CLASS_PATTERN = re.compile(r' class="nass margin-top-10"')
+
+# Book page fields, scanned without parsing the page
+PAGE_CONTENT_START_PATTERN: Pattern = re.compile(
+    r'<(?P<tag>\w+)[^>]*?\sclass="(?:[^"]*\s)?nass[\s"]'
+)
+PAGE_NUMBER_PATTERN: Pattern = re.compile(
+    r'<input[^>]*?\sid="fld_goto_bottom"\s+value="(?P<page>[^"]*)"'
+)
+PAGE_PART_PATTERN: Pattern = re.compile(
+    r'id="fld_part_top"[^>]*>\s*<div[^>]*>\s*<button[^>]*>(?P<part>[^<]*)<'
+)
@@ -0,0 +1,165 @@
+import json
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Any
+
+# Upper bounds of stage timing histograms buckets, in seconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PREFIX = "shamela2epub"
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "max", "sum")
+
+    def __init__(self) -> None:
+        """Stage timing histogram, with a last bucket for values beyond the largest bound."""
+        self.buckets = [0] * (len(STAGE_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(STAGE_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, quantile: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        rank = quantile * self.count
+        seen = 0
+        for bound, bucket_count in zip(STAGE_BUCKETS, self.buckets, strict=False):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([*map(str, STAGE_BUCKETS), "+Inf"], self.buckets, strict=True)),
+        }
+
+
+class Stats:
+    def __init__(self) -> None:
+        """
+        Conversion stages timing histograms and counters.
+        Collecting is disabled by default, so that timing a stage costs a single check.
+        Subscribers are called with the stage or counter name and its new value on every update,
+        from the thread that made it.
+        """
+        self.enabled = False
+        self.stages: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self._subscribers: list[Callable[[str, float], None]] = []
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def subscribe(self, callback: Callable[[str, float], None]) -> None:
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[str, float], None]) -> None:
+        self._subscribers.remove(callback)
+
+    def _notify(self, name: str, value: float) -> None:
+        for callback in self._subscribers:
+            callback(name, value)
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._notify(name, value)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+        self._notify(stage, seconds)
+
+    def time(self, stage: str) -> AbstractContextManager[None]:
+        """Time a stage, unless collecting is disabled."""
+        if not self.enabled:
+            return _DISABLED
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def _snapshot(self) -> tuple[dict[str, Histogram], dict[str, int]]:
+        # Stats can be updated from other threads while they're reported
+        with self._lock:
+            return dict(self.stages), dict(self.counters)
+
+    def summary(self) -> str:
+        stages, counters = self._snapshot()
+        lines = [f"{'stage':<12}{'count':>8}{'total s':>10}{'mean ms':>10}{'p99 ms':>10}"]
+        for stage, histogram in stages.items():
+            lines.append(
+                f"{stage:<12}{histogram.count:>8}{histogram.sum:>10.2f}"
+                f"{histogram.sum / histogram.count * 1000:>10.2f}"
+                f"{histogram.quantile(0.99) * 1000:>10.1f}"
+            )
+        lines.extend(f"{name}: {value}" for name, value in counters.items())
+        return "\n".join(lines)
+
+    def to_json(self) -> dict[str, Any]:
+        stages, counters = self._snapshot()
+        return {
+            "stages": {stage: histogram.to_json() for stage, histogram in stages.items()},
+            "counters": counters,
+        }
+
+    def to_prometheus(self) -> str:
+        """Get stats in Prometheus text exposition format."""
+        stages, counters = self._snapshot()
+        name = f"{METRICS_PREFIX}_stage_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        for stage, histogram in stages.items():
+            cumulative = 0
+            for bound, bucket_count in zip(
+                [*map(str, STAGE_BUCKETS), "+Inf"], histogram.buckets, strict=True
+            ):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        for counter, value in counters.items():
+            lines.append(f"# TYPE {METRICS_PREFIX}_{counter}_total counter")
+            lines.append(f"{METRICS_PREFIX}_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Path) -> None:
+        """Write stats to a JSON file if its extension is .json, or in Prometheus format."""
+        path.write_text(
+            json.dumps(self.to_json(), indent=2) if path.suffix == ".json" else self.to_prometheus()
+        )
+
+
+stats = Stats()
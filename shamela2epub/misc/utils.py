@@ -18,11 +18,21 @@ def get_info_from_url(url: str) -> dict[str, str]:
     return match.groupdict()
 
 
+def get_book_url(book: str) -> str:
+    """Get book URL from a book URL or ID."""
+    return f"https://{SHAMELA_DOMAIN}/{BOOK_RESOURCE}/{book}" if book.isdigit() else book
+
+
 def get_book_first_page_url(url: str) -> str:
     info: dict[str, str] = get_info_from_url(url)
     return f"https://{SHAMELA_DOMAIN}/{BOOK_RESOURCE}/{info['bookID']}/1"
 
 
+def get_book_page_url(url: str, page_number: int) -> str:
+    info: dict[str, str] = get_info_from_url(url)
+    return f"https://{SHAMELA_DOMAIN}/{BOOK_RESOURCE}/{info['bookID']}/{page_number}"
+
+
 def get_book_info_page_url(url: str) -> str:
     info: dict[str, str] = get_info_from_url(url)
     return f"https://{SHAMELA_DOMAIN}/{BOOK_RESOURCE}/{info['bookID']}/"
@@ -32,6 +42,17 @@ def get_stylesheet() -> str:
     return Path(PKG_DIR / "assets/styles.css").read_text()
 
 
+def get_peak_memory() -> float | None:
+    """Get the process peak memory usage in MiB, if the OS reports it."""
+    if system() == "Windows":
+        return None
+    import resource  # noqa: PLC0415
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports it in bytes, other systems in kilobytes
+    return peak_memory / 1024 / (1024 if system() == "Darwin" else 1)
+
+
 def browse_file_directory(filepath: Path) -> None:
     """Browse a file parent directory in OS file explorer."""
     if system() == "Windows":
@@ -1,3 +1,5 @@
+from functools import partial
+from itertools import count
 from re import Match
 from typing import Any, cast
 
@@ -9,18 +11,26 @@ from shamela2epub.misc.patterns import (
     ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN,
     ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN,
     BOOK_URL_PATTERN,
+    HAMESH_CLASS_PATTERN,
     HAMESH_CONTINUATION_PATTERN,
     HAMESH_PATTERN,
-    HTML_STYLE_PATTERN,
+    HTML_LIST_TAG_PATTERN,
+    HTML_PARAGRAPH_PATTERN,
     PARENT_DIV_CLASS_PATTERN,
 )
+from shamela2epub.misc.stats import stats
 from shamela2epub.models.book_base_html_page import BookBaseHTMLPage
+from shamela2epub.models.book_page import HAMESH_PLACEHOLDER, BookPage, Footnote
+from shamela2epub.models.chapter_index import ChapterIndex
 
 epub_type = QName("http://www.idpf.org/2007/ops", "type")
+BOOK_TOC_HEAD_CLASS = "s-nav-head"
+# Font size of pages paragraphs, which is left to the book stylesheet
+PARAGRAPH_STYLE = "font-size: 15px"
 
 
 class BookHTMLPage(BookBaseHTMLPage):
-    BOOK_TOC_SELECTOR = "div.s-nav-head + ul > li"
+    BOOK_TOC_SELECTOR = f"div.{BOOK_TOC_HEAD_CLASS} + ul > li"
     COPY_BTN_SELECTOR = "a.btn_tag"
     PAGE_NUMBER_SELECTOR = "input#fld_goto_bottom"
     PAGE_PARTS_SELECTOR = "#fld_part_top ~ div"
@@ -28,20 +38,43 @@ class BookHTMLPage(BookBaseHTMLPage):
     PAGE_PART_SELECTOR = f"{PAGE_PARTS_SELECTOR} button::text"
     NEXT_PAGE_SELECTOR = f"{PAGE_NUMBER_SELECTOR} + a"
     LAST_PAGE_SELECTOR = f"{PAGE_NUMBER_SELECTOR} + a + a"
-    CHAPTERS_SELECTOR = f"div.s-nav-head ~ ul a[href*='/{BOOK_RESOURCE}/']"
-    _previous_page_hamesh: str = ""
+    CHAPTERS_SELECTOR = f"div.{BOOK_TOC_HEAD_CLASS} ~ ul a[href*='/{BOOK_RESOURCE}/']"
 
-    def __init__(self, url: str, html: str) -> None:
+    def __init__(self, url: str, html: str, with_toc: bool = True) -> None:
         """Book HTML page model constructor."""
-        super().__init__(html)
-        self._remove_copy_btn_from_html()
+        with stats.time("parse_html"):
+            super().__init__(html if with_toc else self.remove_toc(html))
+            self._remove_copy_btn_from_html()
         self.url = url
         self.page_url = self.url.split("#")[0]
-        self._chapters_by_page: dict[str, str] = {}
         self._toc_chapters_levels: dict[str, int] = {}
-        self.content: Selector | None = self.get_clean_page_content()
-        self.hamesh_items: dict[str, Element] = self.get_hamesh_items()
-        self._update_hamesh()
+        with stats.time("clean"):
+            self.content: Selector | None = self.get_clean_page_content()
+        self.hamesh_continuation: str = ""
+        self.footnotes: list[Footnote] = []
+        with stats.time("footnotes"):
+            self.hamesh_items: dict[str, Footnote] = self.get_hamesh_items()
+            self._update_hamesh()
+        stats.count("pages_parsed")
+
+    @staticmethod
+    def remove_toc(html: str) -> str:
+        """Remove the book TOC list from page HTML, since it's the same for all book pages."""
+        toc_start = html.find(BOOK_TOC_HEAD_CLASS)
+        if toc_start == -1:
+            return html
+        depth = 0
+        list_start = 0
+        for tag in HTML_LIST_TAG_PATTERN.finditer(html, toc_start):
+            if not tag.group("closing"):
+                if not depth:
+                    list_start = tag.start()
+                depth += 1
+                continue
+            depth -= 1
+            if not depth:
+                return html[:list_start] + html[tag.end() :]
+        return html
 
     def _remove_copy_btn_from_html(self) -> None:
         self._html.css(self.COPY_BTN_SELECTOR).drop()
@@ -96,20 +129,11 @@ class BookHTMLPage(BookBaseHTMLPage):
         return self.parse_toc(toc_ul)
 
     @property
-    def chapters_by_page(self) -> dict[str, Any]:
-        if self._chapters_by_page:
-            return self.chapters_by_page
-        chapters_list = self._html.css(self.CHAPTERS_SELECTOR)
-        chapters: dict = {}
-        for chapter in chapters_list:
-            chapter_url = chapter.attrib.get("href", "")
-            if chapters.get(chapter_url):
-                chapters[chapter_url].append(chapter.css("::text").get("").strip())
-                chapters.update({chapter_url: chapters[chapter_url]})
-            else:
-                chapters.update({chapter_url: [chapter.css("::text").get("").strip()]})
-        self._chapters_by_page = chapters
-        return self._chapters_by_page
+    def chapter_index(self) -> ChapterIndex:
+        chapter_index = ChapterIndex()
+        for chapter in self._html.css(self.CHAPTERS_SELECTOR):
+            chapter_index.add(chapter.attrib.get("href", ""), chapter.css("::text").get("").strip())
+        return chapter_index
 
     @property
     def part(self) -> str:
@@ -124,6 +148,16 @@ class BookHTMLPage(BookBaseHTMLPage):
             else {}
         )
 
+    @property
+    def parts_first_pages(self) -> dict[str, int]:
+        """First page number of each book part, by part name."""
+        parts_first_pages: dict[str, int] = {}
+        for part in self._html.css(f"{self.PAGE_PARTS_MENU_SELECTOR} li a"):
+            match: Match | None = BOOK_URL_PATTERN.search(part.attrib.get("href", ""))
+            if match is not None:
+                parts_first_pages[part.css("::text").get("")] = int(match.group("page") or 1)
+        return parts_first_pages
+
     def get_clean_page_content(self) -> Selector | None:
         """Get cleaned-up page content."""
         if not self.content:
@@ -142,108 +176,29 @@ class BookHTMLPage(BookBaseHTMLPage):
             if not element.css("::text").get():
                 element.drop()
         # Delete paragraph style
-        for _ in self.content.css('p[style="font-size: 15px"]'):
-            _ = Selector(text=HTML_STYLE_PATTERN.sub("", self.content.get()))
+        for paragraph in self.content.css(f'p[style="{PARAGRAPH_STYLE}"]'):
+            del paragraph.root.attrib["style"]
         return self.content
 
-    def get_hamesh_items(self) -> dict[str, Element]:
-        hamesh_items: dict[str, Element] = {}
+    def get_hamesh_items(self) -> dict[str, Footnote]:
         if not self.content:
-            return hamesh_items
+            return {}
         hamesh: SelectorList = self.content.css(".hamesh")
         if not hamesh:
-            return hamesh_items
-        hamesh_continuation = HAMESH_CONTINUATION_PATTERN.search(str(hamesh))
-        if hamesh_continuation:
-            type(self)._previous_page_hamesh = (
-                hamesh_continuation.group("continuation")
-                if not type(self)._previous_page_hamesh
-                else f"{type(self)._previous_page_hamesh}\n{hamesh_continuation.group('continuation')}"
-            )
-        elif not type(self)._previous_page_hamesh:
-            type(self)._previous_page_hamesh = ""
-        for hamesh_counter, match in enumerate(HAMESH_PATTERN.finditer(hamesh.get("")), 1):
-            current_hamesh = match.group("number").strip()
-            hamesh_line = match.group("content").strip()
-            #  <aside id="fn1" epub:type="footnote">
-            #  <p><a href="#fnref1" title="footnote 1">[1]</a> Text in popup</p>
-            #  </aside>
-            new_footnote_aside = Element(
-                "aside",
-                {"id": f"fn{hamesh_counter}", epub_type: "footnote"},
-            )
-            new_footnote_span = Element("span")
-            new_footnote_a = Element(
-                "a",
-                {
-                    "href": f"#fnref{hamesh_counter}",
-                    # "title": f"هامش {hamesh_counter}",
-                    "class": "nu",
-                },
-            )
-            new_footnote_a.text = current_hamesh
-            if type(self)._previous_page_hamesh:
-                new_footnote_span.text = type(self)._previous_page_hamesh.replace("\n", "<br>")
-                new_footnote_span.append(Element("br"))
-                new_footnote_span.text = " " + hamesh_line.strip()
-                type(self)._previous_page_hamesh = ""
-            else:
-                new_footnote_span.text = " " + hamesh_line.strip()
-            new_footnote_aside.append(new_footnote_a)
-            new_footnote_aside.append(new_footnote_span)
-            hamesh_items.update({current_hamesh: new_footnote_aside})
+            return {}
+        self.hamesh_continuation, hamesh_items = parse_hamesh(hamesh.get(""))
         return hamesh_items
 
     def _update_hamesh(self) -> None:
-        footnote_count = 1
         if not self.content:
             return
         hamesh: SelectorList = self.content.css(".hamesh")
         if not hamesh:
             return
-        new_hamesh: Element = Element("div", {"class": "hamesh"})
-        parent: SelectorList = self.content.css("div")
-        p_elements: SelectorList = self.content.css("p:not(.hamesh)")
-        for p in p_elements:
-            matches = ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN.finditer(p.get())
-            for match in matches:
-                number = match.group("number")
-                if self.hamesh_items.get(number) is None:
-                    continue
-                aya_match = ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN.search(p.get())
-                if (
-                    aya_match
-                    and number in aya_match.group()
-                    # number in inside aya
-                    and match.start("number") > aya_match.start()
-                ):
-                    continue
-                footnote_link: Element = Element(
-                    "a",
-                    {
-                        "href": f"#fn{footnote_count}",
-                        epub_type: "noteref",
-                        "role": "doc-noteref",
-                        "id": f"fnref{footnote_count}",
-                        # "title": f"هامش {footnote_count}",
-                        "class": "fn nu",
-                    },
-                )
-                footnote_link.text = number
-                # new_p_content = (
-                #     str(p)[len("<p>") : match.start()]
-                #     + str(footnote_link)
-                #     + str(p)[match.start() + len(match.group()) : 0 - len("</p>")]
-                # )
-                # TODO: Find a better way to replace number with its a element,
-                #  since replacing only the first occurrence might not be the best solution
-                new_p_el = p.get().replace(number, self.element_as_text(footnote_link), 1)
-                self.content = Selector(text=parent.get("").replace(p.get(), new_p_el))
-                footnote_count += 1
-                new_hamesh.append(self.hamesh_items[number])
-        self.content = Selector(
-            text=self.content.get().replace(hamesh.get(""), self.element_as_text(new_hamesh))
+        content, self.footnotes = link_footnotes(
+            self.content.get(), hamesh.get(""), self.hamesh_items
         )
+        self.content = Selector(text=content)
 
     @staticmethod
     def element_as_text(element: Element) -> str:
@@ -251,5 +206,91 @@ class BookHTMLPage(BookBaseHTMLPage):
         assert isinstance(element_text, str)
         return element_text
 
+    def to_book_page(self) -> BookPage:
+        return BookPage(
+            url=self.url,
+            current_page=self.current_page,
+            part=self.part,
+            content=self.content.get() if self.content else "",
+            footnotes=self.footnotes,
+            hamesh_continuation=self.hamesh_continuation,
+        )
+
     def __repr__(self) -> str:
         return f"<BookHTMLPage(url={self.url})>"
+
+
+def parse_hamesh(hamesh_html: str) -> tuple[str, dict[str, Footnote]]:
+    """Get the footnote continued from previous pages, if any, and the page footnotes."""
+    # The continuation of a footnote from previous pages is kept as is,
+    # EPUBBook links it to the next footnote since it needs the pages in order.
+    hamesh_continuation = HAMESH_CONTINUATION_PATTERN.search(hamesh_html)
+    hamesh_items: dict[str, Footnote] = {}
+    for hamesh_counter, match in enumerate(HAMESH_PATTERN.finditer(hamesh_html), 1):
+        current_hamesh = match.group("number").strip()
+        hamesh_items.update(
+            {
+                current_hamesh: Footnote(
+                    hamesh_counter, current_hamesh, match.group("content").strip()
+                )
+            }
+        )
+    return (
+        hamesh_continuation.group("continuation") if hamesh_continuation else "",
+        hamesh_items,
+    )
+
+
+def link_footnotes(
+    content: str, hamesh_html: str, hamesh_items: dict[str, Footnote]
+) -> tuple[str, list[Footnote]]:
+    """
+    Link footnotes numbers in page content to their footnotes, and replace the page footnotes
+    with a placeholder. Returns the new content and the linked footnotes.
+    """
+    # Linked footnotes by number, in the order they're linked
+    footnotes: dict[str, Footnote] = {}
+    footnote_counter = count(1)
+
+    def link_footnote(aya_match: Match | None, match: Match) -> str:
+        number: str = match.group("number")
+        if hamesh_items.get(number) is None:
+            return number
+        if (
+            aya_match
+            and number in aya_match.group()
+            # number in inside aya
+            and match.start("number") > aya_match.start()
+        ):
+            return number
+        footnote_count = next(footnote_counter)
+        footnote_link: Element = Element(
+            "a",
+            {
+                "href": f"#fn{footnote_count}",
+                epub_type: "noteref",
+                "role": "doc-noteref",
+                "id": f"fnref{footnote_count}",
+                # "title": f"هامش {footnote_count}",
+                "class": "fn nu",
+            },
+        )
+        footnote_link.text = number
+        footnotes.setdefault(number, hamesh_items[number])
+        return BookHTMLPage.element_as_text(footnote_link)
+
+    def link_paragraph_footnotes(paragraph: Match) -> str:
+        if HAMESH_CLASS_PATTERN.search(paragraph.group("attributes")):
+            return cast(str, paragraph.group())
+        aya_match = ARABIC_NUMBER_BETWEEN_CURLY_BRACES_PATTERN.search(paragraph.group())
+        return cast(
+            str,
+            ARABIC_NUMBER_BETWEEN_BRACKETS_PATTERN.sub(
+                partial(link_footnote, aya_match), paragraph.group()
+            ),
+        )
+
+    # Footnotes numbers are replaced with their links in a single pass over the page
+    # paragraphs, so the page is only parsed again once.
+    content = HTML_PARAGRAPH_PATTERN.sub(link_paragraph_footnotes, content)
+    return content.replace(hamesh_html, HAMESH_PLACEHOLDER), list(footnotes.values())
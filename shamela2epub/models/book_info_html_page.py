@@ -12,6 +12,7 @@ class BookInfoHTMLPage(BookBaseHTMLPage):
         """Book Info Page model constructor."""
         super().__init__(html)
         self.url = url
+        self.html = html
         self.text_content: str = ""
         self._sanitize_html()
         self.title = self._html.css(self.BOOK_TITLE_SELECTOR).get("").strip()
@@ -0,0 +1,35 @@
+import json
+from dataclasses import asdict, dataclass, field
+
+HAMESH_PLACEHOLDER = '<div class="hamesh"></div>'
+
+
+@dataclass(slots=True)
+class Footnote:
+    index: int
+    number: str
+    text: str
+
+
+@dataclass(slots=True)
+class BookPage:
+    """
+    Parsed book page, ready to be added to the EPUB book.
+    It only holds plain data so it can be passed between processes.
+    """
+
+    url: str
+    current_page: str
+    part: str
+    content: str
+    footnotes: list[Footnote] = field(default_factory=list)
+    hamesh_continuation: str = ""
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "BookPage":
+        book_page = json.loads(data)
+        book_page["footnotes"] = [Footnote(**footnote) for footnote in book_page["footnotes"]]
+        return cls(**book_page)
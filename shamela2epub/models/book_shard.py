@@ -0,0 +1,117 @@
+import json
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from math import ceil
+from pathlib import Path
+from typing import Any
+
+from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.book_page import BookPage
+
+
+@dataclass(slots=True, frozen=True)
+class Shard:
+    # Shard number, from 1 to the shards count
+    index: int
+    count: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.index}-of-{self.count}"
+
+    @property
+    def extension(self) -> str:
+        return f"{self.name}.shard"
+
+    def get_pages(self, pages: range) -> range:
+        """Get the shard slice of the book pages, pages are split into consecutive slices."""
+        size = ceil(len(pages) / self.count)
+        return pages[(self.index - 1) * size : self.index * size]
+
+
+@dataclass(slots=True)
+class ShardHeader:
+    """Book info and first page fields, which every shard has, so any of them can start the book."""
+
+    url: str
+    shard: int
+    shards: int
+    # Book pages in the shard
+    start: int
+    stop: int
+    info_html: str
+    pages_count: str
+    parts_map: dict[str, int]
+    toc: list[Any]
+    chapters: dict[str, list[str]]
+
+
+class ShardWriter:
+    def __init__(self, path: Path, shard: Shard, url: str, info_page: BookInfoHTMLPage) -> None:
+        """
+        Writer of a shard of the book pages, parsed but not added to an EPUB book yet, to a JSON
+        lines file: the shard header, then one page per line, then the pages that failed.
+        The file is written to a partial file which replaces it once it's closed.
+        """
+        self.path = path
+        self.shard = shard
+        self._url = url
+        self._info_page = info_page
+        self._partial_path = path.with_name(f"{path.name}.part")
+        self._partial_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._partial_path.open("w", encoding="utf-8", newline="\n")
+
+    def write_header(self, first_page: BookHTMLPage, pages: range) -> None:
+        header = ShardHeader(
+            self._url,
+            self.shard.index,
+            self.shard.count,
+            pages.start,
+            pages.stop,
+            self._info_page.html,
+            first_page.last_page,
+            first_page.parts_map,
+            first_page.toc,
+            first_page.chapter_index.to_dict(),
+        )
+        self._write_line(asdict(header))
+
+    def write_page(self, book_page: BookPage) -> None:
+        self._file.write(f"{book_page.to_json()}\n")
+
+    def _write_line(self, data: dict[str, Any]) -> None:
+        self._file.write(f"{json.dumps(data, ensure_ascii=False)}\n")
+
+    def close(self, failed_pages: list[int]) -> None:
+        """Write the pages that failed, close the file, and move it to the shard path."""
+        self._write_line({"failed_pages": failed_pages})
+        self._file.close()
+        self._partial_path.replace(self.path)
+
+    def discard(self) -> None:
+        """Close the file and remove it."""
+        self._file.close()
+        self._partial_path.unlink(missing_ok=True)
+
+
+def read_shard_header(path: Path) -> ShardHeader:
+    """Raises ValueError if the file isn't a book shard."""
+    with path.open(encoding="utf-8") as shard_file:
+        try:
+            return ShardHeader(**json.loads(shard_file.readline()))
+        except (TypeError, json.JSONDecodeError) as err:
+            raise ValueError(f"{path} is not a book shard") from err
+
+
+def read_shard_pages(path: Path, failed_pages: list[int]) -> Iterator[BookPage]:
+    """Read a shard pages one at a time, and add the pages that failed to `failed_pages`."""
+    with path.open(encoding="utf-8") as shard_file:
+        # Skip the header
+        shard_file.readline()
+        for line in shard_file:
+            if line.startswith('{"failed_pages"'):
+                failed_pages.extend(json.loads(line)["failed_pages"])
+                return
+            yield BookPage.from_json(line)
+    raise ValueError(f"{path} is incomplete")
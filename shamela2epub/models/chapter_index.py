@@ -0,0 +1,26 @@
+from shamela2epub.misc.patterns import BOOK_URL_PATTERN
+
+
+class ChapterIndex:
+    def __init__(self, chapters: dict[str, list[str]] | None = None) -> None:
+        """Book chapters titles by their page URL, built once from the book TOC."""
+        self._chapters: dict[str, list[str]] = chapters or {}
+
+    def add(self, page_url: str, title: str) -> None:
+        self._chapters.setdefault(page_url, []).append(title)
+
+    def get(self, page_url: str) -> list[str]:
+        return self._chapters.get(page_url.split("#")[0], [])
+
+    def get_page(self, title: str) -> int | None:
+        """Get the page number of the first chapter with a title."""
+        for page_url, titles in self._chapters.items():
+            if title in titles and (match := BOOK_URL_PATTERN.search(page_url)) is not None:
+                return int(match.group("page") or 1)
+        return None
+
+    def to_dict(self) -> dict[str, list[str]]:
+        return self._chapters
+
+    def __len__(self) -> int:
+        return len(self._chapters)
@@ -0,0 +1,119 @@
+import json
+from dataclasses import asdict, dataclass, field
+from enum import StrEnum
+from pathlib import Path
+
+from lxml.html import fragment_fromstring
+
+from shamela2epub.misc.stats import stats
+from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.book_page import BookPage
+
+# Elements that start a new line in page text
+BLOCK_TAGS = {"p", "div", "br", "hr", "h1", "h2", "h3", "h4", "h5", "h6", "li"}
+FOOTNOTES_SEPARATOR = "_" * 10
+
+
+class CorpusFormat(StrEnum):
+    JSONL = "jsonl"
+    TXT = "txt"
+
+
+@dataclass(slots=True)
+class CorpusFootnote:
+    number: str
+    text: str
+
+
+@dataclass(slots=True)
+class CorpusPage:
+    book_id: int
+    url: str
+    part: str
+    page: str
+    chapters: list[str]
+    text: str
+    footnotes: list[CorpusFootnote] = field(default_factory=list)
+    # Footnote continued from previous pages
+    hamesh_continuation: str = ""
+
+
+def html_to_text(html: str) -> str:
+    """Get the text of an HTML fragment, one line per block element, without footnotes."""
+    if not html.strip():
+        return ""
+    root = fragment_fromstring(html, create_parent="div")
+    for hamesh in root.find_class("hamesh"):
+        hamesh.drop_tree()
+    for element in root.iter(*BLOCK_TAGS):
+        element.tail = f"\n{element.tail or ''}"
+    lines = (line.strip() for line in root.text_content().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def get_corpus_page(book_id: str, book_page: BookPage, chapters: list[str]) -> CorpusPage:
+    """Get the text and footnotes of a parsed page, along with the chapters that start in it."""
+    return CorpusPage(
+        int(book_id),
+        book_page.url,
+        book_page.part,
+        book_page.current_page,
+        chapters,
+        html_to_text(book_page.content),
+        [
+            CorpusFootnote(footnote.number, html_to_text(footnote.text))
+            for footnote in book_page.footnotes
+        ],
+        html_to_text(book_page.hamesh_continuation),
+    )
+
+
+class CorpusWriter:
+    def __init__(
+        self, path: Path, corpus_format: CorpusFormat, info_page: BookInfoHTMLPage
+    ) -> None:
+        """
+        Writer of book pages text and footnotes to a JSON lines or a plain text file, one page at
+        a time as they are added, so the book is never kept in memory.
+        The file is written to a partial file which replaces it once it's closed.
+        """
+        self.path = path
+        self.corpus_format = corpus_format
+        self._partial_path = path.with_name(f"{path.name}.part")
+        self._partial_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._partial_path.open("w", encoding="utf-8", newline="\n")
+        if corpus_format == CorpusFormat.TXT:
+            self._file.write(f"{info_page.title} - {info_page.author}\n\n")
+
+    @staticmethod
+    def format_text(corpus_page: CorpusPage) -> str:
+        header = f"الصفحة: {corpus_page.page}"
+        if corpus_page.part:
+            header = f"الجزء: {corpus_page.part} - {header}"
+        lines = [f"[{header}]", *(f"# {chapter}" for chapter in corpus_page.chapters)]
+        if corpus_page.text:
+            lines.append(corpus_page.text)
+        if corpus_page.footnotes or corpus_page.hamesh_continuation:
+            lines.append(FOOTNOTES_SEPARATOR)
+            if corpus_page.hamesh_continuation:
+                lines.append(corpus_page.hamesh_continuation)
+            lines.extend(f"{footnote.number} {footnote.text}" for footnote in corpus_page.footnotes)
+        return "\n".join(lines) + "\n\n"
+
+    def write_page(self, corpus_page: CorpusPage) -> None:
+        with stats.time("write_corpus"):
+            self._file.write(
+                f"{json.dumps(asdict(corpus_page), ensure_ascii=False)}\n"
+                if self.corpus_format == CorpusFormat.JSONL
+                else self.format_text(corpus_page)
+            )
+
+    def close(self) -> None:
+        """Close the file, and move it to the book path."""
+        self._file.close()
+        self._partial_path.replace(self.path)
+
+    def discard(self) -> None:
+        """Close the file and remove it."""
+        self._file.close()
+        self._partial_path.unlink(missing_ok=True)
@@ -1,5 +1,6 @@
-import re
-from typing import Any, cast
+from pathlib import Path
+from re import Match
+from typing import Any, BinaryIO
 
 from ebooklib.epub import (
     EpubBook,
@@ -10,14 +11,19 @@ from ebooklib.epub import (
     Link,
     write_epub,
 )
-from parsel import Selector
+from lxml.etree import Element, SubElement
 
 from shamela2epub import __version__
 from shamela2epub.misc.constants import SHAMELA_DOMAIN
 from shamela2epub.misc.patterns import CSS_STYLE_COLOR_PATTERN
+from shamela2epub.misc.stats import stats
 from shamela2epub.misc.utils import get_stylesheet
-from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.book_html_page import BookHTMLPage, epub_type
 from shamela2epub.models.book_info_html_page import BookInfoHTMLPage
+from shamela2epub.models.book_page import HAMESH_PLACEHOLDER, BookPage, Footnote
+from shamela2epub.models.chapter_index import ChapterIndex
+from shamela2epub.models.epub_page import EPUBPage
+from shamela2epub.models.epub_stream_writer import WRITER_OPTIONS, EPUBStreamWriter
 
 
 class EPUBBook:
@@ -31,10 +37,15 @@ class EPUBBook:
         self._sections_map: dict[str, Link] = {}
         self._parts_map: dict[str, int] = {}
         self._toc: list[str] = []
+        self._chapter_index: ChapterIndex = ChapterIndex()
         self._default_css: EpubItem = EpubItem()
-        self._color_styles_map: dict[str, int] = {}
-        self._last_color_id: int = 0
+        self._stylesheet: str = ""
+        # Color classes of inline color styles
+        self._color_classes: dict[str, str] = {}
         self._pages_map: dict[int, int] = {}
+        self._hamesh_continuation: str = ""
+        self._writer: EPUBStreamWriter | None = None
+        self._book_info_page: BookInfoHTMLPage | None = None
 
     def set_page_count(self, count: str) -> None:
         self.pages_count = int(count) if count else 0
@@ -46,34 +57,93 @@ class EPUBBook:
     def set_toc(self, toc_list: list[Any]) -> None:
         self._toc = toc_list
 
+    def set_chapter_index(self, chapter_index: ChapterIndex) -> None:
+        self._chapter_index = chapter_index
+
+    def stream_to(self, target: Path | BinaryIO) -> None:
+        """
+        Write pages to the book file, or binary file-like object, as soon as they are added
+        instead of keeping them in memory until the book is saved.
+        Pages that were already added are written right away.
+        """
+        self._writer = EPUBStreamWriter(target, self._book)
+        for page in self._pages:
+            self._writer.write_page(page)
+
+    @property
+    def parts_count(self) -> int:
+        return len(self._parts_map)
+
+    @property
+    def streaming(self) -> bool:
+        return self._writer is not None
+
+    def _add_page_item(self, page: EpubHtml) -> None:
+        page.add_item(self._default_css)
+        self._book.add_item(page)
+        self._pages.append(page)
+        if self._writer is not None:
+            self._writer.write_page(page)
+
     def init(self) -> None:
         self._book.set_language("ar")
         self._book.set_direction("rtl")
         self._book.add_metadata("DC", "publisher", f"https://{SHAMELA_DOMAIN}")
         self._book.add_metadata(None, "meta", "", {"name": "shamela2epub", "content": __version__})
+        self._stylesheet = get_stylesheet()
         self._default_css = EpubItem(
             uid="style_default",
             file_name="style/styles.css",
             media_type="text/css",
-            content=get_stylesheet(),
+            content=self._stylesheet,
         )
         self._book.add_item(self._default_css)
 
     def create_info_page(self, book_info_html_page: BookInfoHTMLPage) -> None:
+        self._book_info_page = book_info_html_page
         self._book.set_title(book_info_html_page.title)
         self._book.add_author(book_info_html_page.author)
         self._book.add_metadata("DC", "source", book_info_html_page.url)
-        info_page = EpubHtml(
+        info_page = EPUBPage(
             title="بطاقة الكتاب",
             file_name="info.xhtml",
             lang="ar",
             content=f"<html><body>{book_info_html_page.text_content}</body></html>",
         )
-        info_page.add_item(self._default_css)
-        self._book.add_item(info_page)
-        self._pages.append(info_page)
+        self._add_page_item(info_page)
 
-    def add_chapter(self, chapters_in_page: dict, page_filename: str) -> None:
+    def set_volume(self, volume: int) -> None:
+        """Title the book as a volume of a book that's split into many EPUB files."""
+        assert self._book_info_page is not None
+        title = self._book_info_page.title
+        self._book.title = f"{title} ({volume})"
+        self._book.set_unique_metadata("DC", "title", self._book.title)
+        self._book.add_metadata(None, "meta", "", {"name": "calibre:series", "content": title})
+        self._book.add_metadata(
+            None, "meta", "", {"name": "calibre:series_index", "content": str(volume)}
+        )
+
+    def new_volume(self, volume: int) -> "EPUBBook":
+        """
+        Start the next volume of a book that's split into many EPUB files.
+        The new volume continues this one, so the next pages are added to it instead.
+        """
+        assert self._book_info_page is not None
+        epub_book = EPUBBook()
+        epub_book.pages_count = self.pages_count
+        epub_book._zfill_length = self._zfill_length
+        epub_book._parts_map = self._parts_map
+        epub_book._toc = self._toc
+        epub_book._chapter_index = self._chapter_index
+        epub_book._pages_map = self._pages_map
+        # Footnotes can be continued from the last page of the previous volume
+        epub_book._hamesh_continuation = self._hamesh_continuation
+        epub_book.init()
+        epub_book.create_info_page(self._book_info_page)
+        epub_book.set_volume(volume)
+        return epub_book
+
+    def add_chapter(self, chapters_in_page: list[str], page_filename: str) -> None:
         for i in chapters_in_page:
             link = Link(
                 page_filename,
@@ -83,28 +153,79 @@ class EPUBBook:
             self._sections.append(link)
             self._sections_map.update({i: link})
 
-    def replace_color_styles_with_class(self, html: Selector | None) -> str:
-        if not html:
+    def _get_color_class(self, style_match: Match[str]) -> str:
+        style = style_match.group(1)
+        color_class = self._color_classes.get(style)
+        if color_class is None:
+            color_class = f"color-{len(self._color_classes) + 1}"
+            self._color_classes[style] = color_class
+        return f'class="{color_class}"'
+
+    def replace_color_styles_with_class(self, html_str: str) -> str:
+        """Replace inline color styles with classes, numbered in the order colors first appear."""
+        if not html_str:
             return ""
-        html_str = html.get()
-        matches = CSS_STYLE_COLOR_PATTERN.findall(html_str)
-        if not matches:
-            return cast(str, html_str)
-        for style in list(set(CSS_STYLE_COLOR_PATTERN.findall(html_str))):
-            color_class = self._color_styles_map.get(style, "")
-            if not color_class:
-                color_class = f"color-{self._last_color_id + 1}"
-                self._color_styles_map.update({style: color_class})
-                self._last_color_id += 1
-                self._default_css.content += f"\n.{color_class} {{ {style}; }}\n\n"
-            html_str = re.sub(f'style="{style}"', f'class="{color_class}"', html_str)
-        return cast(str, html_str)
-
-    def get_book_page_number(self, book_html_page: BookHTMLPage) -> str:
+        return CSS_STYLE_COLOR_PATTERN.sub(self._get_color_class, html_str)
+
+    def _render_styles(self) -> None:
+        """Add color classes to the book stylesheet, once all pages are added."""
+        self._default_css.content = self._stylesheet + "".join(
+            f"\n.{color_class} {{ {style}; }}\n\n"
+            for style, color_class in self._color_classes.items()
+        )
+
+    def link_hamesh_continuation(self, book_page: BookPage) -> list[tuple[Footnote, str]]:
+        """
+        Link footnotes continued from previous pages to the next footnote.
+        Pages must be passed in order, since the continuation is carried between them.
+        """
+        if book_page.hamesh_continuation:
+            self._hamesh_continuation = (
+                book_page.hamesh_continuation
+                if not self._hamesh_continuation
+                else f"{self._hamesh_continuation}\n{book_page.hamesh_continuation}"
+            )
+        footnotes = [(footnote, "") for footnote in book_page.footnotes]
+        if footnotes and self._hamesh_continuation:
+            footnotes[0] = (footnotes[0][0], self._hamesh_continuation)
+            self._hamesh_continuation = ""
+        return footnotes
+
+    @staticmethod
+    def render_hamesh(footnotes: list[tuple[Footnote, str]]) -> str:
+        #  <aside id="fn1" epub:type="footnote">
+        #  <p><a href="#fnref1" title="footnote 1">[1]</a> Text in popup</p>
+        #  </aside>
+        hamesh = Element("div", {"class": "hamesh"})
+        for footnote, continuation in footnotes:
+            footnote_aside = Element("aside", {"id": f"fn{footnote.index}", epub_type: "footnote"})
+            footnote_a = SubElement(
+                footnote_aside,
+                "a",
+                {
+                    "href": f"#fnref{footnote.index}",
+                    # "title": f"هامش {footnote.index}",
+                    "class": "nu",
+                },
+            )
+            footnote_a.text = footnote.number
+            footnote_span = SubElement(footnote_aside, "span")
+            if continuation:
+                lines = continuation.split("\n")
+                footnote_span.text = lines[0]
+                for line in lines[1:]:
+                    SubElement(footnote_span, "br").tail = line
+                SubElement(footnote_span, "br").tail = f" {footnote.text}"
+            else:
+                footnote_span.text = f" {footnote.text}"
+            hamesh.append(footnote_aside)
+        return BookHTMLPage.element_as_text(hamesh)
+
+    def get_book_page_number(self, book_page: BookPage) -> str:
         """
         Get the correct page number, which will be in page file name
         """
-        html_page_number: int = int(book_html_page.current_page)
+        html_page_number: int = int(book_page.current_page)
         book_page_count: int | None = self._pages_map.get(html_page_number)
         if book_page_count:
             new_page_count = book_page_count + 1
@@ -115,48 +236,61 @@ class EPUBBook:
         self._pages_map[html_page_number] = 1
         return str(current_page).zfill(self._zfill_length)
 
-    def add_page(
-        self, book_html_page: BookHTMLPage, file_name: str = "", title: str = ""
-    ) -> EpubHtml:
-        chapters_in_page = book_html_page.chapters_by_page.get(book_html_page.page_url)
+    def add_page(self, book_page: BookPage, file_name: str = "", title: str = "") -> EpubHtml:
+        chapters_in_page = self._chapter_index.get(book_page.url)
         if chapters_in_page:
             title = chapters_in_page[0]
-        part = book_html_page.part
+        part = book_page.part
         page_filename = (
             f"page{'_' if part else ''}{self._parts_map[part] if self._parts_map else ''}_"
-            f"{self.get_book_page_number(book_html_page)}.xhtml"
+            f"{self.get_book_page_number(book_page)}.xhtml"
         )
         footer = ""
         if part:
-            footer += f"الجزء: {book_html_page.part} - "
-        footer += f"الصفحة: {book_html_page.current_page}"
-        new_page = EpubHtml(
+            footer += f"الجزء: {book_page.part} - "
+        footer += f"الصفحة: {book_page.current_page}"
+        content = book_page.content
+        footnotes = self.link_hamesh_continuation(book_page)
+        if footnotes:
+            content = content.replace(HAMESH_PLACEHOLDER, self.render_hamesh(footnotes), 1)
+        with stats.time("colors"):
+            content = self.replace_color_styles_with_class(content)
+        new_page = EPUBPage(
             title=title,
             file_name=file_name or page_filename,
             lang="ar",
-            content=f"<html><body>{self.replace_color_styles_with_class(book_html_page.content)}"
-            f'<div class="text-center">{footer}</div>'
-            f"</body></html>",
+            content=f'<html><body>{content}<div class="text-center">{footer}</div></body></html>',
         )
-        new_page.add_item(self._default_css)
-        self._book.add_item(new_page)
-        self._pages.append(new_page)
+        with stats.time("add_page"):
+            self._add_page_item(new_page)
         if chapters_in_page:
             self.add_chapter(chapters_in_page, page_filename)
         return new_page
 
-    def _update_toc_list(self, toc: list) -> None:
+    def _get_toc_links(self, toc: list) -> list:
+        """
+        Get the TOC links of the chapters in the book pages.
+        Sub-chapters of chapters that are not in the book, like the chapters of a volume that
+        started in a previous volume, take their place.
+        """
         # Bug: Books that have a last nested section with level deeper than its next with the same page number
         # cannot be converted to KFX unless that last nested section is removed.
-        for index, element in enumerate(toc):
+        toc_links: list = []
+        for element in toc:
             if isinstance(element, list):
-                self._update_toc_list(element)
-            else:
-                toc[index] = self._sections_map.get(element, None)
+                title, sub_chapters = element
+                link = self._sections_map.get(title)
+                sub_links = self._get_toc_links(sub_chapters)
+                if link is None:
+                    toc_links.extend(sub_links)
+                else:
+                    toc_links.append([link, sub_links])
+            elif (link := self._sections_map.get(element)) is not None:
+                toc_links.append(link)
+        return toc_links
 
     def generate_toc(self) -> None:
-        toc_list: list[Link | str] = self._toc
-        self._update_toc_list(toc_list)
+        toc_list: list[Link | list] = self._get_toc_links(self._toc)
         toc_list.insert(0, Link("nav.xhtml", "فهرس الموضوعات", "nav"))
         toc_list.insert(0, Link("info.xhtml", "بطاقة الكتاب", "info"))
         self._book.toc = toc_list
@@ -170,5 +304,20 @@ class EPUBBook:
             *self._pages[1:],
         ]  # [info, nav, rest]
 
-    def save_book(self, book_name: str) -> None:
-        write_epub(book_name, self._book)
+    def save_book(self, book_name: str | BinaryIO) -> None:
+        """Save the book to a file, or to a binary file-like object."""
+        self._render_styles()
+        with stats.time("write_epub"):
+            if self._writer is None:
+                write_epub(book_name, self._book, WRITER_OPTIONS)
+                return
+            if isinstance(book_name, str):
+                self._writer.path = Path(book_name)
+            self._writer.write()
+            self._writer = None
+
+    def discard(self) -> None:
+        """Remove the book file that was being streamed, if any."""
+        if self._writer is not None:
+            self._writer.discard()
+            self._writer = None
@@ -0,0 +1,46 @@
+from ebooklib.epub import NAMESPACES, EpubHtml
+from ebooklib.utils import parse_html_string, parse_string
+from lxml.etree import SubElement, _Element, tostring
+
+NAMESPACE_DECLARATION_PREFIX = "xmlns:"
+
+
+def set_namespaced_attributes(element: _Element) -> None:
+    """
+    Set namespaced attributes of an element parsed as HTML, like footnotes `epub:type`.
+    The HTML parser keeps namespaces declarations and prefixed attributes as plain attributes,
+    so they would be declared again on each element that has them.
+    """
+    attributes = element.attrib
+    for declaration in [
+        name for name in attributes if name.startswith(NAMESPACE_DECLARATION_PREFIX)
+    ]:
+        namespace = attributes.pop(declaration)
+        prefix = f"{declaration.removeprefix(NAMESPACE_DECLARATION_PREFIX)}:"
+        for name in [name for name in attributes if name.startswith(prefix)]:
+            attributes[f"{{{namespace}}}{name.removeprefix(prefix)}"] = attributes.pop(name)
+
+
+class EPUBPage(EpubHtml):
+    def get_content(self, default: bytes | None = None) -> bytes:
+        """
+        Get page XHTML the same way EpubHtml does, but compact: without indentation, and with
+        namespaced attributes using the EPUB namespace declared on the root element.
+        """
+        tree = parse_string(self.book.get_template(self._template_name))
+        root = tree.getroot()
+        root.set("lang", self.lang or self.book.language)
+        root.set(f"{{{NAMESPACES['XML']}}}lang", self.lang or self.book.language)
+        head = SubElement(root, "head")
+        if self.title:
+            SubElement(head, "title").text = self.title
+        for link in self.links:
+            SubElement(head, "link", link)
+        body = SubElement(root, "body")
+        page_body = parse_html_string(self.content).find("body")
+        if page_body is not None:
+            for element in page_body.iter():
+                set_namespaced_attributes(element)
+            body.extend(page_body)
+        content: bytes = tostring(tree, encoding="utf-8", xml_declaration=True)
+        return content
@@ -0,0 +1,70 @@
+from pathlib import Path
+from typing import BinaryIO
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from ebooklib.epub import EpubBook, EpubHtml, EpubNav, EpubNcx, EpubWriter
+
+# Higher compression levels shrink books by about 1% only, but take up to 2.5 times as long
+# (see benchmarks/bench_epub_writer.py), while lower levels make them 5-15% bigger.
+COMPRESSION_LEVEL = 6
+# Converted pages have no page break markers, so the nav has no page list, and reading pages
+# content to look for them only slows writing down. Page lists are read from pages content, which
+# is gone by the time the nav is written.
+WRITER_OPTIONS = {"epub3_pages": False, "compresslevel": COMPRESSION_LEVEL}
+
+
+class EPUBStreamWriter(EpubWriter):
+    def __init__(self, target: Path | BinaryIO, book: EpubBook) -> None:
+        """
+        EPUB writer that writes book pages to the archive as soon as they are added,
+        then drops their content, so only pages metadata is kept until the book is closed.
+        A book file is written to a partial file which replaces it once it's closed, while a
+        binary file-like target is written to directly.
+        """
+        super().__init__(str(target), book, WRITER_OPTIONS)
+        self.path = target if isinstance(target, Path) else None
+        self._partial_path = (
+            self.path.with_name(f"{self.path.name}.part") if self.path is not None else None
+        )
+        self._written_pages: set[str] = set()
+        self.out = ZipFile(
+            self._partial_path or target,
+            "w",
+            ZIP_DEFLATED,
+            compresslevel=self.options["compresslevel"],
+        )
+        self.out.writestr("mimetype", "application/epub+zip", compress_type=ZIP_STORED)
+        self._write_container()
+
+    def write_page(self, page: EpubHtml) -> None:
+        """Write an added book page to the archive and drop its content."""
+        self.out.writestr(f"{self.book.FOLDER_NAME}/{page.file_name}", page.get_content())
+        page.content = ""
+        self._written_pages.add(page.id)
+
+    def _write_items(self) -> None:
+        for item in self.book.get_items():
+            if item.id in self._written_pages:
+                continue
+            if isinstance(item, EpubNcx):
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", self._get_ncx())
+            elif isinstance(item, EpubNav):
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", self._get_nav(item))
+            elif item.manifest:
+                self.out.writestr(f"{self.book.FOLDER_NAME}/{item.file_name}", item.get_content())
+            else:
+                self.out.writestr(item.file_name, item.get_content())
+
+    def write(self) -> None:
+        """Write the remaining book files, then move the finished archive to the book path."""
+        self._write_opf()
+        self._write_items()
+        self.out.close()
+        if self._partial_path is not None and self.path is not None:
+            self._partial_path.replace(self.path)
+
+    def discard(self) -> None:
+        """Close the archive and remove the unfinished book file, if any."""
+        self.out.close()
+        if self._partial_path is not None:
+            self._partial_path.unlink(missing_ok=True)
@@ -0,0 +1,141 @@
+from lxml.etree import fromstring, tostring
+from lxml.html import HtmlElement, HTMLParser
+
+from shamela2epub.misc.patterns import (
+    HTML_DIV_TAG_PATTERN,
+    PAGE_CONTENT_START_PATTERN,
+    PAGE_NUMBER_PATTERN,
+    PAGE_PART_PATTERN,
+)
+from shamela2epub.misc.stats import stats
+from shamela2epub.models.book_html_page import (
+    PARAGRAPH_STYLE,
+    BookHTMLPage,
+    link_footnotes,
+    parse_hamesh,
+)
+from shamela2epub.models.book_page import BookPage
+
+PAGE_PART_MARKER = 'id="fld_part_top"'
+PARENT_DIV_CLASS = "nass margin-top-10"
+
+
+class PageFields:
+    __slots__ = ("content", "current_page", "part")
+
+    def __init__(self, current_page: str, part: str, content: str) -> None:
+        """Book page fields scanned from page HTML, with the page content still unparsed."""
+        self.current_page = current_page
+        self.part = part
+        self.content = content
+
+
+def get_page_content(html: str) -> str | None:
+    """Slice the page content div out of page HTML, if it can be found."""
+    content_start = PAGE_CONTENT_START_PATTERN.search(html)
+    if content_start is None or content_start.group("tag") != "div":
+        return None
+    depth = 0
+    for tag in HTML_DIV_TAG_PATTERN.finditer(html, content_start.start()):
+        depth += -1 if tag.group("closing") else 1
+        if not depth:
+            return html[content_start.start() : tag.end()]
+    return None
+
+
+def scan_page(html: str) -> PageFields | None:
+    """
+    Scan page fields with targeted patterns instead of parsing the whole page.
+    Returns None if the page isn't laid out as expected, so that it's parsed with BookHTMLPage.
+    """
+    current_page = PAGE_NUMBER_PATTERN.search(html)
+    content = get_page_content(html)
+    # Entities are left to the HTML parser
+    if current_page is None or "&" in current_page.group("page") or content is None:
+        return None
+    part = ""
+    if PAGE_PART_MARKER in html:
+        part_match = PAGE_PART_PATTERN.search(html)
+        if part_match is None or "&" in part_match.group("part"):
+            return None
+        part = part_match.group("part").strip()
+        if not part:
+            return None
+    return PageFields(current_page.group("page"), part, content)
+
+
+def _parse_html(html: str) -> HtmlElement:
+    # Same as parsel, so that pages are parsed and serialized the same way as BookHTMLPage.
+    # Parsers can't be shared between threads.
+    root: HtmlElement = fromstring(
+        html.strip().replace("\x00", "").encode(),
+        parser=HTMLParser(recover=True, encoding="utf-8", huge_tree=True),
+    )
+    return root
+
+
+def _serialize(element: HtmlElement) -> str:
+    html: str = tostring(element, method="html", encoding="unicode", with_tail=False)
+    return html
+
+
+def _has_class(element: HtmlElement, class_name: str) -> bool:
+    return class_name in element.get("class", "").split()
+
+
+def _has_text(element: HtmlElement) -> bool:
+    """Whether an element has text of its own, its children text aside."""
+    return bool(element.text or any(child.tail for child in element))
+
+
+def parse_page_fields(url: str, fields: PageFields) -> BookPage | None:
+    """
+    Clean page content and link its footnotes the same way BookHTMLPage does, parsing only
+    the page content instead of the whole page, and cleaning it in a single pass.
+    """
+    root = _parse_html(fields.content)
+    body = root.find("body")
+    if body is None or len(body) != 1:
+        return None
+    if body[0].get("class") == PARENT_DIV_CLASS:
+        del body[0].attrib["class"]
+    # Elements are listed first, since dropping them changes the tree
+    for element in list(body.iter("a", "span", "p")):
+        if element.tag == "p":
+            if element.get("style") == PARAGRAPH_STYLE:
+                del element.attrib["style"]
+        elif (element.tag == "a" and _has_class(element, "btn_tag")) or (
+            element.tag == "span" and not _has_text(element)
+        ):
+            element.drop_tree()
+    hamesh = next((element for element in body.iter() if _has_class(element, "hamesh")), None)
+    content = _serialize(root)
+    if hamesh is None:
+        return BookPage(url, fields.current_page, fields.part, content)
+    hamesh_html = _serialize(hamesh)
+    hamesh_continuation, hamesh_items = parse_hamesh(hamesh_html)
+    content, footnotes = link_footnotes(content, hamesh_html, hamesh_items)
+    return BookPage(
+        url,
+        fields.current_page,
+        fields.part,
+        # Linked content is parsed again like BookHTMLPage does, so that it's serialized the same
+        _serialize(_parse_html(content)),
+        footnotes,
+        hamesh_continuation,
+    )
+
+
+def parse_book_page(url: str, html: str) -> BookPage:
+    """
+    Parse a book page HTML, can be used as a process pool task.
+    Page fields and content are scanned first, and the page is parsed with BookHTMLPage only if
+    it isn't laid out as expected.
+    """
+    with stats.time("scan_page"):
+        fields = scan_page(html)
+        book_page = parse_page_fields(url, fields) if fields is not None else None
+    if book_page is not None:
+        return book_page
+    stats.count("parse_fallbacks")
+    return BookHTMLPage(url, html, with_toc=False).to_book_page()
@@ -0,0 +1,92 @@
+from collections.abc import Iterator
+from typing import Any
+
+from shamela2epub.models.book_html_page import BookHTMLPage
+
+# Part names use Arabic-Indic digits, so they can be selected with either digits
+ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+
+
+def iter_toc(toc: list[Any], level: int = 0) -> Iterator[tuple[str, int]]:
+    """Iterate over TOC chapters titles in order, with their nesting level."""
+    for element in toc:
+        if isinstance(element, list):
+            title, sub_chapters = element
+            yield title.strip(), level
+            yield from iter_toc(sub_chapters, level + 1)
+        else:
+            yield element.strip(), level
+
+
+def intersect(pages: range, other_pages: range) -> range:
+    return range(max(pages.start, other_pages.start), min(pages.stop, other_pages.stop))
+
+
+class PageSelection:
+    def __init__(self, pages: range | None = None, part: str = "", chapter: str = "") -> None:
+        """
+        Book pages selected by a pages range, a part name or a TOC chapter title.
+        When more than one is set, only pages selected by all of them are.
+        """
+        self.pages = pages
+        self.part = part
+        self.chapter = chapter
+
+    def resolve(self, first_page: BookHTMLPage) -> range:
+        """
+        Get the selected pages numbers, from the book first page parts menu and TOC.
+        Raises ValueError if the part or the chapter is not in the book, or no pages are selected.
+        """
+        last_page = int(first_page.last_page or 1)
+        selected_pages = range(1, last_page + 1)
+        if self.pages is not None:
+            selected_pages = intersect(selected_pages, self.pages)
+        if self.part:
+            selected_pages = intersect(selected_pages, self._get_part_pages(first_page, last_page))
+        if self.chapter:
+            selected_pages = intersect(
+                selected_pages, self._get_chapter_pages(first_page, last_page)
+            )
+        if not selected_pages:
+            raise ValueError(f"No pages are selected, the book has {last_page} pages")
+        return selected_pages
+
+    def _get_part_pages(self, first_page: BookHTMLPage, last_page: int) -> range:
+        parts_first_pages = first_page.parts_first_pages
+        names = [name.strip().translate(ARABIC_DIGITS) for name in parts_first_pages]
+        part = self.part.strip().translate(ARABIC_DIGITS)
+        if part not in names:
+            raise ValueError(
+                f"The book has no part {self.part}, its parts are: "
+                f"{', '.join(parts_first_pages) or 'none'}"
+            )
+        # Parts are listed in pages order, so a part ends where the next one starts
+        first_pages = list(parts_first_pages.values())
+        index = names.index(part)
+        return range(
+            first_pages[index],
+            first_pages[index + 1] if index + 1 < len(first_pages) else last_page + 1,
+        )
+
+    def _get_chapter_pages(self, first_page: BookHTMLPage, last_page: int) -> range:
+        chapters = list(iter_toc(first_page.toc))
+        chapter_index = first_page.chapter_index
+        title = self.chapter.strip()
+        index, level = next(
+            ((index, level) for index, (chapter, level) in enumerate(chapters) if chapter == title),
+            (-1, 0),
+        )
+        start = chapter_index.get_page(title)
+        if index == -1 or start is None:
+            raise ValueError(f"The book has no chapter {self.chapter}")
+        # A chapter ends where the next chapter that isn't one of its sub-chapters starts
+        stop = next(
+            (
+                chapter_index.get_page(chapter) or last_page + 1
+                for chapter, next_level in chapters[index + 1 :]
+                if next_level <= level
+            ),
+            last_page + 1,
+        )
+        # The next chapter can start in the middle of the same page
+        return range(start, max(stop, start + 1))
@@ -0,0 +1,133 @@
+import asyncio
+from collections.abc import Iterator
+from pathlib import Path
+from zipfile import ZipFile
+
+import pytest
+from niquests import AsyncSession
+
+from benchmarks.server import BOOK_ID, ShamelaStandIn
+from shamela2epub.fetcher import ConnectionBudget
+from shamela2epub.main import BookDownloader
+from shamela2epub.models.book_shard import Shard
+
+BOOK_URL = f"https://shamela.ws/book/{BOOK_ID}"
+# Book metadata that changes every time a book is saved
+VOLATILE_METADATA = (b"dcterms:modified", b"dc:identifier", b"dtb:uid")
+
+
+class StandInBookDownloader(BookDownloader):
+    def __init__(
+        self, server_url: str, shard: Shard | None = None, cache_dir: Path | None = None
+    ) -> None:
+        """Book downloader that fetches pages from a stand-in server."""
+        super().__init__(BOOK_URL, 4, cache_dir=cache_dir, shard=shard)
+        self._server_url = server_url
+
+    def _page_url(self, page_number: int) -> str:
+        # The info page is page 0
+        return f"{self._server_url}/book/{BOOK_ID}/{page_number or ''}"
+
+
+@pytest.fixture(scope="module")
+def server_url() -> Iterator[str]:
+    with ShamelaStandIn(30) as server:
+        yield server.url
+
+
+def download(downloader: BookDownloader, output: Path, sharded: bool = False) -> Path:
+    async def fetch_book() -> None:
+        async with AsyncSession(pool_maxsize=4) as session:
+            budget = ConnectionBudget(4)
+            await downloader.fetch_info_page(session, budget)
+            if sharded:
+                downloader.shard_book(str(output))
+            await downloader.fetch_book(session, budget, lambda _: None)
+
+    asyncio.run(fetch_book())
+    return downloader.save_book(str(output))
+
+
+def download_shards(
+    server_url: str, output: Path, count: int, cache_dir: Path | None = None
+) -> list[Path]:
+    return [
+        download(StandInBookDownloader(server_url, Shard(index, count), cache_dir), output, True)
+        for index in range(1, count + 1)
+    ]
+
+
+def assemble(server_url: str, shards: list[Path], output: Path) -> Path:
+    downloader = StandInBookDownloader(server_url)
+    downloader.load_shards(shards)
+    downloader.assemble_book()
+    return downloader.save_book(str(output))
+
+
+def read_epub(path: Path) -> dict[str, bytes]:
+    with ZipFile(path) as epub:
+        return {
+            name: b"".join(
+                line
+                for line in epub.read(name).splitlines(keepends=True)
+                if not any(metadata in line for metadata in VOLATILE_METADATA)
+            )
+            for name in epub.namelist()
+        }
+
+
+@pytest.mark.parametrize(
+    ("pages", "count", "sizes"),
+    [
+        (range(1, 31), 1, [30]),
+        (range(1, 31), 3, [10, 10, 10]),
+        (range(1, 31), 4, [8, 8, 8, 6]),
+        (range(10, 15), 3, [2, 2, 1]),
+    ],
+)
+def test_shards_split_pages_in_consecutive_slices(
+    pages: range, count: int, sizes: list[int]
+) -> None:
+    slices = [Shard(index, count).get_pages(pages) for index in range(1, count + 1)]
+    assert [len(pages_slice) for pages_slice in slices] == sizes
+    assert [page for pages_slice in slices for page in pages_slice] == list(pages)
+
+
+def test_shards_are_assembled_into_the_book(server_url: str, tmp_path: Path) -> None:
+    book = download(StandInBookDownloader(server_url), tmp_path / "book.epub")
+    cache_dir = tmp_path / "cache"
+    shards = download_shards(server_url, tmp_path / "shards", 3, cache_dir=cache_dir)
+
+    assert all(
+        path.name.endswith(f".{Shard(index, 3).extension}")
+        for index, path in enumerate(shards, start=1)
+    )
+    # Each shard has its own pages cache
+    assert sorted(pack.name for pack in cache_dir.glob("*.pack")) == [
+        f"{BOOK_ID}.{index}-of-3.pack" for index in (1, 2, 3)
+    ]
+    # Shards can be given in any order
+    assembled_book = assemble(server_url, shards[::-1], tmp_path / "assembled.epub")
+    assert read_epub(assembled_book) == read_epub(book)
+
+
+def test_assembling_requires_all_shards(server_url: str, tmp_path: Path) -> None:
+    shards = download_shards(server_url, tmp_path, 3)
+
+    with pytest.raises(ValueError, match="Missing shards: 2"):
+        assemble(server_url, [shards[0], shards[2]], tmp_path / "book.epub")
+    with pytest.raises(ValueError, match="Some shards are given more than once"):
+        assemble(server_url, [*shards, shards[1]], tmp_path / "book.epub")
+    other_shard = download_shards(server_url, tmp_path / "other", 2)[0]
+    with pytest.raises(ValueError, match="not split the same way"):
+        assemble(server_url, [*shards[1:], other_shard], tmp_path / "book.epub")
+
+
+def test_incomplete_shards_are_not_assembled(server_url: str, tmp_path: Path) -> None:
+    shards = download_shards(server_url, tmp_path, 2)
+    lines = shards[1].read_text(encoding="utf-8").splitlines(keepends=True)
+    shards[1].write_text("".join(lines[:-1]), encoding="utf-8")
+
+    with pytest.raises(ValueError, match="is incomplete"):
+        assemble(server_url, shards, tmp_path / "book.epub")
+    assert not (tmp_path / "book.epub").exists()
@@ -0,0 +1,223 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from http import HTTPStatus
+from pathlib import Path
+from typing import cast
+
+import pytest
+from niquests import AsyncSession, HTTPError, Response
+from niquests.structures import CaseInsensitiveDict
+
+from shamela2epub.fetcher import INITIAL_WINDOW, ConnectionBudget, PageFetcher
+from shamela2epub.misc.http_utils import get_retry_after
+from shamela2epub.misc.page_cache import CachePolicy, PageCache
+
+# Requests latency, long enough that its variations don't look like the server slowing down
+LATENCY = 0.01
+
+
+class FakeSession:
+    def __init__(self, pages: dict[int, str], retry_after: str | None = None) -> None:
+        """
+        Session serving pages HTML with an ETag, and 304 responses for unmodified pages.
+        Pages that aren't served are rate limited with a `retry_after` Retry-After header.
+        """
+        self.pages = pages
+        self.retry_after = retry_after
+        self.requests: list[tuple[int, dict[str, str]]] = []
+
+    async def get(self, url: str, headers: dict[str, str] | None = None, **_: object) -> Response:
+        page_number = int(url)
+        self.requests.append((page_number, headers or {}))
+        response = Response()
+        response.url = url
+        response.encoding = "utf-8"
+        if page_number not in self.pages:
+            response.status_code = HTTPStatus.TOO_MANY_REQUESTS
+            response.headers = CaseInsensitiveDict(
+                {"Retry-After": self.retry_after} if self.retry_after else {}
+            )
+            response._content = b""
+            return response
+        html = self.pages[page_number]
+        etag = f'"{hash(html)}"'
+        response.headers = CaseInsensitiveDict({"ETag": etag})
+        if (headers or {}).get("If-None-Match") == etag:
+            response.status_code = HTTPStatus.NOT_MODIFIED
+            response._content = b""
+        else:
+            response.status_code = HTTPStatus.OK
+            response._content = html.encode()
+        return response
+
+
+def get_pages(
+    session: FakeSession, page_cache: PageCache, cache_policy: CachePolicy
+) -> list[tuple[str, bool]]:
+    async def get_pages() -> list[tuple[str, bool]]:
+        fetcher = PageFetcher(
+            cast(AsyncSession, session), str, ConnectionBudget(4), page_cache, cache_policy
+        )
+        return [await fetcher.get_page(page_number) for page_number in (1, 2)]
+
+    return asyncio.run(get_pages())
+
+
+def test_write_policy_downloads_cached_pages(tmp_path: Path) -> None:
+    page_cache = PageCache(tmp_path, "823")
+    page_cache.put(1, "old page 1")
+    session = FakeSession({1: "page 1", 2: "page 2"})
+
+    assert get_pages(session, page_cache, CachePolicy.WRITE) == [
+        ("page 1", False),
+        ("page 2", False),
+    ]
+    assert session.requests == [(1, {}), (2, {})]
+    assert page_cache.get(1) == "page 1"
+
+
+def test_resume_policy_reads_cached_pages(tmp_path: Path) -> None:
+    page_cache = PageCache(tmp_path, "823")
+    page_cache.put(1, "old page 1")
+    session = FakeSession({1: "page 1", 2: "page 2"})
+
+    assert get_pages(session, page_cache, CachePolicy.RESUME) == [
+        ("old page 1", True),
+        ("page 2", False),
+    ]
+    assert session.requests == [(2, {})]
+    assert page_cache.get(2) == "page 2"
+
+
+def test_refresh_policy_downloads_modified_pages(tmp_path: Path) -> None:
+    page_cache = PageCache(tmp_path, "823")
+    session = FakeSession({1: "page 1", 2: "page 2"})
+    get_pages(session, page_cache, CachePolicy.WRITE)
+    session.pages[2] = "new page 2"
+    session.requests.clear()
+
+    assert get_pages(session, page_cache, CachePolicy.REFRESH) == [
+        ("page 1", True),
+        ("new page 2", False),
+    ]
+    assert [headers.get("If-None-Match") for _, headers in session.requests] == [
+        f'"{hash("page 1")}"',
+        f'"{hash("page 2")}"',
+    ]
+    assert page_cache.get(2) == "new page 2"
+    assert page_cache.get_validators(2) == {"ETag": f'"{hash("new page 2")}"'}
+
+
+async def send_requests(
+    budget: ConnectionBudget, requests: int, overloaded: bool = False
+) -> list[float]:
+    """Send requests at the same time, and get their start times."""
+    loop = asyncio.get_running_loop()
+    started_at: list[float] = []
+
+    async def send_request() -> None:
+        async with budget.request() as feedback:
+            started_at.append(loop.time())
+            await asyncio.sleep(LATENCY)
+            if overloaded:
+                feedback.overload()
+
+    await asyncio.gather(*(send_request() for _ in range(requests)))
+    return started_at
+
+
+def test_budget_window_grows_while_latency_is_flat() -> None:
+    async def grow() -> list[int]:
+        budget = ConnectionBudget(16)
+        windows = [budget.window]
+        for _ in range(3):
+            await send_requests(budget, budget.window)
+            windows.append(budget.window)
+        return windows
+
+    assert asyncio.run(grow()) == [INITIAL_WINDOW, 8, 16, 16]
+
+
+def test_budget_window_is_halved_once_per_overloaded_window() -> None:
+    async def overload() -> list[int]:
+        budget = ConnectionBudget(16)
+        await send_requests(budget, 4)
+        await send_requests(budget, 8)
+        windows = [budget.window]
+        for _ in range(5):
+            # Requests sent together overload the server only once
+            await send_requests(budget, budget.window, overloaded=True)
+            windows.append(budget.window)
+        return windows
+
+    assert asyncio.run(overload()) == [16, 8, 4, 2, 1, 1]
+
+
+def test_budget_window_grows_slowly_after_overload() -> None:
+    async def recover() -> list[int]:
+        budget = ConnectionBudget(16)
+        await send_requests(budget, 4)
+        await send_requests(budget, 8, overloaded=True)
+        windows = [budget.window]
+        for _ in range(3):
+            await send_requests(budget, budget.window)
+            windows.append(budget.window)
+        return windows
+
+    # About one more request per window of requests
+    assert asyncio.run(recover()) == [4, 4, 5, 6]
+
+
+def test_budget_timeouts_overload_the_window() -> None:
+    async def time_out() -> int:
+        budget = ConnectionBudget(16)
+        with pytest.raises(TimeoutError):
+            async with budget.request():
+                raise TimeoutError
+        return budget.window
+
+    assert asyncio.run(time_out()) == INITIAL_WINDOW // 2
+
+
+def test_budget_other_errors_keep_the_window() -> None:
+    async def fail() -> int:
+        budget = ConnectionBudget(16)
+        with pytest.raises(HTTPError):
+            async with budget.request():
+                raise HTTPError
+        return budget.window
+
+    assert asyncio.run(fail()) == INITIAL_WINDOW
+
+
+def test_budget_pauses_requests_until_retry_after() -> None:
+    async def pause() -> tuple[int, float]:
+        loop = asyncio.get_running_loop()
+        budget = ConnectionBudget(16)
+        session = FakeSession({}, retry_after="1")
+        fetcher = PageFetcher(cast(AsyncSession, session), str, budget)
+        limited_at = loop.time()
+        with pytest.raises(HTTPError):
+            await fetcher.fetch_page(1)
+        session.pages[2] = "page 2"
+        await fetcher.fetch_page(2)
+        return budget.window, loop.time() - limited_at
+
+    window, paused = asyncio.run(pause())
+    assert window == INITIAL_WINDOW // 2
+    assert paused >= 1
+
+
+def test_retry_after_header_is_parsed() -> None:
+    response = Response()
+    response.headers = CaseInsensitiveDict({"Retry-After": "120"})
+    assert get_retry_after(response) == 120
+    response.headers["Retry-After"] = format_datetime(
+        datetime.now(UTC) + timedelta(seconds=30), usegmt=True
+    )
+    assert 28 <= (get_retry_after(response) or 0) <= 30
+    response.headers["Retry-After"] = format_datetime(datetime.now(UTC), usegmt=True)
+    assert get_retry_after(response) == 0
+    response.headers["Retry-After"] = "soon"
+    assert get_retry_after(response) is None
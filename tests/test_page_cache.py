@@ -0,0 +1,179 @@
+from pathlib import Path
+
+from shamela2epub.misc.page_cache import (
+    CACHE_MAGIC,
+    RECORD_HEADER,
+    RECORD_MARKER,
+    PageCache,
+    RecordKind,
+    lock_file,
+)
+
+
+def read_records(path: Path) -> list[tuple[int, RecordKind]]:
+    """Get the page number and kind of every record of a pack, in order."""
+    pack = path.read_bytes()
+    assert pack.startswith(CACHE_MAGIC)
+    records = []
+    offset = len(CACHE_MAGIC)
+    while offset < len(pack):
+        marker, page_number, kind, meta_length, length = RECORD_HEADER.unpack_from(pack, offset)
+        assert marker == RECORD_MARKER
+        records.append((page_number, RecordKind(kind)))
+        offset += RECORD_HEADER.size + meta_length + length
+    assert offset == len(pack)
+    return records
+
+
+def test_pages_are_kept_after_closing(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    cache.put(1, "<p>page 1</p>", {"ETag": '"1"'})
+    cache.put(2, "<p>page 2</p>")
+    cache.put_parsed(2, '{"page": 2}')
+    cache.close()
+
+    cache = PageCache(tmp_path, "823")
+    assert len(cache) == 2
+    assert 1 in cache
+    assert 3 not in cache
+    assert cache.get(1) == "<p>page 1</p>"
+    assert cache.get_validators(1) == {"ETag": '"1"'}
+    assert cache.get_validators(2) == {}
+    assert cache.get_parsed(2) == '{"page": 2}'
+    assert cache.get_parsed(1) is None
+    cache.close()
+    assert read_records(cache.path) == [
+        (1, RecordKind.HTML),
+        (2, RecordKind.HTML),
+        (2, RecordKind.PARSED),
+    ]
+
+
+def test_new_page_html_outdates_parsed_page(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    cache.put(1, "old")
+    cache.put_parsed(1, "parsed old")
+    cache.put(1, "new")
+    cache.close()
+
+    cache = PageCache(tmp_path, "823")
+    assert cache.get(1) == "new"
+    assert cache.get_parsed(1) is None
+    cache.close()
+
+
+def test_outdated_records_are_compacted(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    for version in range(4):
+        for page_number in range(1, 11):
+            cache.put(page_number, f"page {page_number} version {version}")
+    cache.close()
+
+    assert read_records(cache.path) == [(page, RecordKind.HTML) for page in range(1, 11)]
+    cache = PageCache(tmp_path, "823")
+    assert cache.get(10) == "page 10 version 3"
+    cache.close()
+
+
+def test_few_outdated_records_are_kept(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    for page_number in range(1, 11):
+        cache.put(page_number, f"page {page_number}")
+    cache.put(1, "page 1 again")
+    cache.close()
+
+    assert len(read_records(cache.path)) == 11
+
+
+def test_record_cut_short_is_truncated(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    cache.put(1, "page 1")
+    cache.put(2, "page 2")
+    cache.close()
+    complete_size = cache.path.stat().st_size
+    with cache.path.open("ab") as pack:
+        pack.write(RECORD_HEADER.pack(RECORD_MARKER, 3, RecordKind.HTML, 0, 100) + b"cut")
+
+    cache = PageCache(tmp_path, "823")
+    assert len(cache) == 2
+    assert cache.path.stat().st_size == complete_size
+    assert cache.get(2) == "page 2"
+    cache.close()
+
+
+def test_records_after_corrupt_ones_are_kept(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    cache.put(1, "page 1")
+    cache.close()
+    first_record_end = cache.path.stat().st_size
+    cache = PageCache(tmp_path, "823")
+    cache.put(2, "page 2")
+    cache.close()
+    pack = cache.path.read_bytes()
+    cache.path.write_bytes(pack[:first_record_end] + b"junk" + pack[first_record_end:])
+
+    cache = PageCache(tmp_path, "823")
+    assert cache.get(1) == "page 1"
+    assert cache.get(2) == "page 2"
+    cache.close()
+    assert read_records(cache.path) == [(1, RecordKind.HTML), (2, RecordKind.HTML)]
+
+
+def test_packs_of_other_versions_are_discarded(tmp_path: Path) -> None:
+    (tmp_path / "823.pack").write_bytes(b"S2EPC2\n" + b"\x00" * 64)
+
+    cache = PageCache(tmp_path, "823")
+    assert len(cache) == 0
+    cache.put(1, "page 1")
+    cache.close()
+    assert read_records(cache.path) == [(1, RecordKind.HTML)]
+
+
+def test_pack_is_shared_by_open_caches(tmp_path: Path) -> None:
+    cache = PageCache(tmp_path, "823")
+    other_cache = PageCache(tmp_path, "823")
+    cache.put(1, "page 1")
+    other_cache.put(2, "page 2")
+    cache.put(3, "page 3")
+    other_cache.close()
+    cache.close()
+
+    assert read_records(cache.path) == [(page, RecordKind.HTML) for page in (1, 2, 3)]
+
+
+def test_eviction_skips_open_packs(tmp_path: Path) -> None:
+    open_cache = PageCache(tmp_path, "1", max_size=1)
+    open_cache.put(1, "page 1")
+    old_cache = PageCache(tmp_path, "2", max_size=1)
+    old_cache.put(1, "page 1")
+    old_cache.close()
+    cache = PageCache(tmp_path, "3", max_size=1)
+    cache.put(1, "page 1")
+    cache.close()
+
+    assert open_cache.path.exists()
+    assert not old_cache.path.exists()
+    assert cache.path.exists()
+    open_cache.put(2, "page 2")
+    open_cache.close()
+    assert not cache.path.exists()
+    open_cache = PageCache(tmp_path, "1")
+    assert open_cache.get(2) == "page 2"
+    open_cache.close()
+
+
+def test_eviction_skips_packs_being_written(tmp_path: Path) -> None:
+    old_cache = PageCache(tmp_path, "1", max_size=1)
+    old_cache.put(1, "page 1")
+    old_cache.close()
+
+    with old_cache.lock_path.open("a+b") as lock:
+        lock_file(lock)
+        cache = PageCache(tmp_path, "2", max_size=1)
+        cache.put(1, "page 1")
+        cache.close()
+        assert old_cache.path.exists()
+    cache = PageCache(tmp_path, "2", max_size=1)
+    cache.close()
+    assert not old_cache.path.exists()
+    assert not old_cache.lock_path.exists()
@@ -0,0 +1,48 @@
+from collections.abc import Iterator
+
+import pytest
+
+from benchmarks.server import BOOK_ID, ShamelaStandIn
+from shamela2epub.models.book_html_page import BookHTMLPage
+from shamela2epub.models.page_selection import PageSelection
+
+
+@pytest.fixture(scope="module")
+def first_page() -> Iterator[BookHTMLPage]:
+    """First page of a 300 pages book in two parts, starting at pages 1 and 141."""
+    server = ShamelaStandIn(300)
+    yield BookHTMLPage(f"https://shamela.ws/book/{BOOK_ID}/1", server.render_page(1).decode())
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    ("selection", "pages"),
+    [
+        (PageSelection(), range(1, 301)),
+        (PageSelection(range(10, 21)), range(10, 21)),
+        (PageSelection(range(290, 400)), range(290, 301)),
+        (PageSelection(part="٢"), range(141, 301)),
+        (PageSelection(part="1"), range(1, 141)),
+        (PageSelection(range(100, 200), part="1"), range(100, 141)),
+        (PageSelection(chapter="الباب ١"), range(1, 8)),
+        (PageSelection(chapter="فصل ١ من الباب ١"), range(2, 3)),
+        (PageSelection(chapter="الباب ٤٠"), range(274, 301)),
+        (PageSelection(part="٢", chapter="الباب ٢١"), range(141, 148)),
+    ],
+)
+def test_selected_pages(first_page: BookHTMLPage, selection: PageSelection, pages: range) -> None:
+    assert selection.resolve(first_page) == pages
+
+
+@pytest.mark.parametrize(
+    ("selection", "error"),
+    [
+        (PageSelection(part="3"), "The book has no part 3, its parts are: ١, ٢"),
+        (PageSelection(chapter="الباب ٩٩"), "The book has no chapter الباب ٩٩"),
+        (PageSelection(range(400, 500)), "No pages are selected, the book has 300 pages"),
+        (PageSelection(part="1", chapter="الباب ٢١"), "No pages are selected"),
+    ],
+)
+def test_selection_errors(first_page: BookHTMLPage, selection: PageSelection, error: str) -> None:
+    with pytest.raises(ValueError, match=error):
+        selection.resolve(first_page)